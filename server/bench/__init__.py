@@ -0,0 +1,11 @@
+"""
+性能基准测试
+
+在 server 目录下运行：
+
+    python -m bench all --output bench-results.json
+    python -m bench micro --quick --baseline bench-baseline.json
+
+micro 直接调用分析器/生成器函数并覆盖多个输入规模；http 在进程内通过 ASGI 压测
+server/main.py 与 server/src/main.py 的各个接口。结果写为 JSON，可与保存的基线对比。
+"""
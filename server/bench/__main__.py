@@ -0,0 +1,108 @@
+"""
+命令行入口：python -m bench {micro,http,all} [选项]
+"""
+
+import os
+import sys
+import json
+import argparse
+import shutil
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from typing import Any, Dict
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Solarpunk Smart City 性能基准")
+    parser.add_argument("suite", nargs="?", choices=["micro", "http", "all"], default="all")
+    parser.add_argument("--output", "-o", default="bench-results.json", help="结果 JSON 路径")
+    parser.add_argument("--baseline", "-b", help="与之对比的基线 JSON")
+    parser.add_argument("--threshold", type=float, default=0.10, help="判定回退的相对变化阈值")
+    parser.add_argument("--quick", action="store_true", help="缩小输入规模，快速冒烟")
+    parser.add_argument("--repeat", type=int, default=5, help="微基准每个用例的重复次数")
+    parser.add_argument("--concurrency", default="1,8,32", help="HTTP 压测并发度，逗号分隔")
+    parser.add_argument("--requests", type=int, default=200, help="HTTP 压测每个并发度的请求数")
+    parser.add_argument("--app", choices=["server", "src", "both"], default="both", help="HTTP 压测的应用")
+    parser.add_argument("--only", default="", help="只运行名称包含该子串的用例")
+    parser.add_argument("--db", help="压测写入的数据库路径（默认在临时目录中新建，结束后删除）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    # 压测写入临时数据库，必须在导入 main 之前设置；不沿用环境中的 SMART_CITY_DB，避免写入正式数据库
+    scratch = tempfile.mkdtemp(prefix="smart-city-bench-")
+    os.environ["SMART_CITY_DB"] = os.path.abspath(args.db) if args.db else os.path.join(scratch, "bench.db")
+    os.environ["SMART_CITY_CACHE_DIR"] = os.path.join(scratch, "cache")
+    try:
+        return _run(args)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _run(args: argparse.Namespace) -> int:
+    server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if server_dir not in sys.path:
+        sys.path.insert(0, server_dir)
+
+    import numpy as np
+    from . import micro, http_load
+    from .stats import compare, process_peak_rss_mb
+
+    results: Dict[str, Any] = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "executor": os.getenv("SMART_CITY_EXECUTOR", "thread"),
+            "quick": args.quick,
+        },
+        "micro": [],
+        "http": [],
+    }
+
+    if args.suite in ("micro", "all"):
+        print("== 微基准 ==")
+        results["micro"] = micro.run(quick=args.quick, repeat=max(1, args.repeat), only=args.only)
+    if args.suite in ("http", "all"):
+        print("== HTTP 压测 ==")
+        concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+        apps = ("server", "src") if args.app == "both" else (args.app,)
+        results["http"] = http_load.run(concurrency, max(1, args.requests), args.quick, apps, args.only)
+
+    # 整个进程的峰值内存只在增长时变化，放在 meta 中，各用例的内存见 peak_rss_mb / rss_growth_mb
+    results["meta"]["process_peak_rss_mb"] = process_peak_rss_mb()
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        results["comparison"] = compare(results, baseline, args.threshold)
+        print(f"== 与基线对比 ({args.baseline}) ==")
+        for row in results["comparison"]:
+            print(f"  {row['verdict']:<11} {row['key']}: p50 {row['p50_ms'][0]} -> {row['p50_ms'][1]} ms "
+                  f"({row['latency_change']:+.1%}), 吞吐 {row['throughput_change']:+.1%}")
+        regressions = [row for row in results["comparison"] if row["verdict"] == "regression"]
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+进程内 HTTP 压测：通过 ASGI 直接调用应用（不经过网络），按给定并发度压测各接口
+"""
+
+import json
+import time
+import asyncio
+import contextlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from .stats import RssSampler, summarize
+
+# (名称, 方法, 路径, 请求参数)
+Endpoint = Tuple[str, str, str, Dict[str, Any]]
+
+
+def _ndjson(rows: int) -> bytes:
+    line = json.dumps({"vehicle_count": 1200, "avg_speed": 35.0, "signal_cycle": 90})
+    return ("\n".join([line] * rows) + "\n").encode()
+
+
+def server_endpoints(quick: bool) -> List[Endpoint]:
+    batch = 1000 if quick else 10000
+    grid = 50 if quick else 200
+    return [
+        ("traffic.optimize", "POST", "/api/traffic/optimize",
+         {"json": {"vehicle_count": 1200, "avg_speed": 35.0, "signal_cycle": 90}}),
+        ("traffic.optimize.batch", "POST", "/api/traffic/optimize/batch",
+         {"json": {"vehicle_count": [1200] * batch, "avg_speed": [35.0] * batch, "signal_cycle": [90] * batch}}),
+        ("traffic.realtime", "GET", "/api/traffic/realtime", {}),
+        ("health.analyze", "POST", "/api/health/analyze",
+         {"json": {"heart_rate": 72, "systolic_bp": 125, "diastolic_bp": 82, "exercise_minutes": 30, "sleep_hours": 7.0}}),
+        ("health.analyze.batch", "POST", "/api/health/analyze/batch",
+         {"json": {"heart_rate": [72] * batch, "systolic_bp": [125] * batch, "diastolic_bp": [82] * batch,
+                   "exercise_minutes": [30] * batch, "sleep_hours": [7.0] * batch}}),
+        ("health.realtime", "GET", "/api/health/realtime", {}),
+        ("city.generate", "POST", "/api/city/generate",
+         {"json": {"seed": 42, "grid_size": grid, "max_height": 50}}),
+        ("city.generate.binary", "POST", "/api/city/generate?format=binary",
+         {"json": {"seed": 42, "grid_size": grid, "max_height": 50}}),
+        ("city.generate.stream", "POST", "/api/city/generate/stream",
+         {"json": {"seed": 7, "grid_size": grid, "max_height": 50}}),
+        ("blockchain.store", "POST", "/api/blockchain/store",
+         {"json": {"data_content": "bench", "wallet_address": "0x0000000000000000000000000000000000000000"}}),
+        ("blockchain.stats", "GET", "/api/blockchain/stats", {}),
+        ("blockchain.verify.bulk", "POST", "/api/blockchain/verify/bulk",
+         {"json": {"hashes": [f"{i:064x}" for i in range(batch)]}}),
+        ("stats.overview", "GET", "/api/stats/overview", {}),
+        ("traffic.history", "GET", "/api/traffic/history", {}),
+        ("ingest.traffic", "POST", "/api/ingest/traffic",
+         {"content": _ndjson(batch), "headers": {"content-type": "application/x-ndjson"}}),
+    ]
+
+
+def src_endpoints(quick: bool) -> List[Endpoint]:
+    batch = 1000 if quick else 10000
+    intersections = 500 if quick else 5000
+    return [
+        ("healthz", "GET", "/healthz", {}),
+        ("root", "GET", "/", {}),
+        ("traffic.optimize.proportional", "POST", "/api/traffic/optimize",
+         {"json": {"approaches": 4, "demand": [20, 15, 30, 10]}}),
+        ("traffic.optimize.webster", "POST", "/api/traffic/optimize",
+         {"json": {"intersections": intersections, "approaches": 4, "demand": [20, 15, 30, 10], "mode": "webster"}}),
+        ("traffic.optimize.search", "POST", "/api/traffic/optimize",
+         {"json": {"intersections": intersections, "approaches": 4, "demand": [8, 6, 10, 4], "mode": "search",
+                   "time_budget_ms": 100}}),
+        ("health.analyze", "POST", "/api/health/analyze",
+         {"json": {"hr_rest": 72, "sleep_hours": 7.0, "steps": 8000, "age": 40}}),
+        ("health.analyze.batch", "POST", "/api/health/analyze/batch",
+         {"json": {"hr_rest": [72] * batch, "sleep_hours": [7.0] * batch, "steps": [8000] * batch, "age": [40] * batch}}),
+    ]
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """按 ASGI lifespan 协议触发应用的 startup/shutdown 事件"""
+    receive_queue: "asyncio.Queue[Dict[str, str]]" = asyncio.Queue()
+    sent: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    task = asyncio.create_task(app({"type": "lifespan", "asgi": {"version": "3.0"}}, receive_queue.get, sent.put))
+    await receive_queue.put({"type": "lifespan.startup"})
+    message = await sent.get()
+    if message["type"] != "lifespan.startup.complete":
+        raise RuntimeError(f"应用启动失败: {message}")
+    try:
+        yield
+    finally:
+        await receive_queue.put({"type": "lifespan.shutdown"})
+        await sent.get()
+        await task
+
+
+async def _load(client: httpx.AsyncClient, endpoint: Endpoint, concurrency: int,
+                requests: int) -> Dict[str, Any]:
+    name, method, path, kwargs = endpoint
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+    return {"errors": errors, **summarize(latencies, wall_s=wall), **rss.result()}
+
+
+async def _run_app(label: str, app, endpoints: List[Endpoint], concurrency: List[int], requests: int,
+                   only: str, log: Callable[[str], None]) -> List[Dict[str, Any]]:
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with lifespan(app), httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for endpoint in endpoints:
+            name, method, path, _ = endpoint
+            if only and only not in name:
+                continue
+            # 预热一次，排除首次调用的缓存填充与导入开销
+            await client.request(method, path, **endpoint[3])
+            for level in concurrency:
+                result = {"app": label, "name": name, "method": method, "path": path,
+                          "params": {"concurrency": level}, "requests": requests,
+                          **await _load(client, endpoint, level, requests)}
+                results.append(result)
+                log(f"  [{label}] {name} c={level}: p50 {result['p50_ms']} ms, "
+                    f"p99 {result['p99_ms']} ms, {result['throughput']:.0f} req/s, errors {result['errors']}")
+    return results
+
+
+def run(concurrency: Optional[List[int]] = None, requests: int = 200, quick: bool = False,
+        apps: Tuple[str, ...] = ("server", "src"), only: str = "",
+        log: Callable[[str], None] = print) -> List[Dict[str, Any]]:
+    concurrency = concurrency or [1, 8, 32]
+    results: List[Dict[str, Any]] = []
+    if "server" in apps:
+        import main
+        results += asyncio.run(_run_app("server", main.app, server_endpoints(quick), concurrency,
+                                        requests, only, log))
+    if "src" in apps:
+        from src import main as src_main
+        results += asyncio.run(_run_app("src", src_main.app, src_endpoints(quick), concurrency,
+                                        requests, only, log))
+    return results
@@ -0,0 +1,132 @@
+"""
+微基准：直接调用城市生成、交通优化、健康分析、网络信号求解与 SQLite 批量写入
+"""
+
+import os
+import time
+import tempfile
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from .stats import RssSampler, summarize
+
+GRID_SIZES = [10, 50, 100, 250, 500, 1000]
+BATCH_SIZES = [1, 100, 10000, 100000]
+NETWORK_SIZES = [10, 100, 1000, 5000]
+WRITE_SIZES = [100, 1000, 10000, 50000]
+# 超过该规模时逐栋建筑的 JSON 展开过慢，只测数组生成与统计
+BUILDINGS_MAX_GRID = 250
+
+QUICK_GRID_SIZES = [10, 50, 100]
+QUICK_BATCH_SIZES = [1, 100, 10000]
+QUICK_NETWORK_SIZES = [10, 100, 1000]
+QUICK_WRITE_SIZES = [100, 1000]
+
+# (名称, 参数, 被测函数, 每次调用处理的条目数)
+Case = Tuple[str, Dict[str, Any], Callable[[], Any], int]
+
+
+def _city_cases(sizes: List[int]) -> Iterator[Case]:
+    import city_engine
+    from main import CityGenerator
+
+    for grid in sizes:
+        def arrays(grid=grid):
+            city = city_engine.generate_arrays(42, grid, 50)
+            return city_engine.compute_statistics(city)
+        yield "city.generate_arrays", {"grid_size": grid}, arrays, grid * grid
+        if grid <= BUILDINGS_MAX_GRID:
+            yield ("CityGenerator.generate_city_data", {"grid_size": grid},
+                   lambda grid=grid: CityGenerator.generate_city_data(42, grid, 50), grid * grid)
+
+
+def _traffic_cases(sizes: List[int]) -> Iterator[Case]:
+    from main import TrafficOptimizer
+
+    yield "TrafficOptimizer.optimize_signals", {}, lambda: TrafficOptimizer.optimize_signals(1200, 35.0, 90), 1
+    for n in sizes:
+        rng = np.random.default_rng(n)
+        counts = rng.integers(0, 3000, n)
+        speeds = rng.uniform(5, 80, n)
+        cycles = np.full(n, 90)
+        yield ("TrafficOptimizer.optimize_signals_batch", {"size": n},
+               lambda c=counts, s=speeds, y=cycles: TrafficOptimizer.optimize_signals_batch(c, s, y), n)
+
+
+def _health_cases(sizes: List[int]) -> Iterator[Case]:
+    from main import HealthAnalyzer
+
+    yield "HealthAnalyzer.analyze_health", {}, lambda: HealthAnalyzer.analyze_health(72, 125, 82, 30, 7.0), 1
+    for n in sizes:
+        rng = np.random.default_rng(n)
+        columns = (rng.integers(50, 120, n), rng.integers(100, 170, n), rng.integers(60, 110, n),
+                   rng.integers(0, 120, n), rng.uniform(4, 10, n))
+        yield ("HealthAnalyzer.analyze_health_batch", {"size": n},
+               lambda c=columns: HealthAnalyzer.analyze_health_batch(*c), n)
+
+
+def _network_cases(sizes: List[int]) -> Iterator[Case]:
+    from src.traffic_network import solve_network
+
+    for n in sizes:
+        demand = np.random.default_rng(n).integers(0, 40, (n, 4))
+        yield "solve_network", {"intersections": n}, lambda d=demand: solve_network(d), n
+
+
+def _write_cases(sizes: List[int], directory: str) -> Iterator[Case]:
+    from database import WriteBehindQueue, connect
+
+    path = os.path.join(directory, "bench-writes.db")
+    conn = connect(path)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS traffic_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            vehicle_count INTEGER, avg_speed REAL, signal_cycle INTEGER, optimization_score REAL
+        )
+    ''')
+    conn.commit()
+    conn.close()
+    queue = WriteBehindQueue(path)
+    sql = '''
+        INSERT INTO traffic_data (vehicle_count, avg_speed, signal_cycle, optimization_score)
+        VALUES (?, ?, ?, ?)
+    '''
+    queue.start()
+    try:
+        for n in sizes:
+            rows = [(i % 3000, 35.0, 90, 80.0) for i in range(n)]
+            # 经写后队列提交并等待事务完成，与接口写入路径一致
+            yield "sqlite.submit_many", {"rows": n}, lambda r=rows: queue.submit_many(sql, r, wait=True), n
+    finally:
+        queue.stop()
+
+
+def cases(quick: bool, directory: str) -> Iterator[Case]:
+    yield from _city_cases(QUICK_GRID_SIZES if quick else GRID_SIZES)
+    yield from _traffic_cases(QUICK_BATCH_SIZES if quick else BATCH_SIZES)
+    yield from _health_cases(QUICK_BATCH_SIZES if quick else BATCH_SIZES)
+    yield from _network_cases(QUICK_NETWORK_SIZES if quick else NETWORK_SIZES)
+    yield from _write_cases(QUICK_WRITE_SIZES if quick else WRITE_SIZES, directory)
+
+
+def run(quick: bool = False, repeat: int = 5, warmup: int = 1, only: str = "",
+        log: Callable[[str], None] = print) -> List[Dict[str, Any]]:
+    results = []
+    with tempfile.TemporaryDirectory(prefix="smart-city-bench-") as directory:
+        for name, params, func, items in cases(quick, directory):
+            if only and only not in name:
+                continue
+            for _ in range(warmup):
+                func()
+            samples = []
+            with RssSampler() as rss:
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    func()
+                    samples.append(time.perf_counter() - started)
+            result = {"name": name, "params": params, "items": items, **summarize(samples, items), **rss.result()}
+            results.append(result)
+            log(f"  {name} {params}: p50 {result['p50_ms']} ms, {result['throughput']:.0f} items/s")
+    return results
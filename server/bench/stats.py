@@ -0,0 +1,128 @@
+"""
+基准结果统计：分位数、吞吐量、峰值内存与基线对比
+"""
+
+import os
+import sys
+import resource
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+_PAGE_MB = os.sysconf("SC_PAGE_SIZE") / (1024 * 1024) if hasattr(os, "sysconf") else 0.0
+
+
+def process_peak_rss_mb() -> float:
+    """进程迄今为止的峰值常驻内存（MB），只在增长时变化，不能区分各用例"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def current_rss_mb() -> Optional[float]:
+    """当前常驻内存（MB），读取 /proc/self/statm；不支持的平台返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_MB
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RssSampler:
+    """在后台线程中定时采样常驻内存，给出单个用例期间的峰值与相对用例开始时的增长
+
+    短于采样间隔的尖峰可能漏采；不支持 /proc 的平台两项均为 None。
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start_mb: Optional[float] = None
+        self.peak_mb: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is not None and (self.peak_mb is None or rss > self.peak_mb):
+            self.peak_mb = rss
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self) -> "RssSampler":
+        self.start_mb = current_rss_mb()
+        self.peak_mb = self.start_mb
+        if self.start_mb is not None:
+            self._thread = threading.Thread(target=self._loop, name="bench-rss", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sample()
+
+    def result(self) -> Dict[str, Optional[float]]:
+        if self.peak_mb is None:
+            return {"peak_rss_mb": None, "rss_growth_mb": None}
+        return {"peak_rss_mb": round(self.peak_mb, 1), "rss_growth_mb": round(self.peak_mb - self.start_mb, 1)}
+
+
+def summarize(samples_s: List[float], items: int = 1, wall_s: Optional[float] = None) -> Dict[str, Any]:
+    """samples_s: 每次操作的耗时（秒）；items: 每次操作处理的条目数；
+    wall_s: 并发压测的总耗时，给出时按总耗时计算吞吐量，否则按中位数耗时计算"""
+    ms = np.asarray(samples_s, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99]) if ms.size else (0.0, 0.0, 0.0)
+    if wall_s is not None:
+        throughput = ms.size * items / wall_s if wall_s > 0 else 0.0
+    else:
+        throughput = items / (p50 / 1000) if p50 > 0 else 0.0
+    return {
+        "samples": int(ms.size),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(ms.mean()), 3) if ms.size else 0.0,
+        "throughput": round(float(throughput), 1),
+    }
+
+
+def result_key(section: str, result: Dict[str, Any]) -> str:
+    params = ",".join(f"{k}={v}" for k, v in sorted(result.get("params", {}).items()))
+    return f"{section}:{result.get('app', '')}:{result['name']}[{params}]"
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.10) -> List[Dict[str, Any]]:
+    """对比两次运行中同名用例的 p50 与吞吐量，变化超过 threshold 的标记为回退或提升（内存采样不参与判定）"""
+    previous = {
+        result_key(section, result): result
+        for section in ("micro", "http")
+        for result in baseline.get(section, [])
+    }
+    rows = []
+    for section in ("micro", "http"):
+        for result in current.get(section, []):
+            key = result_key(section, result)
+            base = previous.get(key)
+            if base is None or not base.get("p50_ms") or not base.get("throughput"):
+                continue
+            latency_change = result["p50_ms"] / base["p50_ms"] - 1
+            throughput_change = result["throughput"] / base["throughput"] - 1
+            if latency_change > threshold or throughput_change < -threshold:
+                verdict = "regression"
+            elif latency_change < -threshold or throughput_change > threshold:
+                verdict = "improvement"
+            else:
+                verdict = "unchanged"
+            rows.append({
+                "key": key,
+                "p50_ms": [base["p50_ms"], result["p50_ms"]],
+                "throughput": [base["throughput"], result["throughput"]],
+                "latency_change": round(latency_change, 4),
+                "throughput_change": round(throughput_change, 4),
+                "verdict": verdict,
+            })
+    return rows
@@ -0,0 +1,107 @@
+"""
+跨进程变更订阅：多进程部署时，各工作进程的写后队列只能看到自己的写入，
+这里按自增 id 轮询各表的新行，把所有进程提交的记录以与提交回调相同的形式分发给内存聚合
+"""
+
+import os
+import sqlite3
+import threading
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from database import connect
+
+logger = logging.getLogger(__name__)
+
+TAIL_INTERVAL = float(os.getenv("SMART_CITY_TAIL_INTERVAL", "0.2"))
+_TAIL_CHUNK = 5000
+
+Listener = Callable[[str, List[Sequence[Any]]], None]
+
+
+def watermarks(conn: sqlite3.Connection, tables: Iterable[str]) -> Dict[str, int]:
+    """各表当前已分配的最大自增 id（行被归档删除后仍然有效）"""
+    seq = dict(conn.execute("SELECT name, seq FROM sqlite_sequence").fetchall())
+    return {table: int(seq.get(table, 0)) for table in tables}
+
+
+class ChangeTailer:
+    """SQLite 串行化提交，自增 id 按提交顺序递增，因此 id > 水位 的行恰好是水位之后提交的全部记录"""
+
+    def __init__(self, tables: Sequence[str], interval: float = TAIL_INTERVAL, path: Optional[str] = None):
+        self.tables = list(tables)
+        self.interval = max(0.01, interval)
+        self.path = path
+        self.positions: Dict[str, int] = {table: 0 for table in self.tables}
+        self._listeners: List[Listener] = []
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"polls": 0, "rows": 0, "errors": 0}
+
+    def add_listener(self, listener: Listener):
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def start(self, positions: Dict[str, int]):
+        """从给定水位开始订阅（应与内存状态的重建时刻一致）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.positions.update(positions)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="change-tailer", daemon=True)
+        self._thread.start()
+        logger.info(f"变更订阅已启动: 间隔 {self.interval}s, 起始水位 {self.positions}")
+
+    def stop(self, timeout: float = 10.0):
+        """停止轮询，并做最后一次拉取，使本进程停止前的写入都已分发"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        conn = connect(self.path)
+        try:
+            while True:
+                stopping = self._stopping.is_set()
+                try:
+                    self.poll(conn)
+                except sqlite3.Error as e:
+                    self.stats["errors"] += 1
+                    logger.error(f"变更订阅拉取失败: {str(e)}")
+                if stopping:
+                    break
+                self._stopping.wait(self.interval)
+        finally:
+            conn.close()
+
+    def poll(self, conn: sqlite3.Connection) -> int:
+        """拉取各表水位之后的新行并分发，返回行数"""
+        delivered = 0
+        for table in self.tables:
+            while True:
+                cursor = conn.execute(
+                    f"SELECT * FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                    (self.positions[table], _TAIL_CHUNK)
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                names = [column[0] for column in cursor.description]
+                sql = f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})"
+                self._notify(sql, rows)
+                self.positions[table] = rows[-1][names.index("id")]
+                delivered += len(rows)
+                if len(rows) < _TAIL_CHUNK:
+                    break
+        self.stats["polls"] += 1
+        self.stats["rows"] += delivered
+        return delivered
+
+    def _notify(self, sql: str, rows: List[Sequence[Any]]):
+        for listener in self._listeners:
+            try:
+                listener(sql, rows)
+            except Exception as e:
+                logger.error(f"变更订阅回调失败: {str(e)}")
@@ -0,0 +1,121 @@
+"""
+城市数据的紧凑二进制列式格式
+
+布局（小端序）:
+    magic        4 字节  b"SPC1"
+    header_len   uint32  JSON 头部字节数
+    header       JSON（UTF-8），含网格参数、统计信息和各列的 dtype / offset / length
+    padding      补齐到 8 字节边界
+    columns      各列连续存放，每列起始偏移均按 8 字节对齐
+
+x/z 坐标由网格顺序隐含：第 i 个元素对应 x = i // grid_size, z = i % grid_size。
+浏览器端可直接以 offset 为起点创建 TypedArray 视图，无需拷贝。
+"""
+
+import json
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from city_engine import BUILDING_TYPES, CityArrays
+
+MEDIA_TYPE = "application/vnd.solarpunk.city"
+MAGIC = b"SPC1"
+ALIGNMENT = 8
+
+# 列的 dtype 名与浏览器 TypedArray 对应关系见 web/js/api.js
+_JS_TYPES = {
+    "uint8": "Uint8Array",
+    "uint16": "Uint16Array",
+    "int32": "Int32Array",
+    "float32": "Float32Array",
+}
+
+
+def _pad(length: int) -> int:
+    return (-length) % ALIGNMENT
+
+
+def _columns(city: CityArrays) -> List[Tuple[str, np.ndarray]]:
+    height_dtype = np.uint16 if city.max_height <= np.iinfo(np.uint16).max else np.int32
+    return [
+        ("height", city.heights.astype(height_dtype, copy=False).ravel()),
+        ("type", city.types.astype(np.uint8, copy=False).ravel()),
+        ("solar_coverage", city.solar_coverage.astype(np.float32).ravel()),
+        ("energy_production", city.energy_production.astype(np.float32).ravel()),
+    ]
+
+
+def encode(city: CityArrays, statistics: Dict[str, Any], features: Dict[str, Any]) -> bytes:
+    """将城市数组编码为二进制列式负载"""
+    columns = _columns(city)
+
+    # 先计算列偏移（相对于列数据区起点），头部长度确定后再整体平移
+    layout = []
+    cursor = 0
+    for name, data in columns:
+        data = np.ascontiguousarray(data.astype(data.dtype.newbyteorder("<"), copy=False))
+        layout.append((name, data, cursor))
+        cursor += data.nbytes + _pad(data.nbytes)
+
+    def build_header(base: int) -> bytes:
+        header = {
+            "version": 1,
+            "seed": city.seed,
+            "grid_size": city.grid_size,
+            "max_height": city.max_height,
+            "count": city.grid_size * city.grid_size,
+            "order": "x-major",
+            "type_names": BUILDING_TYPES,
+            "statistics": statistics,
+            "sustainable_features": features,
+            "columns": [
+                {
+                    "name": name,
+                    "dtype": data.dtype.name,
+                    "array": _JS_TYPES[data.dtype.name],
+                    "offset": base + offset,
+                    "length": int(data.size),
+                }
+                for name, data, offset in layout
+            ],
+        }
+        return json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    # 偏移写入头部会改变头部长度，迭代直到稳定
+    base = 0
+    while True:
+        header_bytes = build_header(base)
+        prefix = len(MAGIC) + 4 + len(header_bytes)
+        new_base = prefix + _pad(prefix)
+        if new_base == base:
+            break
+        base = new_base
+
+    parts = [MAGIC, struct.pack("<I", len(header_bytes)), header_bytes, b"\0" * _pad(len(MAGIC) + 4 + len(header_bytes))]
+    for _, data, _ in layout:
+        parts.append(data.tobytes())
+        parts.append(b"\0" * _pad(data.nbytes))
+    return b"".join(parts)
+
+
+def decode(payload: bytes) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """解码二进制负载，返回 (头部, 列名 -> 零拷贝数组)"""
+    if payload[:4] != MAGIC:
+        raise ValueError("无效的城市二进制负载")
+    (header_len,) = struct.unpack_from("<I", payload, 4)
+    header = json.loads(payload[8:8 + header_len].decode("utf-8"))
+    columns = {
+        col["name"]: np.frombuffer(payload, dtype=np.dtype(col["dtype"]).newbyteorder("<"),
+                                   count=col["length"], offset=col["offset"])
+        for col in header["columns"]
+    }
+    return header, columns
+
+
+def wants_binary(accept: Optional[str], fmt: Optional[str] = None) -> bool:
+    """内容协商：?format=binary 或 Accept 中包含二进制媒体类型时返回 True，默认 JSON"""
+    if fmt:
+        return fmt.lower() == "binary"
+    return MEDIA_TYPE in (accept or "") or "application/octet-stream" in (accept or "")
@@ -0,0 +1,247 @@
+"""
+生成城市的内容寻址缓存：按字节数限制的 LRU，可选磁盘溢出，并合并并发的相同请求
+"""
+
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+import city_engine
+import city_spatial
+import city_tiles
+import executor
+from city_engine import CityArrays
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_BYTES = int(os.getenv("SMART_CITY_CACHE_BYTES", str(256 * 1024 * 1024)))
+# 为空时不启用磁盘溢出
+CACHE_SPILL_DIR = os.getenv("SMART_CITY_CACHE_DIR", "")
+
+# 生成算法变化时递增，使旧缓存与旧 ETag 失效
+ENGINE_VERSION = 3
+
+CityKey = Tuple[int, int, int]
+
+
+class CachedCity:
+    """缓存条目：城市数组、统计信息及内容摘要；四叉树瓦片与空间索引在首次请求时构建"""
+
+    __slots__ = ("key", "digest", "city", "statistics", "pyramid", "spatial")
+
+    def __init__(self, key: CityKey, digest: str, city: CityArrays, statistics: Dict[str, Any]):
+        self.key = key
+        self.digest = digest
+        self.city = city
+        self.statistics = statistics
+        self.pyramid: Optional[city_tiles.CityPyramid] = None
+        self.spatial: Optional[city_spatial.SpatialIndex] = None
+
+    @property
+    def nbytes(self) -> int:
+        derived = (self.pyramid, self.spatial)
+        return self.city.nbytes + sum(item.nbytes for item in derived if item is not None)
+
+    def etag(self, variant: str) -> str:
+        return city_etag(self.digest, variant)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否匹配 etag：解析逗号分隔的 ETag 列表（弱比较，忽略 W/ 前缀），* 匹配任意"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+
+def city_digest(seed: int, grid_size: int, max_height: int) -> str:
+    raw = f"v{ENGINE_VERSION}:{seed}:{grid_size}:{max_height}".encode()
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+
+def city_etag(digest: str, variant: str) -> str:
+    """ETag 只由参数摘要与响应变体决定，不需要先取得城市即可比较"""
+    return f'"{digest}-{variant}"'
+
+
+def build_city(seed: int, grid_size: int, max_height: int) -> Tuple[CityArrays, Dict[str, Any]]:
+    """生成城市数组及统计（在计算执行器中运行）"""
+    city = city_engine.generate_arrays(seed, grid_size, max_height)
+    return city, city_engine.compute_statistics(city)
+
+
+class CityCache:
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, spill_dir: str = CACHE_SPILL_DIR):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self._entries: "OrderedDict[CityKey, CachedCity]" = OrderedDict()
+        self._inflight: Dict[CityKey, asyncio.Future] = {}
+        self._derived_inflight: Dict[Tuple[CityKey, str], asyncio.Future] = {}
+        self.current_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "disk_hits": 0}
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    async def get(self, seed: int, grid_size: int, max_height: int) -> CachedCity:
+        """获取城市；未命中时只由一个请求负责生成，其余并发请求等待其结果"""
+        key = (seed, grid_size, max_height)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # 负责生成的请求被取消（如客户端断开）时由当前请求重新获取；当前请求自身被取消则照常抛出
+                if not pending.cancelled():
+                    raise
+                return await self.get(seed, grid_size, max_height)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            entry = await self._load(key)
+            self._insert(entry)
+            future.set_result(entry)
+            return entry
+        except Exception as e:
+            future.set_exception(e)
+            # 避免无人等待时出现 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            # 被取消时（CancelledError 不是 Exception）也要结束 future，否则合并等待的请求会一直挂起
+            if not future.done():
+                future.cancel()
+            del self._inflight[key]
+
+    async def get_pyramid(self, entry: CachedCity) -> city_tiles.CityPyramid:
+        """获取城市的四叉树瓦片"""
+        return await self._get_derived(entry, "pyramid", city_tiles.CityPyramid)
+
+    async def get_spatial_index(self, entry: CachedCity) -> city_spatial.SpatialIndex:
+        """获取城市的空间索引"""
+        return await self._get_derived(entry, "spatial", city_spatial.SpatialIndex)
+
+    async def _get_derived(self, entry: CachedCity, attr: str, build: Callable[[CityArrays], Any]) -> Any:
+        """按需构建由城市数组派生的结构；并发的首次请求只构建一次，构建后计入缓存占用"""
+        existing = getattr(entry, attr)
+        if existing is not None:
+            return existing
+        inflight_key = (entry.key, attr)
+        pending = self._derived_inflight.get(inflight_key)
+        if pending is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                return await self._get_derived(entry, attr, build)
+
+        future = asyncio.get_running_loop().create_future()
+        self._derived_inflight[inflight_key] = future
+        try:
+            derived = await executor.run_cpu(build, entry.city)
+            setattr(entry, attr, derived)
+            if self._entries.get(entry.key) is entry:
+                self.current_bytes += derived.nbytes
+                self._evict()
+            future.set_result(derived)
+            return derived
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._derived_inflight[inflight_key]
+
+    async def _load(self, key: CityKey) -> CachedCity:
+        digest = city_digest(*key)
+        if self.spill_dir:
+            spilled = await executor.run_io(self._read_spill, key, digest)
+            if spilled is not None:
+                self.stats["disk_hits"] += 1
+                return spilled
+        self.stats["misses"] += 1
+        city, statistics = await executor.run_cpu(build_city, *key)
+        return CachedCity(key, digest, city, statistics)
+
+    def _insert(self, entry: CachedCity):
+        if entry.nbytes > self.max_bytes:
+            # 超过整个缓存容量的城市不驻留内存
+            self._spill_async(entry)
+            return
+        self._entries[entry.key] = entry
+        self.current_bytes += entry.nbytes
+        self._evict()
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+            self.stats["evictions"] += 1
+            self._spill_async(evicted)
+
+    # ==================== 磁盘溢出 ====================
+
+    def _spill_path(self, digest: str) -> str:
+        return os.path.join(self.spill_dir, f"{digest}.npz")
+
+    def _spill_async(self, entry: CachedCity):
+        """在 IO 线程中写盘，不阻塞事件循环"""
+        if self.spill_dir:
+            executor.get_io_executor().submit(self._spill, entry)
+
+    def _spill(self, entry: CachedCity):
+        if not self.spill_dir:
+            return
+        path = self._spill_path(entry.digest)
+        if os.path.exists(path):
+            return
+        try:
+            city = entry.city
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, heights=city.heights, types=city.types,
+                         solar_coverage=city.solar_coverage, energy_production=city.energy_production)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"城市缓存溢出写入失败: {str(e)}")
+
+    def _read_spill(self, key: CityKey, digest: str) -> Optional[CachedCity]:
+        path = self._spill_path(digest)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                city = CityArrays(key[0], key[1], key[2], data["heights"], data["types"],
+                                  data["solar_coverage"], data["energy_production"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"城市缓存溢出读取失败: {str(e)}")
+            return None
+        return CachedCity(key, digest, city, city_engine.compute_statistics(city))
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+
+cache = CityCache()
@@ -0,0 +1,227 @@
+"""
+基于 NumPy 数组的城市生成引擎：整网格一次性采样，统计量通过数组归约计算
+"""
+
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+BUILDING_TYPES = ['residential', 'commercial', 'industrial', 'green']
+BUILDING_TYPE_PROBS = [0.4, 0.3, 0.2, 0.1]
+GREEN = BUILDING_TYPES.index('green')
+_TYPE_NAMES = np.array(BUILDING_TYPES, dtype=object)
+
+# 每个随机数子流覆盖的行数：第 i 段行由 SeedSequence(seed).spawn 的第 i 个子生成器整块抽取。
+# 修改它会改变生成结果（需同时递增 city_cache.ENGINE_VERSION）
+SEED_BLOCK_ROWS = 64
+# 整城生成时每次处理的行数（仅影响内存分块，不影响生成结果）
+ROWS_PER_BLOCK = SEED_BLOCK_ROWS
+
+
+class CityArrays:
+    """按列存储的城市数据，所有数组形状为 (grid_size, grid_size)，下标为 [x, z]"""
+
+    __slots__ = ("seed", "grid_size", "max_height", "heights", "types", "solar_coverage", "energy_production")
+
+    def __init__(self, seed: int, grid_size: int, max_height: int,
+                 heights: np.ndarray, types: np.ndarray,
+                 solar_coverage: np.ndarray, energy_production: np.ndarray):
+        self.seed = seed
+        self.grid_size = grid_size
+        self.max_height = max_height
+        self.heights = heights
+        self.types = types
+        self.solar_coverage = solar_coverage
+        self.energy_production = energy_production
+
+    @property
+    def nbytes(self) -> int:
+        return (self.heights.nbytes + self.types.nbytes
+                + self.solar_coverage.nbytes + self.energy_production.nbytes)
+
+
+class CityBlock:
+    """城市中的一个矩形区块（行带或瓦片），x0/z0 为左上角网格坐标"""
+
+    __slots__ = ("x0", "z0", "heights", "types", "solar_coverage", "energy_production")
+
+    def __init__(self, x0: int, z0: int, heights: np.ndarray, types: np.ndarray,
+                 solar_coverage: np.ndarray, energy_production: np.ndarray):
+        self.x0 = x0
+        self.z0 = z0
+        self.heights = heights
+        self.types = types
+        self.solar_coverage = solar_coverage
+        self.energy_production = energy_production
+
+    def sub_block(self, z_start: int, z_stop: int) -> "CityBlock":
+        return CityBlock(self.x0, self.z0 + z_start,
+                         self.heights[:, z_start:z_stop], self.types[:, z_start:z_stop],
+                         self.solar_coverage[:, z_start:z_stop], self.energy_production[:, z_start:z_stop])
+
+
+def _seed_blocks(seed: int, grid_size: int, max_height: int) -> Iterator[CityBlock]:
+    """按 SEED_BLOCK_ROWS 行一段生成城市，每个字段整段一次抽取"""
+    children = np.random.SeedSequence(seed).spawn((grid_size + SEED_BLOCK_ROWS - 1) // SEED_BLOCK_ROWS)
+    for child, x0 in zip(children, range(0, grid_size, SEED_BLOCK_ROWS)):
+        rng = np.random.default_rng(child)
+        shape = (min(SEED_BLOCK_ROWS, grid_size - x0), grid_size)
+        heights = rng.integers(2, max_height + 1, size=shape, dtype=np.int32)
+        types = rng.choice(len(BUILDING_TYPES), size=shape, p=BUILDING_TYPE_PROBS).astype(np.uint8)
+        solar = rng.uniform(0.3, 0.9, size=shape)
+        solar[types == GREEN] = 0.0
+
+        # 能源产出基于未取整的覆盖率，与逐栋计算保持一致
+        energy = heights * solar * 10
+        yield CityBlock(x0, 0, heights, types, np.round(solar, 2), energy)
+
+
+def iter_row_blocks(seed: int, grid_size: int, max_height: int, rows_per_block: int = 1) -> Iterator[CityBlock]:
+    """逐行生成城市，每次产出 rows_per_block 行
+
+    随机数按固定的 SEED_BLOCK_ROWS 行一段抽取，与 rows_per_block 无关，因此无论分块大小如何，
+    同一种子生成的城市完全一致；每次调用使用独立的随机数生成器，线程安全。
+    """
+    rows_per_block = max(1, rows_per_block)
+    pending: List[CityBlock] = []
+    buffered = 0
+    for segment in _seed_blocks(seed, grid_size, max_height):
+        pending.append(segment)
+        buffered += segment.heights.shape[0]
+        is_last = segment.x0 + segment.heights.shape[0] >= grid_size
+        while buffered >= rows_per_block or (is_last and buffered):
+            block = _take_rows(pending, min(rows_per_block, buffered))
+            buffered -= block.heights.shape[0]
+            yield block
+
+
+def _take_rows(pending: List[CityBlock], rows: int) -> CityBlock:
+    """从缓存的段中取出前 rows 行（跨段时拼接），剩余部分留在 pending 中"""
+    parts: List[CityBlock] = []
+    while rows > 0:
+        head = pending[0]
+        count = head.heights.shape[0]
+        if count <= rows:
+            parts.append(pending.pop(0))
+            rows -= count
+            continue
+        parts.append(CityBlock(head.x0, 0, head.heights[:rows], head.types[:rows],
+                               head.solar_coverage[:rows], head.energy_production[:rows]))
+        pending[0] = CityBlock(head.x0 + rows, 0, head.heights[rows:], head.types[rows:],
+                               head.solar_coverage[rows:], head.energy_production[rows:])
+        rows = 0
+    if len(parts) == 1:
+        return parts[0]
+    return CityBlock(parts[0].x0, 0, *(np.concatenate([getattr(p, name) for p in parts])
+                                       for name in ("heights", "types", "solar_coverage", "energy_production")))
+
+
+def iter_tiles(seed: int, grid_size: int, max_height: int, tile_size: Optional[int] = None) -> Iterator[CityBlock]:
+    """按瓦片产出城市；tile_size 为空时每次产出完整的一行"""
+    if not tile_size:
+        yield from iter_row_blocks(seed, grid_size, max_height, 1)
+        return
+    for band in iter_row_blocks(seed, grid_size, max_height, tile_size):
+        for z0 in range(0, grid_size, tile_size):
+            yield band.sub_block(z0, min(z0 + tile_size, grid_size))
+
+
+def generate_arrays(seed: int, grid_size: int, max_height: int) -> CityArrays:
+    """为整个网格生成高度、类型和太阳能覆盖率"""
+    shape = (grid_size, grid_size)
+    heights = np.empty(shape, dtype=np.int32)
+    types = np.empty(shape, dtype=np.uint8)
+    solar = np.empty(shape, dtype=np.float64)
+    energy = np.empty(shape, dtype=np.float64)
+
+    for block in iter_row_blocks(seed, grid_size, max_height, ROWS_PER_BLOCK):
+        rows = slice(block.x0, block.x0 + block.heights.shape[0])
+        heights[rows] = block.heights
+        types[rows] = block.types
+        solar[rows] = block.solar_coverage
+        energy[rows] = block.energy_production
+    return CityArrays(seed, grid_size, max_height, heights, types, solar, energy)
+
+
+class StatisticsAccumulator:
+    """可增量累加的统计量，用于整城计算与流式生成的结尾统计"""
+
+    def __init__(self):
+        self.total_buildings = 0
+        self.green_spaces = 0
+        self.built_count = 0
+        self.solar_sum = 0.0
+        self.total_energy = 0.0
+
+    def update(self, types: np.ndarray, solar_coverage: np.ndarray, energy_production: np.ndarray):
+        green_mask = types == GREEN
+        green = int(np.count_nonzero(green_mask))
+        self.total_buildings += int(types.size)
+        self.green_spaces += green
+        self.built_count += int(types.size) - green
+        # 绿地覆盖率为 0，直接求和即为非绿地建筑覆盖率之和
+        self.solar_sum += float(solar_coverage.sum())
+        self.total_energy += float(energy_production.sum())
+
+    def result(self) -> Dict[str, Any]:
+        total_buildings = self.total_buildings
+        green_ratio = self.green_spaces / total_buildings if total_buildings else 0.0
+        avg_solar_coverage = self.solar_sum / self.built_count if self.built_count else 0.0
+
+        sustainability_score = (green_ratio * 40 + avg_solar_coverage * 60)
+
+        return {
+            "total_buildings": total_buildings,
+            "green_spaces": self.green_spaces,
+            "green_ratio": round(green_ratio * 100, 1),
+            "total_energy_production": round(self.total_energy, 1),
+            "avg_solar_coverage": round(avg_solar_coverage * 100, 1),
+            "sustainability_score": round(sustainability_score, 1)
+        }
+
+
+def compute_statistics(city: CityArrays) -> Dict[str, Any]:
+    """通过数组归约计算可持续性统计"""
+    stats = StatisticsAccumulator()
+    stats.update(city.types, city.solar_coverage, city.energy_production)
+    return stats.result()
+
+
+def sustainable_features(statistics: Dict[str, Any]) -> Dict[str, Any]:
+    """根据统计结果生成可持续性特征描述"""
+    sustainability_score = statistics["sustainability_score"]
+    return {
+        "solar_panels": f"{statistics['avg_solar_coverage']}% 建筑覆盖",
+        "green_buildings": f"{statistics['green_spaces']} 个生态建筑",
+        "energy_efficiency": "A级" if sustainability_score > 70 else "B级",
+        "carbon_neutral": bool(sustainability_score > 80)
+    }
+
+
+def block_to_buildings(block: CityBlock) -> List[Dict[str, Any]]:
+    """将一个区块展开为逐栋建筑字典（x 优先顺序，与整城输出一致）"""
+    rows, cols = block.heights.shape
+    xs = np.repeat(np.arange(block.x0, block.x0 + rows), cols).tolist()
+    zs = np.tile(np.arange(block.z0, block.z0 + cols), rows).tolist()
+    heights = block.heights.ravel().tolist()
+    types = _TYPE_NAMES[block.types.ravel()].tolist()
+    solar = block.solar_coverage.ravel().tolist()
+    energy = np.round(block.energy_production.ravel(), 1).tolist()
+
+    return [
+        {
+            "x": x,
+            "z": z,
+            "height": h,
+            "type": t,
+            "solar_coverage": s,
+            "energy_production": e
+        }
+        for x, z, h, t, s, e in zip(xs, zs, heights, types, solar, energy)
+    ]
+
+
+def to_buildings(city: CityArrays) -> List[Dict[str, Any]]:
+    """仅在客户端需要时展开为逐栋建筑字典"""
+    return block_to_buildings(CityBlock(0, 0, city.heights, city.types,
+                                        city.solar_coverage, city.energy_production))
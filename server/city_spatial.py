@@ -0,0 +1,288 @@
+"""
+城市空间索引：每座缓存城市构建一次，支持半径内汇总、最近绿地与多边形范围查询
+
+建筑位于整数网格点 (x, z)。索引由两部分组成：
+- 沿 z 方向的逐行前缀和（能源产出、各类型数量），任意一行上的连续区间求和为 O(1)，
+  因此半径为 r 的圆只需 O(r) 次查表，多边形按扫描线逐行求和
+- 每个网格点到最近绿地的特征变换（最近绿地的位置），单点查询为 O(1)
+"""
+
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from city_engine import BUILDING_TYPES, GREEN, CityArrays, _TYPE_NAMES
+
+MAX_BATCH_POINTS = 10000
+MAX_POLYGONS = 100
+MAX_POLYGON_VERTICES = 1000
+MAX_LISTED_BUILDINGS = 10000
+# 批量半径查询每次处理的 (点数 x 行数) 上限，限制临时数组大小
+_RADIUS_CHUNK = 1 << 20
+
+
+def _row_prefix(values: np.ndarray, dtype) -> np.ndarray:
+    """沿 z 方向的前缀和，形状为 (rows, cols + 1)，首列为 0"""
+    prefix = np.zeros((values.shape[0], values.shape[1] + 1), dtype=dtype)
+    np.cumsum(values, axis=1, dtype=dtype, out=prefix[:, 1:])
+    return prefix
+
+
+def nearest_feature(mask: np.ndarray) -> np.ndarray:
+    """精确欧氏特征变换：每个网格点最近的 mask 点的展平下标，mask 为空时全为 -1
+
+    先沿 z 求每行内的最近点，再沿 x 逐步扩大搜索距离 d，只保留当前最优距离仍大于 (d+1)^2 的点；
+    耗时约为 O(N^2 * D)，D 为最远的最近距离（生成器中绿地占 10%，D 很小）。
+    """
+    rows, cols = mask.shape
+    if not mask.any():
+        return np.full(mask.shape, -1, dtype=np.int64)
+
+    # 第一遍：行内最近点（左右两侧取较近者，相等时取左侧）
+    z = np.arange(cols)
+    left = np.maximum.accumulate(np.where(mask, z, -1), axis=1)
+    right = np.minimum.accumulate(np.where(mask, z, cols)[:, ::-1], axis=1)[:, ::-1]
+    left_d = np.where(left >= 0, z - left, cols * 2)
+    right_d = np.where(right < cols, right - z, cols * 2)
+    row_z = np.where(left_d <= right_d, left, right)
+    row_d = np.minimum(left_d, right_d).astype(np.int64)
+    # 无绿地的行距离视为无穷大
+    unreachable = (rows + cols) ** 2 + 1
+    row_d2 = np.where(row_d < cols * 2, row_d * row_d, unreachable)
+
+    # 第二遍：在其他行中寻找更近的点
+    best = row_d2.ravel().copy()
+    best_x = np.repeat(np.arange(rows), cols)
+    active = np.flatnonzero(best > 1)
+    d = 1
+    while active.size and d < rows:
+        ax, az = np.divmod(active, cols)
+        for other in (ax - d, ax + d):
+            ok = (other >= 0) & (other < rows)
+            candidate = np.full(active.shape, unreachable, dtype=np.int64)
+            candidate[ok] = d * d + row_d2[other[ok], az[ok]]
+            better = candidate < best[active]
+            best[active[better]] = candidate[better]
+            best_x[active[better]] = other[better]
+        d += 1
+        active = active[best[active] > d * d]
+
+    best_z = row_z[best_x, np.tile(z, rows)]
+    return (best_x * cols + best_z).reshape(mask.shape)
+
+
+class SpatialIndex:
+    """一座城市的空间索引，只读；查询方法可在多个线程中并发调用"""
+
+    def __init__(self, city: CityArrays):
+        self.grid_size = city.grid_size
+        count_dtype = np.uint16 if city.grid_size < 1 << 16 else np.uint32
+        self._energy = _row_prefix(city.energy_production, np.float64)
+        self._types = np.stack([_row_prefix(city.types == t, count_dtype) for t in range(len(BUILDING_TYPES))])
+        flat_dtype = np.int32 if city.grid_size * city.grid_size < 1 << 31 else np.int64
+        self._nearest_green = nearest_feature(city.types == GREEN).astype(flat_dtype)
+        self.has_green = bool(self._nearest_green.size) and self._nearest_green.flat[0] >= 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._energy.nbytes + self._types.nbytes + self._nearest_green.nbytes
+
+    def _sum_intervals(self, xs: np.ndarray, z0: np.ndarray, z1: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """对若干行区间 [z0, z1]（含两端，z0 > z1 表示空区间）求能源产出与各类型数量，返回按最后一维求和前的数组"""
+        empty = z0 > z1
+        z0 = np.where(empty, 0, z0)
+        z1 = np.where(empty, -1, z1) + 1
+        energy = self._energy[xs, z1] - self._energy[xs, z0]
+        counts = self._types[:, xs, z1].astype(np.int64) - self._types[:, xs, z0]
+        energy[empty] = 0.0
+        counts[:, empty] = 0
+        return energy, counts
+
+    def _summary(self, energy: np.ndarray, counts: np.ndarray) -> Dict[str, Any]:
+        """energy 形状 (Q,)，counts 形状 (类型数, Q)，返回列式结果"""
+        return {
+            "count": counts.sum(axis=0).tolist(),
+            "energy_production": np.round(energy, 1).tolist(),
+            "by_type": {name: counts[t].tolist() for t, name in enumerate(BUILDING_TYPES)},
+        }
+
+    def radius(self, points: np.ndarray, radii: np.ndarray) -> Dict[str, Any]:
+        """每个点 (x, z) 半径 radii 内（含边界）的建筑数、能源产出与各类型数量，每个点只查 O(r) 行"""
+        n = self.grid_size
+        # 超过城市对角线的半径等价于覆盖整座城市
+        radii = np.minimum(radii, 2.0 * n)
+        spans = 2 * np.ceil(radii).astype(np.int64) + 2
+        total_energy = np.zeros(len(points))
+        total_counts = np.zeros((len(BUILDING_TYPES), len(points)), dtype=np.int64)
+        # 按半径排序后分块，使同一块内的行数相近，且临时数组不超过 _RADIUS_CHUNK
+        order = np.argsort(radii, kind="stable")
+        start = 0
+        while start < len(order):
+            stop = start + 1
+            while stop < len(order) and (stop - start + 1) * spans[order[stop]] <= _RADIUS_CHUNK:
+                stop += 1
+            chunk = order[start:stop]
+            span = int(spans[chunk[-1]])
+            px, pz, r = points[chunk, 0:1], points[chunk, 1:2], radii[chunk, None]
+            xs = np.floor(px - r).astype(np.int64) + np.arange(span)
+            remaining = r * r - (xs - px) ** 2
+            valid = (remaining >= 0) & (xs >= 0) & (xs < n)
+            half = np.sqrt(np.where(valid, remaining, 0.0)) + 1e-9
+            z0 = np.maximum(np.ceil(pz - half), 0).astype(np.int64)
+            z1 = np.minimum(np.floor(pz + half), n - 1).astype(np.int64)
+            z0 = np.where(valid, z0, 1)
+            z1 = np.where(valid, z1, 0)
+            energy, counts = self._sum_intervals(np.clip(xs, 0, n - 1), z0, z1)
+            total_energy[chunk] = energy.sum(axis=1)
+            total_counts[:, chunk] = counts.sum(axis=2)
+            start = stop
+        return self._summary(total_energy, total_counts)
+
+    def nearest_green(self, cells: np.ndarray) -> Dict[str, Any]:
+        """网格点 (x, z) 到最近绿地的位置与欧氏距离；城市中没有绿地时位置与距离为 None"""
+        if not self.has_green:
+            missing = [None] * len(cells)
+            return {"green_x": missing, "green_z": missing, "distance": missing}
+        flat = self._nearest_green[cells[:, 0], cells[:, 1]].astype(np.int64)
+        gx, gz = np.divmod(flat, self.grid_size)
+        return {
+            "green_x": gx.tolist(),
+            "green_z": gz.tolist(),
+            "distance": np.round(np.hypot(gx - cells[:, 0], gz - cells[:, 1]), 3).tolist(),
+        }
+
+    def nearest_green_summary(self, city: CityArrays, building_type: int, bins: int = 20) -> Dict[str, Any]:
+        """某类型全部建筑到最近绿地距离的分布（平均值、分位数与按整数距离分桶的直方图）"""
+        mask = city.types == building_type
+        buildings = int(np.count_nonzero(mask))
+        if not buildings or not self.has_green:
+            return {"buildings": buildings, "mean": None, "max": None, "percentiles": {}, "histogram": []}
+        xs, zs = np.nonzero(mask)
+        gx, gz = np.divmod(self._nearest_green[mask].astype(np.int64), self.grid_size)
+        distance = np.hypot(gx - xs, gz - zs)
+        histogram = np.bincount(np.minimum(np.floor(distance).astype(np.int64), bins - 1), minlength=bins)
+        return {
+            "buildings": buildings,
+            "mean": round(float(distance.mean()), 3),
+            "max": round(float(distance.max()), 3),
+            "percentiles": {f"p{q}": round(float(v), 3)
+                            for q, v in zip((50, 90, 99), np.percentile(distance, (50, 90, 99)))},
+            # 第 i 个桶为距离在 [i, i+1) 内的建筑数，最后一个桶包含更远的全部建筑
+            "histogram": np.trim_zeros(histogram, "b").tolist(),
+        }
+
+    def _polygon_rows(self, vertices: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """扫描线：返回多边形内每段行区间的 (x, z0, z1)，奇偶规则，边界上的网格点计入"""
+        n = self.grid_size
+        x0 = max(0, int(math.ceil(vertices[:, 0].min())))
+        x1 = min(n - 1, int(math.floor(vertices[:, 0].max())))
+        if x1 < x0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        xs = np.arange(x0, x1 + 1, dtype=np.float64)[:, None]
+        row_ids = np.broadcast_to(np.arange(x0, x1 + 1)[:, None], (len(xs), len(vertices)))
+        ax, az = vertices[:, 0], vertices[:, 1]
+        bx, bz = np.roll(ax, -1), np.roll(az, -1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = az + (xs - ax) * (bz - az) / (bx - ax)
+
+        # 内部：半开区间判定交点，使经过顶点的扫描线只计一次
+        crosses = ((ax <= xs) & (xs < bx)) | ((bx <= xs) & (xs < ax))
+        fill = np.sort(np.where(crosses, z, np.inf), axis=1)
+        pairs = fill.shape[1] // 2
+        starts, stops = fill[:, 0:2 * pairs:2], fill[:, 1:2 * pairs:2]
+        inner = np.isfinite(stops)
+
+        # 边界：半开判定会漏掉 x 最大处的顶点与水平边，单独补上边落在各行上的部分
+        touches = (np.minimum(ax, bx) <= xs) & (xs <= np.maximum(ax, bx))
+        flat = np.broadcast_to(ax == bx, touches.shape)
+        lo = np.where(flat, np.minimum(az, bz), z)
+        hi = np.where(flat, np.maximum(az, bz), z)
+
+        rows = np.concatenate([row_ids[:, :pairs][inner], row_ids[touches]])
+        z0 = np.ceil(np.concatenate([starts[inner], lo[touches]]) - 1e-9)
+        z1 = np.floor(np.concatenate([stops[inner], hi[touches]]) + 1e-9)
+        z0 = np.maximum(z0, 0).astype(np.int64)
+        z1 = np.minimum(z1, n - 1).astype(np.int64)
+        keep = z0 <= z1
+        return _merge_intervals(rows[keep].astype(np.int64), z0[keep], z1[keep], n)
+
+    def polygon(self, city: CityArrays, vertices: np.ndarray, limit: int = 0) -> Dict[str, Any]:
+        """多边形内的建筑汇总；limit > 0 时同时列出前 limit 栋建筑（x 优先顺序）"""
+        rows, z0, z1 = self._polygon_rows(vertices)
+        energy, counts = self._sum_intervals(rows, z0, z1)
+        result = {
+            "count": int(counts.sum()),
+            "energy_production": round(float(energy.sum()), 1),
+            "by_type": {name: int(counts[t].sum()) for t, name in enumerate(BUILDING_TYPES)},
+        }
+        if limit > 0:
+            result["buildings"] = self._list_buildings(city, rows, z0, z1, limit)
+        return result
+
+    def _list_buildings(self, city: CityArrays, rows: np.ndarray, z0: np.ndarray, z1: np.ndarray,
+                        limit: int) -> List[Dict[str, Any]]:
+        order = np.lexsort((z0, rows))
+        xs: List[np.ndarray] = []
+        zs: List[np.ndarray] = []
+        remaining = limit
+        for i in order:
+            if remaining <= 0:
+                break
+            width = min(int(z1[i] - z0[i] + 1), remaining)
+            if width <= 0:
+                continue
+            xs.append(np.full(width, rows[i]))
+            zs.append(np.arange(z0[i], z0[i] + width))
+            remaining -= width
+        if not xs:
+            return []
+        x = np.concatenate(xs)
+        z = np.concatenate(zs)
+        return [
+            {"x": bx, "z": bz, "height": h, "type": t, "solar_coverage": s, "energy_production": e}
+            for bx, bz, h, t, s, e in zip(
+                x.tolist(), z.tolist(), city.heights[x, z].tolist(), _TYPE_NAMES[city.types[x, z]].tolist(),
+                city.solar_coverage[x, z].tolist(), np.round(city.energy_production[x, z], 1).tolist())
+        ]
+
+
+def query_polygons(index: SpatialIndex, city: CityArrays, polygons: List[np.ndarray],
+                   limit: int = 0) -> List[Dict[str, Any]]:
+    """批量多边形查询（在计算执行器中一次完成）"""
+    return [index.polygon(city, vertices, limit) for vertices in polygons]
+
+
+def _merge_intervals(rows: np.ndarray, z0: np.ndarray, z1: np.ndarray,
+                     n: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """合并同一行上重叠的区间，使每个网格点只计一次"""
+    if not rows.size:
+        return rows, z0, z1
+    order = np.lexsort((z0, rows))
+    rows, z0, z1 = rows[order], z0[order], z1[order]
+    # 行号乘以 (n + 1) 作为偏移，使累积最大值不会跨行传递
+    offset = rows * (n + 1)
+    reach = np.maximum.accumulate(z1 + offset)
+    first = np.ones(rows.size, dtype=bool)
+    first[1:] = z0[1:] + offset[1:] > reach[:-1]
+    starts = np.flatnonzero(first)
+    ends = np.append(starts[1:], rows.size) - 1
+    return rows[starts], z0[starts], reach[ends] - offset[starts]
+
+
+def as_points(points: Sequence[Sequence[float]], grid_size: Optional[int] = None) -> np.ndarray:
+    """校验并转换为 (Q, 2) 数组；给定 grid_size 时要求为城市内的整数网格点"""
+    array = np.asarray(points, dtype=np.float64)
+    if array.size == 0:
+        array = array.reshape(0, 2)
+    if array.ndim != 2 or array.shape[1] != 2:
+        raise ValueError("points 应为 [[x, z], ...]")
+    if not np.isfinite(array).all():
+        raise ValueError("坐标必须为有限数值")
+    if grid_size is None:
+        return array
+    cells = np.rint(array).astype(np.int64)
+    if ((cells < 0) | (cells >= grid_size)).any():
+        raise ValueError(f"网格点坐标必须在 [0, {grid_size}) 内")
+    return cells
@@ -0,0 +1,174 @@
+"""
+城市的四叉树分级瓦片：每一级把上一级的 2x2 个单元合并为一个，预先聚合最大/平均高度、主导类型、
+能源产出总和与绿地数量；远景只需读取少量粗粒度单元，近景按需从原始数组聚合
+"""
+
+import math
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from city_engine import BUILDING_TYPES, GREEN, CityArrays
+
+# 单元边长不小于该值的级别预先聚合；更细的级别请求范围受 MAX_TILE_CELLS 限制，直接从原始数组计算
+PYRAMID_MIN_CELL = 8
+DEFAULT_MAX_CELLS = 1024
+MAX_TILE_CELLS = 65536
+
+Bbox = Tuple[int, int, int, int]
+
+
+class TileLevel:
+    """某一级的聚合数组，形状为 (rows, cols)，type_counts 为 (类型数, rows, cols)"""
+
+    __slots__ = ("cell_size", "count", "height_sum", "height_max", "energy_sum", "type_counts")
+
+    def __init__(self, cell_size: int, count: np.ndarray, height_sum: np.ndarray, height_max: np.ndarray,
+                 energy_sum: np.ndarray, type_counts: np.ndarray):
+        self.cell_size = cell_size
+        self.count = count
+        self.height_sum = height_sum
+        self.height_max = height_max
+        self.energy_sum = energy_sum
+        self.type_counts = type_counts
+
+    @property
+    def nbytes(self) -> int:
+        return (self.count.nbytes + self.height_sum.nbytes + self.height_max.nbytes
+                + self.energy_sum.nbytes + self.type_counts.nbytes)
+
+    def window(self, i0: int, i1: int, j0: int, j1: int) -> "TileLevel":
+        return TileLevel(self.cell_size, self.count[i0:i1, j0:j1], self.height_sum[i0:i1, j0:j1],
+                         self.height_max[i0:i1, j0:j1], self.energy_sum[i0:i1, j0:j1],
+                         self.type_counts[:, i0:i1, j0:j1])
+
+
+def _block_reduce(values: np.ndarray, factor: int, reducer, fill) -> np.ndarray:
+    """把最后两维按 factor x factor 分块归约，不足整块的边缘用 fill 补齐"""
+    rows, cols = values.shape[-2:]
+    pad_rows, pad_cols = (-rows) % factor, (-cols) % factor
+    if pad_rows or pad_cols:
+        pad = [(0, 0)] * (values.ndim - 2) + [(0, pad_rows), (0, pad_cols)]
+        values = np.pad(values, pad, constant_values=fill)
+    rows, cols = values.shape[-2:]
+    shaped = values.reshape(values.shape[:-2] + (rows // factor, factor, cols // factor, factor))
+    return reducer(shaped, axis=(-3, -1))
+
+
+def aggregate(city: CityArrays, x0: int, x1: int, z0: int, z1: int, cell_size: int) -> TileLevel:
+    """把原始数组的 [x0, x1) x [z0, z1) 区域（x0/z0 与单元对齐）聚合为 cell_size 大小的单元"""
+    heights = city.heights[x0:x1, z0:z1]
+    types = city.types[x0:x1, z0:z1]
+    energy = city.energy_production[x0:x1, z0:z1]
+    ones = np.ones(heights.shape, dtype=np.int32)
+    type_counts = np.stack([
+        _block_reduce((types == t).astype(np.int32), cell_size, np.sum, 0) for t in range(len(BUILDING_TYPES))
+    ])
+    return TileLevel(
+        cell_size,
+        _block_reduce(ones, cell_size, np.sum, 0),
+        _block_reduce(heights.astype(np.int64), cell_size, np.sum, 0),
+        _block_reduce(heights, cell_size, np.max, 0),
+        _block_reduce(energy, cell_size, np.sum, 0.0),
+        type_counts,
+    )
+
+
+def merge(level: TileLevel) -> TileLevel:
+    """把一级的 2x2 个单元合并为上一级的一个单元"""
+    return TileLevel(
+        level.cell_size * 2,
+        _block_reduce(level.count, 2, np.sum, 0),
+        _block_reduce(level.height_sum, 2, np.sum, 0),
+        _block_reduce(level.height_max, 2, np.max, 0),
+        _block_reduce(level.energy_sum, 2, np.sum, 0.0),
+        _block_reduce(level.type_counts, 2, np.sum, 0),
+    )
+
+
+class CityPyramid:
+    """级别 0 为覆盖整座城市的单个根单元，级别 max_level 的单元即单栋建筑"""
+
+    def __init__(self, city: CityArrays):
+        self.grid_size = city.grid_size
+        self.max_level = max(0, math.ceil(math.log2(max(1, city.grid_size))))
+        self.levels: Dict[int, TileLevel] = {}
+        level = self.max_level - int(math.log2(PYRAMID_MIN_CELL))
+        if level < 0:
+            return
+        current = aggregate(city, 0, city.grid_size, 0, city.grid_size, PYRAMID_MIN_CELL)
+        self.levels[level] = current
+        while level > 0:
+            level -= 1
+            current = merge(current)
+            self.levels[level] = current
+
+    @property
+    def nbytes(self) -> int:
+        return sum(level.nbytes for level in self.levels.values())
+
+    def cell_size(self, level: int) -> int:
+        return 1 << (self.max_level - level)
+
+    def cell_range(self, level: int, bbox: Bbox) -> Tuple[int, int, int, int]:
+        """bbox 覆盖的单元下标范围 [i0, i1) x [j0, j1)，限制在城市范围内"""
+        size = self.cell_size(level)
+        cells = -(-self.grid_size // size)
+        x0, z0, x1, z1 = bbox
+        i0, j0 = max(0, x0 // size), max(0, z0 // size)
+        i1, j1 = min(cells, -(-x1 // size)), min(cells, -(-z1 // size))
+        return i0, max(i0, i1), j0, max(j0, j1)
+
+    def choose_level(self, bbox: Bbox, max_cells: int) -> int:
+        """单元数不超过 max_cells 的最细级别"""
+        for level in range(self.max_level, -1, -1):
+            i0, i1, j0, j1 = self.cell_range(level, bbox)
+            if (i1 - i0) * (j1 - j0) <= max_cells:
+                return level
+        return 0
+
+    def query(self, city: CityArrays, level: int, bbox: Bbox) -> Dict[str, Any]:
+        """返回 bbox 内某一级单元的列式聚合（按 x 优先的行主序展开）"""
+        if not 0 <= level <= self.max_level:
+            raise ValueError(f"lod 必须在 [0, {self.max_level}] 内")
+        i0, i1, j0, j1 = self.cell_range(level, bbox)
+        if (i1 - i0) * (j1 - j0) > MAX_TILE_CELLS:
+            raise ValueError(f"请求的单元数 {(i1 - i0) * (j1 - j0)} 超过上限 {MAX_TILE_CELLS}，请降低 lod 或缩小范围")
+        size = self.cell_size(level)
+        if level in self.levels:
+            cells = self.levels[level].window(i0, i1, j0, j1)
+        else:
+            cells = aggregate(city, i0 * size, min(i1 * size, self.grid_size),
+                              j0 * size, min(j1 * size, self.grid_size), size)
+        count = cells.count
+        mean = np.divide(cells.height_sum, count, out=np.zeros(count.shape), where=count > 0)
+        return {
+            "level": level,
+            "max_level": self.max_level,
+            "cell_size": size,
+            "grid_size": self.grid_size,
+            "origin": [i0, j0],
+            "shape": [i1 - i0, j1 - j0],
+            "types": BUILDING_TYPES,
+            "cells": {
+                "count": count.ravel().tolist(),
+                "height_max": cells.height_max.ravel().tolist(),
+                "height_mean": np.round(mean, 2).ravel().tolist(),
+                "dominant_type": cells.type_counts.argmax(axis=0).ravel().tolist(),
+                "energy_production": np.round(cells.energy_sum, 1).ravel().tolist(),
+                "green_count": cells.type_counts[GREEN].ravel().tolist(),
+            },
+        }
+
+
+def parse_bbox(text: Optional[str], grid_size: int) -> Bbox:
+    """解析 "x0,z0,x1,z1"（网格坐标，右下角不含），为空时为整座城市"""
+    if not text:
+        return 0, 0, grid_size, grid_size
+    try:
+        x0, z0, x1, z1 = (int(float(v)) for v in text.split(","))
+    except ValueError:
+        raise ValueError("bbox 格式应为 x0,z0,x1,z1")
+    if x1 <= x0 or z1 <= z0:
+        raise ValueError("bbox 的 x1/z1 必须大于 x0/z0")
+    return x0, z0, x1, z1
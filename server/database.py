@@ -0,0 +1,347 @@
+"""
+SQLite 持久化层：长连接 + WAL 模式 + 批量写后队列
+"""
+
+import os
+import re
+import asyncio
+import functools
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from metrics import add_stage_time
+
+logger = logging.getLogger(__name__)
+
+# ==================== 配置 ====================
+
+DB_PATH = os.getenv("SMART_CITY_DB", "smart_city.db")
+
+# 持久性与延迟的取舍:
+#   durable  - synchronous=FULL，请求等待事务提交后才返回
+#   balanced - synchronous=NORMAL，写后队列异步批量提交（默认）
+#   fast     - synchronous=OFF，写后队列异步批量提交，崩溃时可能丢失最近一批
+DB_DURABILITY = os.getenv("SMART_CITY_DB_DURABILITY", "balanced").lower()
+
+# 批量刷新条件：满足条数或时间间隔任一即提交
+DB_BATCH_SIZE = int(os.getenv("SMART_CITY_DB_BATCH_SIZE", "500"))
+DB_FLUSH_INTERVAL = float(os.getenv("SMART_CITY_DB_FLUSH_INTERVAL", "0.05"))
+
+_SYNCHRONOUS = {"durable": "FULL", "balanced": "NORMAL", "fast": "OFF"}
+
+if DB_DURABILITY not in _SYNCHRONOUS:
+    raise ValueError(f"SMART_CITY_DB_DURABILITY 取值无效: {DB_DURABILITY}")
+
+
+def connect(path: Optional[str] = None) -> sqlite3.Connection:
+    """创建一个配置好 WAL 模式的连接"""
+    conn = sqlite3.connect(path or DB_PATH, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={_SYNCHRONOUS[DB_DURABILITY]}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+_INSERT_RE = re.compile(r"^\s*INSERT\s+(?:OR\s+\w+\s+)?INTO\s+(\w+)\s*\(([^)]*)\)", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=256)
+def parse_insert(sql: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+    """解析 INSERT 语句的表名与列名，非 INSERT 语句返回 None"""
+    match = _INSERT_RE.match(sql)
+    if match is None:
+        return None
+    columns = tuple(col.strip() for col in match.group(2).split(","))
+    return match.group(1), columns
+
+
+# ==================== 读连接池 ====================
+
+class ConnectionPool:
+    """按线程复用的只读连接池（WAL 模式下读写互不阻塞）"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or DB_PATH
+        self._local = threading.local()
+        self._all: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.path)
+            self._local.conn = conn
+            with self._lock:
+                self._all.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._all:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._all.clear()
+        self._local = threading.local()
+
+
+# ==================== 写后队列 ====================
+
+Statement = Tuple[str, List[Sequence[Any]]]
+
+
+class _WriteOp:
+    """一次写入请求：一条或多条语句，作为整体提交或失败；没有语句的为 flush 标记"""
+    __slots__ = ("statements", "rows", "done", "error")
+
+    def __init__(self, statements: List[Statement], done: Optional[threading.Event]):
+        self.statements = statements
+        self.rows = sum(len(rows) for _, rows in statements)
+        self.done = done
+        self.error: Optional[BaseException] = None
+
+
+class WriteBehindQueue:
+    """后台写线程：将所有表的插入合并为每批一个事务"""
+
+    def __init__(self, path: Optional[str] = None,
+                 batch_size: int = DB_BATCH_SIZE,
+                 flush_interval: float = DB_FLUSH_INTERVAL):
+        self.path = path or DB_PATH
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.001, flush_interval)
+        self._queue: "queue.Queue[Optional[_WriteOp]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        # stop() 已发出停止信号：此后的写入不再入队（写线程清空队列后即退出），改为同步写入
+        self._stopping = False
+        self._listeners: List[Callable[[str, List[Sequence[Any]]], None]] = []
+        self._hooks: List[Callable[[str, List[Sequence[Any]]], List[Statement]]] = []
+        self.stats: Dict[str, int] = {"batches": 0, "rows": 0, "errors": 0}
+        # 不等待提交的写入失败后，错误在下一次 flush 时抛出
+        self._unreported: Optional[BaseException] = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._conn = connect(self.path)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"写后队列已启动: 模式 {DB_DURABILITY}, 批量 {self.batch_size}, 间隔 {self.flush_interval}s")
+
+    def add_commit_listener(self, listener: Callable[[str, List[Sequence[Any]]], None]):
+        """注册提交回调 listener(sql, rows)，在事务提交成功后调用（用于维护内存聚合）"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def add_transaction_hook(self, hook: Callable[[str, List[Sequence[Any]]], List[Statement]]):
+        """注册事务回调 hook(sql, rows) -> [(sql, rows), ...]，返回的语句与原始写入在同一事务中执行
+
+        用于必须与原始行保持一致的派生表（如汇总表）：两者一起提交或一起回滚，崩溃时不会只写入其一。
+        """
+        if hook not in self._hooks:
+            self._hooks.append(hook)
+
+    def submit(self, sql: str, params: Sequence[Any], wait: Optional[bool] = None):
+        """提交单行写入；durable 模式下默认等待提交完成"""
+        self.submit_many(sql, [params], wait=wait)
+
+    def submit_many(self, sql: str, rows: List[Sequence[Any]], wait: Optional[bool] = None):
+        """提交多行写入（同一语句），作为同一批次的一部分；等待提交时写入失败会抛出 sqlite3.Error"""
+        self.submit_transaction([(sql, rows)], wait=wait)
+
+    def submit_transaction(self, statements: List[Statement], wait: Optional[bool] = None):
+        """提交多条语句的写入，保证它们在同一事务中提交（全部成功或全部失败）"""
+        statements = [(sql, list(rows)) for sql, rows in statements if rows]
+        if not statements:
+            return
+        if wait is None:
+            wait = DB_DURABILITY == "durable"
+        if not self._running():
+            # 写线程未运行（如脚本直接调用）或正在停止，退化为同步写入
+            self._write_now(statements)
+            return
+        done = threading.Event() if wait else None
+        op = _WriteOp(statements, done)
+        self._queue.put(op)
+        if done is not None:
+            done.wait()
+            if op.error is not None:
+                raise op.error
+
+    async def asubmit(self, sql: str, params: Sequence[Any]):
+        """协程版本：需要等待提交时转到线程池中等待，避免阻塞事件循环"""
+        await self.asubmit_many(sql, [params])
+
+    async def asubmit_many(self, sql: str, rows: List[Sequence[Any]]):
+        """协程版本的批量提交"""
+        if DB_DURABILITY != "durable":
+            self.submit_many(sql, rows, wait=False)
+            return
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        await loop.run_in_executor(None, self.submit_many, sql, rows, True)
+        add_stage_time("db", time.perf_counter() - started)
+
+    def flush(self, timeout: Optional[float] = None):
+        """阻塞直到当前已入队的写入全部提交；此前不等待提交的写入如有失败，抛出其中最近的错误"""
+        if not self._running():
+            return
+        done = threading.Event()
+        op = _WriteOp([], done)
+        self._queue.put(op)
+        done.wait(timeout)
+        if op.error is not None:
+            raise op.error
+
+    def _running(self) -> bool:
+        return not self._stopping and self._thread is not None and self._thread.is_alive()
+
+    def stop(self, timeout: float = 10.0) -> bool:
+        """刷新剩余写入并停止写线程（关闭时调用）
+
+        超时后写线程仍在提交时不关闭其连接，写线程提交完剩余写入后自行关闭连接；可再次调用 stop 继续等待。
+        返回写线程是否已退出。
+        """
+        if self._thread is None:
+            return True
+        self._stopping = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning(f"写后队列在 {timeout}s 内未完成剩余写入，写线程继续在后台提交")
+            return False
+        self._thread = None
+        logger.info(f"写后队列已停止: 共提交 {self.stats['batches']} 批 / {self.stats['rows']} 行")
+        return True
+
+    def _write_now(self, statements: List[Statement]):
+        conn = connect(self.path)
+        try:
+            with conn:
+                for sql, rows in statements:
+                    conn.executemany(sql, rows)
+                self._run_hooks(conn, statements)
+        finally:
+            conn.close()
+        self._notify(statements)
+
+    def _notify(self, groups: List[Tuple[str, List[Sequence[Any]]]]):
+        for listener in self._listeners:
+            for sql, rows in groups:
+                try:
+                    listener(sql, rows)
+                except Exception as e:
+                    logger.error(f"提交回调失败: {str(e)}")
+
+    def _run(self):
+        try:
+            self._drain()
+        finally:
+            # 连接只由写线程自己在退出时关闭，stop 超时也不会关闭仍在使用的连接
+            self._conn.close()
+            self._conn = None
+
+    def _drain(self):
+        stopping = False
+        while not stopping:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch: List[_WriteOp] = []
+            if first is None:
+                stopping = True
+            else:
+                batch.append(first)
+
+            # 在时间窗口内继续收集，直到达到批量上限
+            deadline = time.monotonic() + self.flush_interval
+            rows_in_batch = sum(op.rows for op in batch)
+            while rows_in_batch < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    op = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if op is None:
+                    stopping = True
+                    # 停止信号之后仍需清空队列中已有的写入
+                    continue
+                batch.append(op)
+                rows_in_batch += op.rows
+
+            if stopping:
+                while True:
+                    try:
+                        op = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if op is not None:
+                        batch.append(op)
+
+            self._commit(batch)
+
+    def _commit(self, batch: List[_WriteOp]):
+        ops = [op for op in batch if op.rows]
+        if ops:
+            try:
+                self._execute(ops)
+            except Exception as e:
+                if len(ops) == 1:
+                    self._fail(ops[0], e)
+                else:
+                    # 合并的事务已回滚：逐个写入请求单独重试，只有出错的请求失败
+                    logger.warning(f"批量写入失败，逐个请求重试: {str(e)}")
+                    for op in ops:
+                        try:
+                            self._execute([op])
+                        except Exception as op_error:
+                            self._fail(op, op_error)
+        for op in batch:
+            if not op.rows:
+                op.error, self._unreported = self._unreported, None
+            if op.done is not None:
+                op.done.set()
+
+    def _execute(self, ops: List[_WriteOp]):
+        # 按语句分组，使用 executemany 在一个事务内写入
+        groups: Dict[str, List[Sequence[Any]]] = {}
+        for op in ops:
+            for sql, rows in op.statements:
+                groups.setdefault(sql, []).extend(rows)
+        with self._conn:
+            for sql, rows in groups.items():
+                self._conn.executemany(sql, rows)
+            self._run_hooks(self._conn, list(groups.items()))
+        self.stats["batches"] += 1
+        self.stats["rows"] += sum(len(rows) for rows in groups.values())
+        self._notify(list(groups.items()))
+
+    def _run_hooks(self, conn: sqlite3.Connection, statements: List[Statement]):
+        for hook in self._hooks:
+            for sql, rows in statements:
+                for extra_sql, extra_rows in hook(sql, rows):
+                    if extra_rows:
+                        conn.executemany(extra_sql, extra_rows)
+
+    def _fail(self, op: _WriteOp, error: Exception):
+        self.stats["errors"] += 1
+        op.error = error
+        if op.done is None:
+            self._unreported = error
+        logger.error(f"写入失败: {str(error)}")
+
+
+# ==================== 全局实例 ====================
+
+pool = ConnectionPool()
+writer = WriteBehindQueue()
@@ -0,0 +1,73 @@
+"""
+CPU 密集型任务执行器：将同步的 NumPy / sqlite 计算移出事件循环
+"""
+
+import os
+import time
+import asyncio
+import functools
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from metrics import add_stage_time
+
+logger = logging.getLogger(__name__)
+
+# thread: 线程池（NumPy 大部分运算会释放 GIL）; process: 进程池（纯 Python 计算可跨核扩展）
+EXECUTOR_KIND = os.getenv("SMART_CITY_EXECUTOR", "thread").lower()
+EXECUTOR_WORKERS = int(os.getenv("SMART_CITY_WORKERS", str(os.cpu_count() or 4)))
+
+if EXECUTOR_KIND not in ("thread", "process"):
+    raise ValueError(f"SMART_CITY_EXECUTOR 取值无效: {EXECUTOR_KIND}")
+
+_executor: Optional[Executor] = None
+_io_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if EXECUTOR_KIND == "process":
+            _executor = ProcessPoolExecutor(max_workers=EXECUTOR_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix="cpu")
+        logger.info(f"计算执行器已创建: {EXECUTOR_KIND} x {EXECUTOR_WORKERS}")
+    return _executor
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = ThreadPoolExecutor(max_workers=max(4, EXECUTOR_WORKERS), thread_name_prefix="io")
+    return _io_executor
+
+
+async def run_cpu(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """在计算执行器中运行 CPU 密集型函数（进程池模式下函数与参数需可序列化）"""
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+    finally:
+        add_stage_time("compute", time.perf_counter() - started)
+
+
+async def run_io(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """在线程池中运行阻塞 IO（如 sqlite 查询），连接不能跨进程共享因此始终使用线程"""
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(get_io_executor(), functools.partial(func, *args, **kwargs))
+    finally:
+        add_stage_time("db", time.perf_counter() - started)
+
+
+def shutdown():
+    global _executor, _io_executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    if _io_executor is not None:
+        _io_executor.shutdown(wait=True)
+        _io_executor = None
@@ -0,0 +1,201 @@
+"""
+存证记录的哈希查询索引：内存布隆过滤器快速判定"从未存储"，命中后再走 SQLite 索引
+"""
+
+import os
+import math
+import hashlib
+import sqlite3
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from database import parse_insert
+
+logger = logging.getLogger(__name__)
+
+BLOOM_CAPACITY = int(os.getenv("SMART_CITY_BLOOM_CAPACITY", "1000000"))
+BLOOM_ERROR_RATE = float(os.getenv("SMART_CITY_BLOOM_ERROR_RATE", "0.01"))
+
+# 单次 IN 查询的参数个数，低于旧版 SQLite 的 999 变量上限
+_QUERY_CHUNK = 500
+
+
+def hash_pairs(keys: Sequence[str]) -> np.ndarray:
+    """每个键的两个 64 位哈希 (len(keys), 2)，双重哈希由此生成各位置，多层过滤器共用"""
+    digests = b"".join(hashlib.blake2b(key.encode(), digest_size=16).digest() for key in keys)
+    return np.frombuffer(digests, dtype=np.uint64).reshape(-1, 2)
+
+
+class BloomFilter:
+    """基于 NumPy 位数组的布隆过滤器，使用双重哈希生成 k 个位置"""
+
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.num_bits = max(64, int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / self.capacity * math.log(2))))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def _positions(self, pairs: np.ndarray) -> np.ndarray:
+        """返回形状为 (len(pairs), k) 的位下标"""
+        h1, h2 = pairs[:, :1], pairs[:, 1:] | np.uint64(1)
+        steps = np.arange(self.num_hashes, dtype=np.uint64)
+        return (h1 + steps * h2) % np.uint64(self.num_bits)
+
+    def add_many(self, keys: Sequence[str]):
+        if keys:
+            self.add_pairs(hash_pairs(keys))
+
+    def add_pairs(self, pairs: np.ndarray):
+        positions = self._positions(pairs).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                         (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+        self.count += len(pairs)
+
+    def contains_many(self, keys: Sequence[str]) -> np.ndarray:
+        if not keys:
+            return np.zeros(0, dtype=bool)
+        return self.contains_pairs(hash_pairs(keys))
+
+    def contains_pairs(self, pairs: np.ndarray) -> np.ndarray:
+        positions = self._positions(pairs)
+        bytes_ = self.bits[positions >> np.uint64(3)]
+        masks = np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)
+        return np.all(bytes_ & masks, axis=1)
+
+    def __contains__(self, key: str) -> bool:
+        return bool(self.contains_many([key])[0])
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+
+class ScalableBloomFilter:
+    """可扩容的布隆过滤器：当前层写满后追加一层容量翻倍、误判率减半的过滤器，已有的位保持不变
+
+    扩容不需要重新扫描数据库；各层误判率为 error_rate/2, error_rate/4, ...，总误判率不超过 error_rate。
+    """
+
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        self.error_rate = error_rate
+        self.layers: List[BloomFilter] = [BloomFilter(capacity, error_rate / 2)]
+
+    def add_many(self, keys: Sequence[str]):
+        if not keys:
+            return
+        pairs = hash_pairs(keys)
+        while len(pairs):
+            layer = self.layers[-1]
+            room = layer.capacity - layer.count
+            if room <= 0:
+                layer = BloomFilter(layer.capacity * 2, layer.error_rate / 2)
+                self.layers.append(layer)
+                logger.info(f"布隆过滤器已扩容: 第 {len(self.layers)} 层, 容量 {self.capacity}")
+                room = layer.capacity
+            layer.add_pairs(pairs[:room])
+            pairs = pairs[room:]
+
+    def contains_many(self, keys: Sequence[str]) -> np.ndarray:
+        if not keys:
+            return np.zeros(0, dtype=bool)
+        pairs = hash_pairs(keys)
+        found = np.zeros(len(keys), dtype=bool)
+        for layer in list(self.layers):
+            found |= layer.contains_pairs(pairs)
+        return found
+
+    def __contains__(self, key: str) -> bool:
+        return bool(self.contains_many([key])[0])
+
+    @property
+    def capacity(self) -> int:
+        return sum(layer.capacity for layer in self.layers)
+
+    @property
+    def count(self) -> int:
+        return sum(layer.count for layer in self.layers)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(layer.nbytes for layer in self.layers)
+
+
+class HashIndex:
+    """维护 data_hash / transaction_hash 的布隆过滤器，并提供单条与批量查询"""
+
+    def __init__(self, capacity: int = BLOOM_CAPACITY):
+        self.base_capacity = capacity
+        self.bloom = ScalableBloomFilter(capacity)
+
+    def _load(self, conn: sqlite3.Connection, capacity: int) -> ScalableBloomFilter:
+        bloom = ScalableBloomFilter(capacity)
+        cursor = conn.execute("SELECT data_hash, transaction_hash FROM blockchain_data")
+        while True:
+            rows = cursor.fetchmany(50000)
+            if not rows:
+                break
+            bloom.add_many([h for row in rows for h in row if h])
+        return bloom
+
+    def rebuild(self, conn: sqlite3.Connection):
+        """启动时从数据库重建，容量至少为现有哈希数的两倍"""
+        rows = conn.execute("SELECT COUNT(*) FROM blockchain_data").fetchone()[0]
+        self.bloom = self._load(conn, max(self.base_capacity, rows * 4))
+        logger.info(f"布隆过滤器已重建: {self.bloom.count} 个哈希, {self.bloom.nbytes // 1024} KB")
+
+    def on_commit(self, sql: str, rows: List[Sequence[Any]]):
+        """写后队列提交回调：把新存证的哈希加入过滤器"""
+        parsed = parse_insert(sql)
+        if parsed is None or parsed[0] != "blockchain_data":
+            return
+        columns = parsed[1]
+        indexes = [columns.index(name) for name in ("data_hash", "transaction_hash") if name in columns]
+        # 超出容量时过滤器自行追加一层，不在写线程中重新扫描数据库
+        self.bloom.add_many([row[i] for row in rows for i in indexes if row[i]])
+
+    def lookup(self, conn: sqlite3.Connection, value: str) -> Optional[Dict[str, Any]]:
+        """按数据哈希或交易哈希查询存证记录；布隆过滤器判定不存在时不访问数据库"""
+        if value not in self.bloom:
+            return None
+        row = conn.execute('''
+            SELECT id, timestamp, data_hash, wallet_address, transaction_hash FROM blockchain_data
+            WHERE data_hash = ? OR transaction_hash = ?
+            ORDER BY id LIMIT 1
+        ''', (value, value)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "timestamp", "data_hash", "wallet_address", "transaction_hash"), row))
+
+    def bulk_lookup(self, conn: sqlite3.Connection, values: List[str]) -> Dict[str, Any]:
+        """批量校验：先用布隆过滤器排除，剩余候选分块走索引查询"""
+        maybe = self.bloom.contains_many(values)
+        candidates = sorted({v for v, m in zip(values, maybe.tolist()) if m})
+
+        found: Dict[str, str] = {}
+        for start in range(0, len(candidates), _QUERY_CHUNK):
+            chunk = candidates[start:start + _QUERY_CHUNK]
+            placeholders = ", ".join("?" for _ in chunk)
+            for data_hash, transaction_hash in conn.execute(f'''
+                SELECT data_hash, transaction_hash FROM blockchain_data WHERE data_hash IN ({placeholders})
+                UNION ALL
+                SELECT data_hash, transaction_hash FROM blockchain_data WHERE transaction_hash IN ({placeholders})
+            ''', chunk + chunk):
+                found.setdefault(data_hash, transaction_hash)
+                found.setdefault(transaction_hash, transaction_hash)
+
+        transaction_hashes = [found.get(v) for v in values]
+        return {
+            "count": len(values),
+            "exists": [tx is not None for tx in transaction_hashes],
+            "transaction_hash": transaction_hashes,
+            "found": sum(tx is not None for tx in transaction_hashes),
+            "bloom_rejected": int(len(values) - maybe.sum()),
+            "db_checked": len(candidates),
+        }
+
+
+hash_index = HashIndex()
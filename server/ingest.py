@@ -0,0 +1,275 @@
+"""
+传感器数据批量导入：流式读取 NDJSON/CSV 请求体，按批校验并写入，报告每批错误与吞吐量
+"""
+
+import os
+import csv
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import executor
+
+logger = logging.getLogger(__name__)
+
+INGEST_BATCH_SIZE = int(os.getenv("SMART_CITY_INGEST_BATCH", "5000"))
+MAX_ERRORS_PER_BATCH = 20
+# 单行最大字节数，超出的行丢弃其内容并作为错误行报告，避免无换行的请求体占满内存
+MAX_LINE_BYTES = int(os.getenv("SMART_CITY_INGEST_MAX_LINE", "65536"))
+
+# 字段名 -> (类型, 最小值, 最大值)
+SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "traffic": {
+        "table": "traffic_data",
+        "fields": {
+            "vehicle_count": (int, 0, 100000),
+            "avg_speed": (float, 0, 300),
+            "signal_cycle": (int, 1, 600),
+        },
+        "score_column": "optimization_score",
+    },
+    "health": {
+        "table": "health_data",
+        "fields": {
+            "heart_rate": (int, 20, 300),
+            "systolic_bp": (int, 40, 300),
+            "diastolic_bp": (int, 20, 200),
+            "exercise_minutes": (int, 0, 1440),
+            "sleep_hours": (float, 0, 24),
+        },
+        "score_column": "health_score",
+    },
+}
+
+# 评分函数：接收各字段的 NumPy 数组，返回评分数组
+Scorer = Callable[[Dict[str, np.ndarray]], np.ndarray]
+
+
+class IngestError(ValueError):
+    """请求级错误（格式或表头不正确），整个导入终止"""
+
+
+def insert_sql(kind: str) -> str:
+    schema = SCHEMAS[kind]
+    columns = ["timestamp", *schema["fields"], schema["score_column"]]
+    return (f"INSERT INTO {schema['table']} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)})")
+
+
+def detect_format(content_type: Optional[str], fmt: Optional[str]) -> str:
+    if fmt:
+        fmt = fmt.lower()
+        if fmt not in ("ndjson", "csv"):
+            raise IngestError(f"不支持的格式: {fmt}")
+        return fmt
+    if content_type and "csv" in content_type.lower():
+        return "csv"
+    return "ndjson"
+
+
+def parse_time(value: Any) -> datetime:
+    """解析 epoch 秒或 ISO 时间为 UTC 时间；无时区的 ISO 时间按 UTC 处理，与 CURRENT_TIMESTAMP 写入的时间一致"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    text = str(value).strip()
+    try:
+        return datetime.fromtimestamp(float(text), tz=timezone.utc)
+    except ValueError:
+        moment = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def _sql_timestamp(value: Any) -> str:
+    """转换为 SQLite CURRENT_TIMESTAMP 的格式（UTC）"""
+    return parse_time(value).strftime("%Y-%m-%d %H:%M:%S")
+
+
+async def iter_lines(chunks: AsyncIterator[bytes],
+                     max_line: int = MAX_LINE_BYTES) -> AsyncIterator[Optional[bytes]]:
+    """把任意切分的字节块还原为行，只缓存最后一个不完整的行
+
+    不完整的行按片段缓存、换行到达时一次拼接；超过 max_line 字节的行不再缓存，以 None 代替。
+    """
+    parts: List[bytes] = []
+    size = 0
+    too_long = False
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        pieces = chunk.split(b"\n")
+        for piece in pieces[:-1]:
+            if too_long or size + len(piece) > max_line:
+                yield None
+            elif parts:
+                parts.append(piece)
+                yield b"".join(parts)
+            else:
+                yield piece
+            parts, size, too_long = [], 0, False
+        tail = pieces[-1]
+        if tail and not too_long:
+            size += len(tail)
+            if size > max_line:
+                parts, too_long = [], True
+            else:
+                parts.append(tail)
+    if too_long:
+        yield None
+    elif parts:
+        yield b"".join(parts)
+
+
+def parse_batch(kind: str, fmt: str, header: Optional[List[str]], lines: List[Tuple[int, Optional[bytes]]],
+                scorer: Scorer) -> Tuple[List[tuple], Dict[str, Any]]:
+    """解析并校验一批行，返回待写入的行与该批的报告"""
+    fields = SCHEMAS[kind]["fields"]
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    errors: List[Dict[str, Any]] = []
+    rejected = 0
+
+    def reject(line_no: int, message: str):
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < MAX_ERRORS_PER_BATCH:
+            errors.append({"line": line_no, "error": message})
+
+    line_numbers: List[int] = []
+    stamps: List[str] = []
+    values: Dict[str, List[Any]] = {name: [] for name in fields}
+    for line_no, raw in lines:
+        if raw is None:
+            reject(line_no, f"行长度超过 {MAX_LINE_BYTES} 字节")
+            continue
+        try:
+            text = raw.decode("utf-8").strip()
+            if fmt == "ndjson":
+                record = json.loads(text)
+                if not isinstance(record, dict):
+                    raise ValueError("每行必须是 JSON 对象")
+            else:
+                record = dict(zip(header, next(csv.reader([text]))))
+            row = {}
+            for name, (cast, _, _) in fields.items():
+                value = record.get(name)
+                if value is None or value == "":
+                    raise ValueError(f"缺少字段 {name}")
+                row[name] = cast(float(value)) if cast is int else float(value)
+            stamp = record.get("timestamp")
+            stamp = _sql_timestamp(stamp) if stamp not in (None, "") else now
+        except (ValueError, TypeError, OverflowError, UnicodeDecodeError) as e:
+            reject(line_no, str(e))
+            continue
+        line_numbers.append(line_no)
+        stamps.append(stamp)
+        for name in fields:
+            values[name].append(row[name])
+
+    # 向量化范围校验
+    arrays = {name: np.asarray(column, dtype=np.float64) for name, column in values.items()}
+    valid = np.ones(len(line_numbers), dtype=bool)
+    for name, (_, low, high) in fields.items():
+        bad = (arrays[name] < low) | (arrays[name] > high) | ~np.isfinite(arrays[name])
+        for i in np.flatnonzero(bad & valid).tolist():
+            reject(line_numbers[i], f"{name} 超出范围 [{low}, {high}]")
+        valid &= ~bad
+
+    keep = np.flatnonzero(valid)
+    columns = {name: arrays[name][keep].astype(np.int64 if cast is int else np.float64)
+               for name, (cast, _, _) in fields.items()}
+    scores = scorer(columns) if keep.size else np.zeros(0)
+    rows = list(zip([stamps[i] for i in keep.tolist()],
+                    *(columns[name].tolist() for name in fields),
+                    np.asarray(scores).tolist()))
+
+    report = {
+        "first_line": lines[0][0] if lines else None,
+        "rows": len(lines),
+        "accepted": len(rows),
+        "rejected": rejected,
+        "errors": errors,
+    }
+    return rows, report
+
+
+async def ingest_stream(chunks: AsyncIterator[bytes], kind: str, fmt: str, scorer: Scorer, writer,
+                        batch_size: int = INGEST_BATCH_SIZE) -> Dict[str, Any]:
+    """流式导入：解析下一批的同时等待上一批提交，最多一个批次在途"""
+    fields = SCHEMAS[kind]["fields"]
+    sql = insert_sql(kind)
+    started = time.perf_counter()
+    header: Optional[List[str]] = None
+    batches: List[Dict[str, Any]] = []
+    in_flight = None
+    totals = {"rows": 0, "accepted": 0, "rejected": 0}
+    failed_batches = 0
+
+    async def commit(rows: List[tuple], report: Dict[str, Any]):
+        """提交一批；数据库错误只使该批失败，之前已提交的批次照常报告，客户端可据此只重发失败的批次"""
+        nonlocal failed_batches
+        try:
+            await executor.run_io(writer.submit_many, sql, rows, True)
+        except sqlite3.Error as e:
+            logger.error(f"{kind} 数据导入第 {report['batch']} 批写入失败: {e}")
+            failed_batches += 1
+            totals["accepted"] -= report["accepted"]
+            totals["rejected"] += report["accepted"]
+            report["rejected"] += report["accepted"]
+            report["accepted"] = 0
+            report["error"] = f"写入失败: {e}"
+
+    async def flush(lines: List[Tuple[int, Optional[bytes]]]):
+        nonlocal in_flight
+        rows, report = await executor.run_cpu(parse_batch, kind, fmt, header, lines, scorer)
+        if in_flight is not None:
+            await in_flight
+        # 等待提交完成，使每批成为一个有界事务并对客户端形成背压
+        in_flight = None
+        report["batch"] = len(batches)
+        batches.append(report)
+        for key in totals:
+            totals[key] += report[key]
+        if rows:
+            in_flight = asyncio.ensure_future(commit(rows, report))
+
+    lines: List[Tuple[int, Optional[bytes]]] = []
+    line_no = 0
+    async for line in iter_lines(chunks):
+        line_no += 1
+        if line is not None and not line.strip():
+            continue
+        if fmt == "csv" and header is None:
+            if line is None:
+                raise IngestError(f"CSV 表头超过 {MAX_LINE_BYTES} 字节")
+            header = [name.strip() for name in next(csv.reader([line.decode("utf-8", "replace")]))]
+            missing = [name for name in fields if name not in header]
+            if missing:
+                raise IngestError(f"CSV 表头缺少字段: {', '.join(missing)}")
+            continue
+        lines.append((line_no, line))
+        if len(lines) >= batch_size:
+            await flush(lines)
+            lines = []
+    if lines:
+        await flush(lines)
+    if in_flight is not None:
+        await in_flight
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"{kind} 数据导入完成: {totals['accepted']}/{totals['rows']} 行, {elapsed:.2f}s")
+    return {
+        "kind": kind,
+        "format": fmt,
+        **totals,
+        "failed_batches": failed_batches,
+        "batches": batches,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_sec": round(totals["accepted"] / elapsed, 1) if elapsed > 0 else None,
+    }
@@ -1,17 +1,41 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 import uvicorn
 import numpy as np
 import json
 import asyncio
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Union
 import sqlite3
 import os
+import time
+import hmac
 import logging
 
+import city_binary
+import city_cache
+import city_engine
+import city_solar
+import city_spatial
+import city_tiles
+import executor
+from database import connect, pool, writer
+from overview_stats import overview_stats
+import rollups
+import merkle_anchor
+from hash_index import hash_index
+from realtime_feed import feed_hub
+import ingest
+import metrics
+import traffic_forecast
+from traffic_forecast import traffic_forecaster
+import retention
+from retention import retention_manager
+import change_feed
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,11 +51,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求指标（最外层，计时包含 CORS 处理）
+app.add_middleware(metrics.MetricsMiddleware, registry=metrics.registry, profiler=metrics.profiler)
+
 # 数据库初始化
 def init_database():
-    conn = sqlite3.connect('smart_city.db')
+    conn = connect()
     cursor = conn.cursor()
     
+    # 新建数据库启用增量 vacuum，归档删除后可在后台逐步收缩文件；
+    # WAL 模式下文件头已写入，需要对空库执行一次 VACUUM 才能生效（已有数据的库不做转换）
+    if cursor.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute("VACUUM")
+    
     # 交通数据表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS traffic_data (
@@ -40,9 +73,14 @@ def init_database():
             vehicle_count INTEGER,
             avg_speed REAL,
             signal_cycle INTEGER,
-            optimization_score REAL
+            optimization_score REAL,
+            intersection_id INTEGER
         )
     ''')
+    # 旧数据库补充路口编号列（用于按路口训练流量预测）
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(traffic_data)")}
+    if "intersection_id" not in columns:
+        cursor.execute("ALTER TABLE traffic_data ADD COLUMN intersection_id INTEGER")
     
     # 健康数据表
     cursor.execute('''
@@ -82,11 +120,103 @@ def init_database():
         )
     ''')
     
+    # 交通/健康历史汇总表
+    rollups.init_tables(conn)
+    
+    # Merkle 批量锚定表
+    merkle_anchor.init_tables(conn)
+    
+    # 交通预测模型状态表
+    traffic_forecast.init_tables(conn)
+    
+    # 归档文件清单
+    retention.init_tables(conn)
+    
+    # 存证查询索引：按数据哈希或交易哈希校验
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_blockchain_data_hash ON blockchain_data(data_hash)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_blockchain_transaction_hash ON blockchain_data(transaction_hash)")
+    
+    # 时间戳索引：用于启动时重建 24 小时滚动统计
+    for table in ("traffic_data", "health_data", "city_configs"):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_timestamp ON {table}(timestamp)")
+    
     conn.commit()
     conn.close()
 
 # 启动时初始化数据库
 init_database()
+rollup_maintainer = rollups.RollupMaintainer()
+
+# 多进程部署（start_backend.py --prod --workers N）时由启动器在导入本模块前设置
+MULTI_PROCESS = os.getenv("SMART_CITY_MULTIPROCESS") == "1"
+_LAUNCHED_AT = float(os.getenv("SMART_CITY_LAUNCH_TIME") or time.time())
+
+# 需要看到所有进程写入的内存聚合所依赖的表
+TAILED_TABLES = ("traffic_data", "health_data", "city_configs", "blockchain_data")
+change_tailer = change_feed.ChangeTailer(TAILED_TABLES)
+
+# 冷启动各阶段耗时（秒），通过 /metrics 导出
+startup_timings: Dict[str, float] = {}
+_preloaded_positions: Optional[Dict[str, int]] = None
+
+def preload_state():
+    """从数据库重建内存聚合并记录各表水位
+
+    多进程模式下由启动器在 fork 之前于主进程中调用一次（此时没有任何写入者），
+    工作进程继承重建好的状态并从同一水位开始订阅变更。使用独立连接，不在 fork 前留下池化连接。
+    """
+    global _preloaded_positions
+    started = time.perf_counter()
+    conn = connect()
+    try:
+        overview_stats.rebuild(conn, retention.archived_counts(conn))
+        rollups.backfill(conn)
+        hash_index.rebuild(conn)
+        traffic_forecaster.load(conn)
+        _preloaded_positions = change_feed.watermarks(conn, TAILED_TABLES)
+    finally:
+        conn.close()
+    startup_timings["preload"] = time.perf_counter() - started
+
+@app.on_event("startup")
+async def start_database_writer():
+    # 先从数据库重建内存聚合（启动器已预加载时直接沿用），再增量维护
+    if _preloaded_positions is None:
+        preload_state()
+    # 汇总表与原始行在同一事务中写回数据库，只能由产生写入的进程维护一次
+    writer.add_transaction_hook(rollup_maintainer.statements)
+    for listener in (overview_stats.on_commit, hash_index.on_commit, traffic_forecaster.on_commit):
+        if MULTI_PROCESS:
+            # 写后队列只能看到本进程的写入，改由变更订阅按 id 顺序分发所有进程的记录
+            change_tailer.add_listener(listener)
+        else:
+            writer.add_commit_listener(listener)
+    writer.start()
+    if MULTI_PROCESS:
+        change_tailer.start(_preloaded_positions)
+    if merkle_anchor.ANCHOR_MODE == "batch":
+        anchor_batcher.start()
+    feed_hub.start()
+    retention_manager.start()
+    startup_timings["ready"] = time.time() - _LAUNCHED_AT
+    logger.info(f"服务就绪 (pid {os.getpid()}): 自启动起 {startup_timings['ready']:.2f}s")
+
+@app.on_event("shutdown")
+async def stop_database_writer():
+    # 关闭前锚定未封批的记录并刷新写后队列中剩余的数据
+    await feed_hub.stop()
+    await anchor_batcher.stop()
+    await retention_manager.stop()
+    executor.shutdown()
+    writer.stop()
+    if MULTI_PROCESS:
+        # 最后一次拉取后保存，水位即预测模型已吸收到的位置
+        change_tailer.stop()
+        traffic_forecaster.save(pool.get(), change_tailer.positions["traffic_data"])
+    else:
+        # 写后队列停止后所有已提交记录都已被预测模型吸收，再保存其状态
+        traffic_forecaster.save(pool.get())
+    pool.close()
 
 # ==================== 数据模型 ====================
 
@@ -94,6 +224,13 @@ class TrafficInput(BaseModel):
     vehicle_count: int
     avg_speed: float
     signal_cycle: int
+    intersection_id: Optional[int] = Field(None, ge=0, lt=traffic_forecast.MAX_INTERSECTIONS)
+
+class TrafficBatchInput(BaseModel):
+    vehicle_count: List[int]
+    avg_speed: List[float]
+    signal_cycle: List[int]
+    intersection_id: Optional[List[int]] = None
 
 class HealthInput(BaseModel):
     heart_rate: int
@@ -102,22 +239,73 @@ class HealthInput(BaseModel):
     exercise_minutes: int
     sleep_hours: float
 
+class HealthBatchInput(BaseModel):
+    heart_rate: List[int]
+    systolic_bp: List[int]
+    diastolic_bp: List[int]
+    exercise_minutes: List[int]
+    sleep_hours: List[float]
+
 class CityConfig(BaseModel):
     seed: int
     grid_size: int
     max_height: int
+    include_buildings: bool = True
+
+class CityStreamConfig(BaseModel):
+    seed: int
+    grid_size: int
+    max_height: int
+    tile_size: Optional[int] = None  # 为空时逐行输出
+
+class CityRef(BaseModel):
+    seed: int
+    grid_size: int
+    max_height: int
+
+class SpatialRadiusQuery(CityRef):
+    points: List[List[float]] = Field(..., max_length=city_spatial.MAX_BATCH_POINTS, description="[[x, z], ...]")
+    radius: Union[float, List[float]] = Field(..., description="统一半径，或与 points 等长的半径列表")
+
+class SpatialNearestGreenQuery(CityRef):
+    points: Optional[List[List[int]]] = Field(None, max_length=city_spatial.MAX_BATCH_POINTS,
+                                              description="[[x, z], ...] 网格点")
+    building_type: Optional[str] = Field(None, description="统计该类型全部建筑到最近绿地的距离分布")
+
+class SpatialPolygonQuery(CityRef):
+    polygons: List[List[List[float]]] = Field(..., max_length=city_spatial.MAX_POLYGONS,
+                                              description="[[[x, z], ...], ...]，每个多边形至少 3 个顶点")
+    limit: int = Field(0, ge=0, le=city_spatial.MAX_LISTED_BUILDINGS, description="每个多边形列出的建筑数")
+
+class SolarSimulationRequest(CityRef):
+    horizon: str = Field("day", pattern="^(day|year)$", description="day 为一天（逐时间步输出），year 为一年（按天汇总）")
+    day_of_year: int = Field(172, ge=1, le=city_solar.DAYS_PER_YEAR, description="horizon 为 day 时模拟的日期")
+    step_minutes: int = Field(60, ge=1, le=city_solar.MINUTES_PER_DAY)
+    latitude: float = Field(city_solar.DEFAULT_LATITUDE, ge=-90, le=90)
+    shading: bool = True
+    shadow_range: int = Field(city_solar.DEFAULT_SHADOW_RANGE, ge=1, le=city_solar.MAX_SHADOW_RANGE,
+                              description="考虑遮挡的最大距离（网格数）")
+    parallel: bool = Field(False, description="各太阳方位扇区并行计算")
 
 class BlockchainData(BaseModel):
     data_content: str
     wallet_address: str
 
+class MerkleProofInput(BaseModel):
+    data_hash: str
+    merkle_root: str
+    proof: List[Dict[str, str]]
+
+class BulkVerifyInput(BaseModel):
+    hashes: List[str]
+
 # ==================== 智能交通优化模块 ====================
 
 class TrafficOptimizer:
     @staticmethod
-    def optimize_signals(vehicle_count: int, avg_speed: float, signal_cycle: int) -> Dict[str, Any]:
+    def optimize_signals(vehicle_count: int, avg_speed: float, signal_cycle: int,
+                         intersection_id: Optional[int] = None) -> Dict[str, Any]:
         """基于机器学习算法优化交通信号灯"""
-        
         # 计算交通密度
         traffic_density = vehicle_count / max(avg_speed, 1)
         
@@ -135,10 +323,9 @@ class TrafficOptimizer:
             red_time = signal_cycle - green_time
             efficiency_improvement = 15
         
-        # 预测下一小时流量
-        base_prediction = vehicle_count
-        time_factor = np.sin(datetime.now().hour * np.pi / 12) * 0.3 + 1
-        next_hour_prediction = int(base_prediction * time_factor * (1 + np.random.normal(0, 0.1)))
+        # 预测下一小时流量（基于历史数据训练的周内小时季节模型）
+        ids = None if intersection_id is None else np.array([intersection_id])
+        next_hour_prediction = int(traffic_forecaster.forecast(np.array([vehicle_count]), ids)[0])
         
         # 计算拥堵概率
         congestion_probability = min(100, max(0, (traffic_density - 20) * 2))
@@ -151,11 +338,50 @@ class TrafficOptimizer:
             },
             "traffic_prediction": {
                 "next_hour_vehicles": next_hour_prediction,
-                "peak_hours": "17:30-19:00",
+                "peak_hours": traffic_forecaster.peak_hours(),
                 "congestion_probability": int(congestion_probability)
             },
             "optimization_score": min(100, 60 + efficiency_improvement)
         }
+    
+    @staticmethod
+    def optimize_signals_batch(vehicle_count: np.ndarray, avg_speed: np.ndarray, signal_cycle: np.ndarray,
+                               intersection_id: Optional[np.ndarray] = None,
+                               next_hour_vehicles: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """批量优化交通信号灯（向量化版本，逐项结果与 optimize_signals 一致）
+
+        next_hour_vehicles 可由调用方预先算好传入：进程池模式下工作进程中的预测模型没有训练状态。
+        """
+        vehicle_count = np.asarray(vehicle_count, dtype=np.int64)
+        avg_speed = np.asarray(avg_speed, dtype=np.float64)
+        signal_cycle = np.asarray(signal_cycle, dtype=np.int64)
+        
+        # 计算交通密度
+        traffic_density = vehicle_count / np.maximum(avg_speed, 1)
+        high = traffic_density > 50
+        medium = ~high & (traffic_density > 25)
+        
+        # 基于交通密度调整信号灯时长
+        green_time = signal_cycle * np.select([high, medium], [0.7, 0.6], 0.5)
+        green_time = np.where(high, np.minimum(90, green_time), green_time)
+        red_time = signal_cycle - green_time
+        efficiency_improvement = np.select([high, medium], [35, 25], 15)
+        
+        # 预测下一小时流量（一次向量化查表）
+        if next_hour_vehicles is None:
+            next_hour_vehicles = traffic_forecaster.forecast(vehicle_count, intersection_id)
+        
+        # 计算拥堵概率
+        congestion_probability = np.clip((traffic_density - 20) * 2, 0, 100)
+        
+        return {
+            "green_time": green_time.astype(np.int64),
+            "red_time": red_time.astype(np.int64),
+            "efficiency_improvement": efficiency_improvement,
+            "next_hour_vehicles": np.asarray(next_hour_vehicles, dtype=np.int64),
+            "congestion_probability": congestion_probability.astype(np.int64),
+            "optimization_score": np.minimum(100, 60 + efficiency_improvement)
+        }
 
 @app.post("/api/traffic/optimize")
 async def optimize_traffic(traffic_data: TrafficInput):
@@ -165,19 +391,16 @@ async def optimize_traffic(traffic_data: TrafficInput):
         result = TrafficOptimizer.optimize_signals(
             traffic_data.vehicle_count,
             traffic_data.avg_speed,
-            traffic_data.signal_cycle
+            traffic_data.signal_cycle,
+            traffic_data.intersection_id
         )
         
         # 保存到数据库
-        conn = sqlite3.connect('smart_city.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO traffic_data (vehicle_count, avg_speed, signal_cycle, optimization_score)
-            VALUES (?, ?, ?, ?)
+        await writer.asubmit('''
+            INSERT INTO traffic_data (vehicle_count, avg_speed, signal_cycle, optimization_score, intersection_id)
+            VALUES (?, ?, ?, ?, ?)
         ''', (traffic_data.vehicle_count, traffic_data.avg_speed, 
-              traffic_data.signal_cycle, result['optimization_score']))
-        conn.commit()
-        conn.close()
+              traffic_data.signal_cycle, result['optimization_score'], traffic_data.intersection_id))
         
         logger.info(f"交通优化完成: 效率提升 {result['signal_optimization']['efficiency_improvement']}%")
         return {"success": True, "data": result}
@@ -186,30 +409,97 @@ async def optimize_traffic(traffic_data: TrafficInput):
         logger.error(f"交通优化失败: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/traffic/realtime")
-async def get_realtime_traffic():
-    """获取实时交通数据"""
+@app.post("/api/traffic/optimize/batch")
+async def optimize_traffic_batch(batch: TrafficBatchInput):
+    """批量交通优化API（列式输入/输出，一次批量写入数据库）"""
+    count = len(batch.vehicle_count)
+    if len(batch.avg_speed) != count or len(batch.signal_cycle) != count:
+        raise HTTPException(status_code=400, detail="vehicle_count、avg_speed、signal_cycle 长度必须一致")
+    intersection_id = batch.intersection_id
+    if intersection_id is not None:
+        if len(intersection_id) != count:
+            raise HTTPException(status_code=400, detail="intersection_id 长度必须与 vehicle_count 一致")
+        if any(i < 0 or i >= traffic_forecast.MAX_INTERSECTIONS for i in intersection_id):
+            raise HTTPException(status_code=400,
+                                detail=f"intersection_id 必须在 [0, {traffic_forecast.MAX_INTERSECTIONS}) 内")
+    try:
+        # 预测在事件循环所在进程中查表，确保使用已训练的模型状态
+        next_hour_vehicles = traffic_forecaster.forecast(np.asarray(batch.vehicle_count), intersection_id)
+        result = await executor.run_cpu(
+            TrafficOptimizer.optimize_signals_batch,
+            batch.vehicle_count,
+            batch.avg_speed,
+            batch.signal_cycle,
+            intersection_id,
+            next_hour_vehicles
+        )
+        
+        # 一次性批量写入数据库
+        ids = intersection_id if intersection_id is not None else [None] * count
+        await writer.asubmit_many('''
+            INSERT INTO traffic_data (vehicle_count, avg_speed, signal_cycle, optimization_score, intersection_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', list(zip(batch.vehicle_count, batch.avg_speed, batch.signal_cycle,
+                       result["optimization_score"].tolist(), ids)))
+        
+        logger.info(f"批量交通优化完成: {count} 个路口")
+        data = {name: values.tolist() for name, values in result.items()}
+        data["count"] = count
+        data["peak_hours"] = traffic_forecaster.peak_hours()
+        return JSONResponse({"success": True, "data": data})
+        
+    except Exception as e:
+        logger.error(f"批量交通优化失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def sample_realtime_traffic() -> Dict[str, Any]:
+    """生成一次实时交通样本"""
     # 模拟实时数据
+    rng = np.random.default_rng()
     current_time = datetime.now()
     base_flow = 1200
     
     # 根据时间调整流量
     hour_factor = np.sin((current_time.hour - 6) * np.pi / 12) * 0.4 + 1
-    vehicle_count = int(base_flow * hour_factor * (1 + np.random.normal(0, 0.1)))
+    vehicle_count = int(base_flow * hour_factor * (1 + rng.normal(0, 0.1)))
     
-    avg_speed = max(20, 50 - (vehicle_count - 1000) / 50 + np.random.normal(0, 5))
-    wait_time = max(1, (vehicle_count - 800) / 200 + np.random.normal(0, 0.5))
-    efficiency = max(60, 100 - (vehicle_count - 800) / 20 + np.random.normal(0, 5))
+    avg_speed = max(20, 50 - (vehicle_count - 1000) / 50 + rng.normal(0, 5))
+    wait_time = max(1, (vehicle_count - 800) / 200 + rng.normal(0, 0.5))
+    efficiency = max(60, 100 - (vehicle_count - 800) / 20 + rng.normal(0, 5))
     
     return {
         "vehicle_count": vehicle_count,
         "avg_speed": round(avg_speed, 1),
         "wait_time": round(wait_time, 1),
         "efficiency": int(efficiency),
-        "signal_status": "正常运行" if np.random.random() > 0.1 else "维护中",
+        "signal_status": "正常运行" if rng.random() > 0.1 else "维护中",
         "timestamp": current_time.isoformat()
     }
 
+@app.get("/api/traffic/forecast")
+async def get_traffic_forecast(hours: int = Query(24, gt=0, le=168),
+                               intersection_id: Optional[int] = Query(None, ge=0,
+                                                                      lt=traffic_forecast.MAX_INTERSECTIONS)):
+    """未来若干小时的逐小时流量预测（全网或指定路口）"""
+    series = traffic_forecast.NETWORK_SERIES if intersection_id is None else intersection_id + 1
+    hourly = traffic_forecaster.profile(series, hours=hours)
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    return {
+        "success": True,
+        "data": {
+            "intersection_id": intersection_id,
+            "hours": [(now + timedelta(hours=h)).isoformat() for h in range(hours)],
+            "vehicles": np.maximum(hourly, 0).round().astype(np.int64).tolist(),
+            "peak_hours": traffic_forecaster.peak_hours(series),
+            "trained": bool(hourly.any())
+        }
+    }
+
+@app.get("/api/traffic/realtime")
+async def get_realtime_traffic():
+    """获取实时交通数据（与推送通道共享同一周期的样本）"""
+    return feed_hub.latest("traffic")
+
 # ==================== 健康数据分析模块 ====================
 
 class HealthAnalyzer:
@@ -274,6 +564,51 @@ class HealthAnalyzer:
             }
         }
 
+    # 批量结果中等级字段的编码（数组下标即编码值）
+    EXERCISE_LEVELS = ["不足", "达标", "优秀"]
+    SLEEP_LEVELS = ["需改善", "良好", "优秀"]
+    
+    @staticmethod
+    def analyze_health_batch(heart_rate: np.ndarray, systolic_bp: np.ndarray, diastolic_bp: np.ndarray,
+                             exercise_minutes: np.ndarray, sleep_hours: np.ndarray) -> Dict[str, np.ndarray]:
+        """批量分析健康数据（向量化版本，评分与 analyze_health 逐项一致）"""
+        heart_rate = np.asarray(heart_rate, dtype=np.int64)
+        systolic_bp = np.asarray(systolic_bp, dtype=np.int64)
+        diastolic_bp = np.asarray(diastolic_bp, dtype=np.int64)
+        exercise_minutes = np.asarray(exercise_minutes, dtype=np.int64)
+        sleep_hours = np.asarray(sleep_hours, dtype=np.float64)
+        
+        # 心血管健康评估
+        abnormal_hr = (heart_rate < 60) | (heart_rate > 100)
+        high_bp = (systolic_bp > 140) | (diastolic_bp > 90)
+        elevated_bp = ~high_bp & ((systolic_bp > 120) | (diastolic_bp > 80))
+        cardiovascular_score = 100 - 20 * abnormal_hr - 30 * high_bp - 10 * elevated_bp
+        
+        # 运动水平评估
+        exercise_score = np.minimum(100, exercise_minutes * 2)
+        exercise_level = (exercise_minutes >= 30).astype(np.uint8) + (exercise_minutes >= 60)
+        
+        # 睡眠质量评估
+        poor_sleep = (sleep_hours < 6) | (sleep_hours > 9)
+        fair_sleep = ~poor_sleep & ((sleep_hours < 7) | (sleep_hours > 8))
+        sleep_score = 100 - 30 * poor_sleep - 10 * fair_sleep
+        sleep_quality = (sleep_score >= 70).astype(np.uint8) + (sleep_score >= 90)
+        
+        # 综合健康评分
+        overall_score = (cardiovascular_score * 0.4 + exercise_score * 0.3 + sleep_score * 0.3).astype(np.int64)
+        
+        return {
+            "cardiovascular_score": cardiovascular_score,
+            "exercise_score": exercise_score,
+            "sleep_score": sleep_score,
+            "health_score": overall_score,
+            "exercise_level": exercise_level,
+            "sleep_quality": sleep_quality,
+            "cardiovascular_ok": cardiovascular_score >= 80,
+            "hypertension_risk": systolic_bp > 140,
+            "cardiovascular_risk": heart_rate > 90
+        }
+
 @app.post("/api/health/analyze")
 async def analyze_health(health_data: HealthInput):
     """健康数据分析API"""
@@ -288,16 +623,12 @@ async def analyze_health(health_data: HealthInput):
         )
         
         # 保存到数据库
-        conn = sqlite3.connect('smart_city.db')
-        cursor = conn.cursor()
-        cursor.execute('''
+        await writer.asubmit('''
             INSERT INTO health_data (heart_rate, systolic_bp, diastolic_bp, 
                                    exercise_minutes, sleep_hours, health_score)
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (health_data.heart_rate, health_data.systolic_bp, health_data.diastolic_bp,
               health_data.exercise_minutes, health_data.sleep_hours, result['health_score']))
-        conn.commit()
-        conn.close()
         
         logger.info(f"健康分析完成: 综合评分 {result['health_score']}")
         return {"success": True, "data": result}
@@ -306,18 +637,63 @@ async def analyze_health(health_data: HealthInput):
         logger.error(f"健康分析失败: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/health/realtime")
-async def get_realtime_health():
-    """获取实时健康监控数据"""
+@app.post("/api/health/analyze/batch")
+async def analyze_health_batch(batch: HealthBatchInput):
+    """批量健康数据分析API（列式输入/输出，一次批量写入数据库）"""
+    count = len(batch.heart_rate)
+    columns = [batch.systolic_bp, batch.diastolic_bp, batch.exercise_minutes, batch.sleep_hours]
+    if any(len(column) != count for column in columns):
+        raise HTTPException(status_code=400, detail="所有字段的数组长度必须一致")
+    try:
+        result = await executor.run_cpu(
+            HealthAnalyzer.analyze_health_batch,
+            batch.heart_rate,
+            batch.systolic_bp,
+            batch.diastolic_bp,
+            batch.exercise_minutes,
+            batch.sleep_hours
+        )
+        
+        # 一次性批量写入数据库
+        await writer.asubmit_many('''
+            INSERT INTO health_data (heart_rate, systolic_bp, diastolic_bp, 
+                                   exercise_minutes, sleep_hours, health_score)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', list(zip(batch.heart_rate, batch.systolic_bp, batch.diastolic_bp,
+                       batch.exercise_minutes, batch.sleep_hours, result["health_score"].tolist())))
+        
+        data = {name: values.tolist() for name, values in result.items()}
+        data["count"] = count
+        data["levels"] = {
+            "exercise_level": HealthAnalyzer.EXERCISE_LEVELS,
+            "sleep_quality": HealthAnalyzer.SLEEP_LEVELS
+        }
+        data["summary"] = {
+            "avg_health_score": round(float(result["health_score"].mean()), 1) if count else 0,
+            "hypertension_risk_count": int(result["hypertension_risk"].sum()),
+            "cardiovascular_risk_count": int(result["cardiovascular_risk"].sum())
+        }
+        
+        logger.info(f"批量健康分析完成: {count} 条记录")
+        # 结果均为原生类型，直接序列化以跳过 jsonable_encoder 对大数组的逐项遍历
+        return JSONResponse({"success": True, "data": data})
+        
+    except Exception as e:
+        logger.error(f"批量健康分析失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def sample_realtime_health() -> Dict[str, Any]:
+    """生成一次实时健康监控样本"""
     # 模拟实时健康数据
+    rng = np.random.default_rng()
     base_hr = 72
     time_variation = np.sin(datetime.now().minute * np.pi / 30) * 5
-    heart_rate = int(base_hr + time_variation + np.random.normal(0, 3))
+    heart_rate = int(base_hr + time_variation + rng.normal(0, 3))
     
-    body_temp = round(36.5 + np.random.normal(0, 0.3), 1)
-    spo2 = max(95, int(98 + np.random.normal(0, 1)))
-    daily_steps = int(8000 + np.random.normal(0, 1000))
-    health_score = max(70, int(85 + np.random.normal(0, 5)))
+    body_temp = round(36.5 + rng.normal(0, 0.3), 1)
+    spo2 = max(95, int(98 + rng.normal(0, 1)))
+    daily_steps = int(8000 + rng.normal(0, 1000))
+    health_score = max(70, int(85 + rng.normal(0, 5)))
     
     return {
         "heart_rate": heart_rate,
@@ -328,100 +704,249 @@ async def get_realtime_health():
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/api/health/realtime")
+async def get_realtime_health():
+    """获取实时健康监控数据（与推送通道共享同一周期的样本）"""
+    return feed_hub.latest("health")
+
 # ==================== 3D城市生成模块 ====================
 
 class CityGenerator:
     @staticmethod
-    def generate_city_data(seed: int, grid_size: int, max_height: int) -> Dict[str, Any]:
-        """生成3D城市数据"""
-        np.random.seed(seed)
-        
-        buildings = []
-        total_energy = 0
-        green_spaces = 0
-        
-        for x in range(grid_size):
-            for z in range(grid_size):
-                # 生成建筑高度
-                height = np.random.randint(2, max_height + 1)
-                
-                # 建筑类型
-                building_types = ['residential', 'commercial', 'industrial', 'green']
-                building_type = np.random.choice(building_types, p=[0.4, 0.3, 0.2, 0.1])
-                
-                # 太阳能板覆盖率
-                solar_coverage = np.random.uniform(0.3, 0.9) if building_type != 'green' else 0
-                
-                # 能源生产计算
-                energy_production = height * solar_coverage * 10
-                total_energy += energy_production
-                
-                if building_type == 'green':
-                    green_spaces += 1
-                
-                buildings.append({
-                    "x": x,
-                    "z": z,
-                    "height": height,
-                    "type": building_type,
-                    "solar_coverage": round(solar_coverage, 2),
-                    "energy_production": round(energy_production, 1)
-                })
-        
-        # 计算可持续性指标
-        total_buildings = len(buildings)
-        green_ratio = green_spaces / total_buildings
-        avg_solar_coverage = np.mean([b['solar_coverage'] for b in buildings if b['type'] != 'green'])
-        
-        sustainability_score = (green_ratio * 40 + avg_solar_coverage * 60)
-        
-        return {
-            "buildings": buildings,
-            "statistics": {
-                "total_buildings": total_buildings,
-                "green_spaces": green_spaces,
-                "green_ratio": round(green_ratio * 100, 1),
-                "total_energy_production": round(total_energy, 1),
-                "avg_solar_coverage": round(avg_solar_coverage * 100, 1),
-                "sustainability_score": round(sustainability_score, 1)
-            },
-            "sustainable_features": {
-                "solar_panels": f"{round(avg_solar_coverage * 100, 1)}% 建筑覆盖",
-                "green_buildings": f"{green_spaces} 个生态建筑",
-                "energy_efficiency": "A级" if sustainability_score > 70 else "B级",
-                "carbon_neutral": sustainability_score > 80
-            }
-        }
+    def generate_city_data(seed: int, grid_size: int, max_height: int,
+                           include_buildings: bool = True) -> Dict[str, Any]:
+        """生成3D城市数据（整网格向量化生成，按需展开逐栋建筑）"""
+        city = city_engine.generate_arrays(seed, grid_size, max_height)
+        statistics = city_engine.compute_statistics(city)
+        return CityGenerator.format_city_data(city, statistics, include_buildings)
+    
+    @staticmethod
+    def format_city_data(city: city_engine.CityArrays, statistics: Dict[str, Any],
+                         include_buildings: bool = True) -> Dict[str, Any]:
+        """将城市数组组装为 JSON 响应结构"""
+        result = {"buildings": city_engine.to_buildings(city)} if include_buildings else {}
+        result["statistics"] = statistics
+        result["sustainable_features"] = city_engine.sustainable_features(statistics)
+        return result
+    
+    @staticmethod
+    def encode_city_binary(city: city_engine.CityArrays, statistics: Dict[str, Any]) -> bytes:
+        """将城市数组编码为二进制列式负载"""
+        return city_binary.encode(city, statistics, city_engine.sustainable_features(statistics))
 
 @app.post("/api/city/generate")
-async def generate_city(city_config: CityConfig):
-    """3D城市生成API"""
+async def generate_city(city_config: CityConfig, request: Request,
+                        format: Optional[str] = Query(None, description="json（默认）或 binary")):
+    """3D城市生成API（默认 JSON；?format=binary 或 Accept 二进制类型时返回列式二进制）
+    
+    相同参数的城市只生成一次并缓存，响应携带 ETag，客户端可通过 If-None-Match 获得 304。
+    """
+    binary = city_binary.wants_binary(request.headers.get("accept"), format)
+    variant = "binary" if binary else ("json" if city_config.include_buildings else "stats")
+    # ETag 只取决于参数，304 重新验证不读取缓存，城市被淘汰后也不会重新生成
+    digest = city_cache.city_digest(city_config.seed, city_config.grid_size, city_config.max_height)
+    etag = city_cache.city_etag(digest, variant)
+    headers = {"ETag": etag, "Vary": "Accept", "Cache-Control": "no-cache"}
+    if city_cache.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
     try:
-        # 生成城市数据
-        result = CityGenerator.generate_city_data(
+        # 从缓存获取（未命中时生成，并发的相同请求合并为一次计算）
+        entry = await city_cache.cache.get(
             city_config.seed,
             city_config.grid_size,
             city_config.max_height
         )
+        statistics = entry.statistics
         
-        # 保存到数据库
-        conn = sqlite3.connect('smart_city.db')
-        cursor = conn.cursor()
-        cursor.execute('''
+        # 保存到数据库（304 重新验证不计为一次生成）
+        await writer.asubmit('''
             INSERT INTO city_configs (seed, grid_size, max_height, sustainability_score)
             VALUES (?, ?, ?, ?)
         ''', (city_config.seed, city_config.grid_size, 
-              city_config.max_height, result['statistics']['sustainability_score']))
-        conn.commit()
-        conn.close()
+              city_config.max_height, statistics['sustainability_score']))
         
-        logger.info(f"城市生成完成: 可持续性评分 {result['statistics']['sustainability_score']}")
-        return {"success": True, "data": result}
+        logger.info(f"城市生成完成: 可持续性评分 {statistics['sustainability_score']}")
+        if binary:
+            payload = await executor.run_cpu(CityGenerator.encode_city_binary, entry.city, statistics)
+            return Response(content=payload, media_type=city_binary.MEDIA_TYPE, headers=headers)
+        
+        result = await executor.run_cpu(
+            CityGenerator.format_city_data, entry.city, statistics, city_config.include_buildings
+        )
+        return JSONResponse({"success": True, "data": result}, headers=headers)
         
     except Exception as e:
         logger.error(f"城市生成失败: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _ndjson(obj: Dict[str, Any]) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+def stream_city_ndjson(config: CityStreamConfig):
+    """逐行/逐瓦片生成城市并输出 NDJSON，统计信息作为最后一行"""
+    yield _ndjson({
+        "type": "header",
+        "seed": config.seed,
+        "grid_size": config.grid_size,
+        "max_height": config.max_height,
+        "tile_size": config.tile_size
+    })
+    
+    stats = city_engine.StatisticsAccumulator()
+    for block in city_engine.iter_tiles(config.seed, config.grid_size, config.max_height, config.tile_size):
+        stats.update(block.types, block.solar_coverage, block.energy_production)
+        rows, cols = block.heights.shape
+        yield _ndjson({
+            "type": "tile",
+            "x0": block.x0,
+            "z0": block.z0,
+            "rows": rows,
+            "cols": cols,
+            "buildings": city_engine.block_to_buildings(block)
+        })
+    
+    statistics = stats.result()
+    writer.submit('''
+        INSERT INTO city_configs (seed, grid_size, max_height, sustainability_score)
+        VALUES (?, ?, ?, ?)
+    ''', (config.seed, config.grid_size, config.max_height, statistics['sustainability_score']))
+    
+    logger.info(f"流式城市生成完成: 可持续性评分 {statistics['sustainability_score']}")
+    yield _ndjson({
+        "type": "statistics",
+        "statistics": statistics,
+        "sustainable_features": city_engine.sustainable_features(statistics)
+    })
+
+@app.post("/api/city/generate/stream")
+async def generate_city_stream(city_config: CityStreamConfig):
+    """3D城市流式生成API（NDJSON，分块传输）"""
+    if city_config.grid_size <= 0 or city_config.max_height < 2:
+        raise HTTPException(status_code=400, detail="grid_size 必须为正数且 max_height 不小于 2")
+    if city_config.tile_size is not None and city_config.tile_size <= 0:
+        raise HTTPException(status_code=400, detail="tile_size 必须为正数")
+    # 同步生成器由 Starlette 在线程池中迭代，不会阻塞事件循环
+    return StreamingResponse(stream_city_ndjson(city_config), media_type="application/x-ndjson")
+
+@app.get("/api/city/tiles")
+async def get_city_tiles(request: Request, seed: int, grid_size: int, max_height: int,
+                         bbox: Optional[str] = Query(None, description="x0,z0,x1,z1 网格坐标，默认整座城市"),
+                         lod: Optional[int] = Query(None, ge=0, description="四叉树级别，0 为根，max_level 为单栋建筑"),
+                         max_cells: int = Query(city_tiles.DEFAULT_MAX_CELLS, gt=0, le=city_tiles.MAX_TILE_CELLS)):
+    """城市分级瓦片：返回 bbox 内某一级四叉树单元的列式聚合（高度最大/平均值、主导类型、能源产出、绿地数）
+
+    未指定 lod 时自动选择单元数不超过 max_cells 的最细级别。
+    """
+    if grid_size <= 0 or max_height < 2:
+        raise HTTPException(status_code=400, detail="grid_size 必须为正数且 max_height 不小于 2")
+    try:
+        area = city_tiles.parse_bbox(bbox, grid_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    entry = await city_cache.cache.get(seed, grid_size, max_height)
+    pyramid = await city_cache.cache.get_pyramid(entry)
+    level = lod if lod is not None else pyramid.choose_level(area, max_cells)
+    
+    i0, i1, j0, j1 = pyramid.cell_range(min(level, pyramid.max_level), area)
+    etag = entry.etag(f"tiles-{level}-{i0}-{j0}-{i1}-{j1}")
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if city_cache.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        if level in pyramid.levels:
+            # 预聚合级别只需切片，直接在事件循环中完成
+            data = pyramid.query(entry.city, level, area)
+        else:
+            data = await executor.run_cpu(pyramid.query, entry.city, level, area)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse({"success": True, "data": data}, headers=headers)
+
+@app.post("/api/city/solar/simulate")
+async def simulate_city_solar(query: SolarSimulationRequest):
+    """太阳能分时模拟：按太阳位置与晴空辐照逐时间步计算发电量，并考虑相邻建筑遮挡"""
+    if query.grid_size <= 0 or query.max_height < 2:
+        raise HTTPException(status_code=400, detail="grid_size 必须为正数且 max_height 不小于 2")
+    if city_solar.MINUTES_PER_DAY % query.step_minutes:
+        raise HTTPException(status_code=400, detail="step_minutes 必须能整除 1440")
+    
+    entry = await city_cache.cache.get(query.seed, query.grid_size, query.max_height)
+    data = await executor.run_cpu(
+        city_solar.simulate, entry.city, query.horizon, query.day_of_year, query.step_minutes,
+        query.latitude, query.shading, query.shadow_range,
+        executor.EXECUTOR_WORKERS if query.parallel else 1
+    )
+    logger.info(f"太阳能模拟完成: {query.horizon} 发电量 {data['total_energy_kwh']} kWh, "
+                f"遮挡损失 {data['shading_loss_percent']}%")
+    return JSONResponse({"success": True, "data": data})
+
+async def load_spatial_index(query: CityRef):
+    """获取缓存城市及其空间索引（首次查询时构建）"""
+    if query.grid_size <= 0 or query.max_height < 2:
+        raise HTTPException(status_code=400, detail="grid_size 必须为正数且 max_height 不小于 2")
+    entry = await city_cache.cache.get(query.seed, query.grid_size, query.max_height)
+    return entry, await city_cache.cache.get_spatial_index(entry)
+
+@app.post("/api/city/spatial/radius")
+async def spatial_radius(query: SpatialRadiusQuery):
+    """批量半径查询：每个点 (x, z) 半径内的建筑数、能源产出与各类型数量"""
+    try:
+        points = city_spatial.as_points(query.points)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    radii = np.asarray(query.radius, dtype=np.float64)
+    if radii.ndim and radii.shape != (len(points),):
+        raise HTTPException(status_code=400, detail="radius 列表的长度必须与 points 相同")
+    radii = np.broadcast_to(radii, (len(points),))
+    if (radii < 0).any() or not np.isfinite(radii).all():
+        raise HTTPException(status_code=400, detail="radius 必须为非负有限数值")
+    
+    _, index = await load_spatial_index(query)
+    data = await executor.run_cpu(index.radius, points, radii)
+    return JSONResponse({"success": True, "data": data})
+
+@app.post("/api/city/spatial/nearest-green")
+async def spatial_nearest_green(query: SpatialNearestGreenQuery):
+    """最近绿地：points 为批量网格点查询；building_type 为该类型全部建筑的距离分布"""
+    if (query.points is None) == (query.building_type is None):
+        raise HTTPException(status_code=400, detail="points 与 building_type 必须且只能提供一个")
+    if query.building_type is not None and query.building_type not in city_engine.BUILDING_TYPES:
+        raise HTTPException(status_code=400, detail=f"building_type 必须为 {city_engine.BUILDING_TYPES} 之一")
+    
+    entry, index = await load_spatial_index(query)
+    if query.building_type is not None:
+        building_type = city_engine.BUILDING_TYPES.index(query.building_type)
+        data = await executor.run_cpu(index.nearest_green_summary, entry.city, building_type)
+        data["building_type"] = query.building_type
+    else:
+        try:
+            cells = city_spatial.as_points(query.points, query.grid_size)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # 查表为 O(1)，直接在事件循环中完成
+        data = index.nearest_green(cells)
+    return JSONResponse({"success": True, "data": data})
+
+@app.post("/api/city/spatial/polygon")
+async def spatial_polygon(query: SpatialPolygonQuery):
+    """批量多边形查询：每个多边形内（含边界）的建筑汇总，可选列出建筑"""
+    polygons = []
+    for vertices in query.polygons:
+        try:
+            polygon = city_spatial.as_points(vertices)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not 3 <= len(polygon) <= city_spatial.MAX_POLYGON_VERTICES:
+            raise HTTPException(status_code=400,
+                                detail=f"每个多边形的顶点数必须在 [3, {city_spatial.MAX_POLYGON_VERTICES}] 内")
+        polygons.append(polygon)
+    
+    entry, index = await load_spatial_index(query)
+    data = await executor.run_cpu(city_spatial.query_polygons, index, entry.city, polygons, query.limit)
+    return JSONResponse({"success": True, "data": data})
+
 # ==================== 区块链数据存证模块 ====================
 
 import hashlib
@@ -442,6 +967,11 @@ class BlockchainService:
         transaction_hash = hashlib.sha256(transaction_data.encode()).hexdigest()
         return f"0x{transaction_hash[:40]}"
 
+MAX_BULK_VERIFY = 100000
+
+# 批量模式下由 Merkle 批次锚定，吞吐量取决于哈希速度而非交易数
+anchor_batcher = merkle_anchor.AnchorBatcher(writer, BlockchainService.simulate_blockchain_storage)
+
 @app.post("/api/blockchain/store")
 async def store_blockchain_data(blockchain_data: BlockchainData):
     """区块链数据存证API"""
@@ -449,29 +979,40 @@ async def store_blockchain_data(blockchain_data: BlockchainData):
         # 创建数据哈希
         data_hash = BlockchainService.create_data_hash(blockchain_data.data_content)
         
+        if merkle_anchor.ANCHOR_MODE == "batch":
+            position = await anchor_batcher.add(
+                data_hash, blockchain_data.data_content, blockchain_data.wallet_address
+            )
+            result = {
+                "data_hash": data_hash,
+                "status": "pending",
+                "batch_id": position["batch_id"],
+                "leaf_index": position["leaf_index"],
+                "anchor_window": f"~{merkle_anchor.ANCHOR_WINDOW:g}秒",
+                "proof_url": f"/api/blockchain/proof/{data_hash}"
+            }
+            return {"success": True, "data": result}
+        
         # 模拟区块链存储
         transaction_hash = BlockchainService.simulate_blockchain_storage(
             data_hash, blockchain_data.wallet_address
         )
         
         # 保存到数据库
-        conn = sqlite3.connect('smart_city.db')
-        cursor = conn.cursor()
-        cursor.execute('''
+        await writer.asubmit('''
             INSERT INTO blockchain_data (data_hash, data_content, wallet_address, transaction_hash)
             VALUES (?, ?, ?, ?)
         ''', (data_hash, blockchain_data.data_content, 
               blockchain_data.wallet_address, transaction_hash))
-        conn.commit()
-        conn.close()
         
+        rng = np.random.default_rng()
         result = {
             "data_hash": data_hash,
             "transaction_hash": transaction_hash,
-            "block_number": np.random.randint(1000000, 2000000),
-            "gas_used": np.random.randint(21000, 50000),
+            "block_number": int(rng.integers(1000000, 2000000)),
+            "gas_used": int(rng.integers(21000, 50000)),
             "confirmation_time": "~15秒",
-            "storage_cost": f"{np.random.uniform(0.001, 0.01):.4f} ETH"
+            "storage_cost": f"{rng.uniform(0.001, 0.01):.4f} ETH"
         }
         
         logger.info(f"区块链存证完成: 交易哈希 {transaction_hash}")
@@ -481,51 +1022,284 @@ async def store_blockchain_data(blockchain_data: BlockchainData):
         logger.error(f"区块链存证失败: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/blockchain/stats")
-async def get_blockchain_stats():
-    """获取区块链网络统计"""
+@app.get("/api/blockchain/proof/{data_hash}")
+async def get_merkle_proof(data_hash: str):
+    """获取记录的 Merkle 包含证明并校验"""
+    pending = anchor_batcher.pending_position(data_hash)
+    if pending is not None:
+        return {"success": True, "data": {"data_hash": data_hash, "status": "pending", **pending}}
+    
+    proof = await executor.run_io(lambda: anchor_batcher.get_proof(pool.get(), data_hash))
+    if proof is None:
+        raise HTTPException(status_code=404, detail="未找到该数据哈希的批量锚定记录")
+    proof["status"] = "anchored"
+    return {"success": True, "data": proof}
+
+@app.post("/api/blockchain/proof/verify")
+async def verify_merkle_proof(proof_input: MerkleProofInput):
+    """校验客户端提交的 Merkle 包含证明"""
+    verified = merkle_anchor.verify_proof(proof_input.data_hash, proof_input.proof, proof_input.merkle_root)
+    return {"success": True, "data": {"verified": verified}}
+
+@app.get("/api/blockchain/verify/{hash_value}")
+async def verify_blockchain_record(hash_value: str):
+    """按数据哈希或交易哈希查询存证记录"""
+    pending = anchor_batcher.pending_position(hash_value)
+    if pending is not None:
+        return {"success": True, "data": {"exists": True, "status": "pending", "data_hash": hash_value, **pending}}
+    
+    record = await executor.run_io(lambda: hash_index.lookup(pool.get(), hash_value))
+    if record is None:
+        return {"success": True, "data": {"exists": False}}
+    return {"success": True, "data": {"exists": True, "status": "stored", **record}}
+
+@app.post("/api/blockchain/verify/bulk")
+async def verify_blockchain_records(verify_input: BulkVerifyInput):
+    """批量校验哈希是否已存证，返回与输入顺序一致的结果"""
+    if len(verify_input.hashes) > MAX_BULK_VERIFY:
+        raise HTTPException(status_code=422, detail=f"单次最多校验 {MAX_BULK_VERIFY} 个哈希")
+    
+    result = await executor.run_io(lambda: hash_index.bulk_lookup(pool.get(), verify_input.hashes))
+    # 尚在 Merkle 批次中等待锚定的记录视为已存证（交易哈希待定）
+    pending = 0
+    for i, value in enumerate(verify_input.hashes):
+        if not result["exists"][i] and anchor_batcher.pending_position(value) is not None:
+            result["exists"][i] = True
+            pending += 1
+    result["found"] += pending
+    result["pending"] = pending
+    return JSONResponse({"success": True, "data": result})
+
+def sample_blockchain_stats() -> Dict[str, Any]:
+    """生成一次区块链网络统计样本"""
+    rng = np.random.default_rng()
     return {
         "network_status": "正常",
-        "current_block": np.random.randint(18000000, 19000000),
-        "gas_price": f"{np.random.uniform(20, 50):.1f} Gwei",
-        "tps": np.random.randint(10, 25),
-        "total_transactions": np.random.randint(1000000, 2000000),
-        "network_hashrate": f"{np.random.uniform(200, 400):.1f} TH/s",
+        "current_block": int(rng.integers(18000000, 19000000)),
+        "gas_price": f"{rng.uniform(20, 50):.1f} Gwei",
+        "tps": int(rng.integers(10, 25)),
+        "total_transactions": int(rng.integers(1000000, 2000000)),
+        "network_hashrate": f"{rng.uniform(200, 400):.1f} TH/s",
         "timestamp": datetime.now().isoformat()
     }
 
-# ==================== 数据统计API ====================
+@app.get("/api/blockchain/stats")
+async def get_blockchain_stats():
+    """获取区块链网络统计（与推送通道共享同一周期的样本）"""
+    return feed_hub.latest("chain")
 
-@app.get("/api/stats/overview")
-async def get_system_overview():
-    """获取系统总览统计"""
-    conn = sqlite3.connect('smart_city.db')
-    cursor = conn.cursor()
-    
-    # 获取各模块数据统计
-    cursor.execute("SELECT COUNT(*) FROM traffic_data")
-    traffic_records = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM health_data")
-    health_records = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM city_configs")
-    city_records = cursor.fetchone()[0]
+# ==================== 实时推送 ====================
+
+# 与前端原有轮询间隔一致
+feed_hub.register("traffic", sample_realtime_traffic, 3.0)
+feed_hub.register("health", sample_realtime_health, 3.0)
+feed_hub.register("chain", sample_blockchain_stats, 5.0)
+
+@app.get("/api/realtime/stream")
+async def stream_realtime(request: Request, feeds: Optional[str] = None):
+    """Server-Sent Events 推送，feeds 为逗号分隔的 traffic/health/chain，默认全部"""
+    try:
+        names = feed_hub.parse_feeds(feeds)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    subscriber = feed_hub.subscribe(names)
     
-    cursor.execute("SELECT COUNT(*) FROM blockchain_data")
-    blockchain_records = cursor.fetchone()[0]
+    async def events():
+        try:
+            while True:
+                message = await subscriber.get()
+                if message is None or await request.is_disconnected():
+                    break
+                feed, data = message
+                yield f"event: {feed}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        finally:
+            feed_hub.unsubscribe(subscriber)
     
-    # 获取最新的优化分数
-    cursor.execute("SELECT AVG(optimization_score) FROM traffic_data WHERE timestamp > datetime('now', '-1 day')")
-    avg_traffic_score = cursor.fetchone()[0] or 0
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/ws/realtime")
+async def websocket_realtime(websocket: WebSocket, feeds: Optional[str] = None):
+    """WebSocket 推送，消息格式 {"feed": 名称, "data": 样本}"""
+    try:
+        names = feed_hub.parse_feeds(feeds)
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+    await websocket.accept()
+    subscriber = feed_hub.subscribe(names)
     
-    cursor.execute("SELECT AVG(health_score) FROM health_data WHERE timestamp > datetime('now', '-1 day')")
-    avg_health_score = cursor.fetchone()[0] or 0
+    async def watch_disconnect():
+        # 客户端不发送数据，只需感知断开
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
     
-    cursor.execute("SELECT AVG(sustainability_score) FROM city_configs WHERE timestamp > datetime('now', '-1 day')")
-    avg_sustainability_score = cursor.fetchone()[0] or 0
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        while True:
+            getter = asyncio.create_task(subscriber.get())
+            done, _ = await asyncio.wait({getter, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if watcher in done:
+                getter.cancel()
+                break
+            message = getter.result()
+            if message is None:
+                # 慢消费者被丢弃或服务关闭
+                await websocket.close(code=1013)
+                break
+            feed, data = message
+            await websocket.send_json({"feed": feed, "data": data})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        watcher.cancel()
+        feed_hub.unsubscribe(subscriber)
+
+@app.get("/api/realtime/stats")
+async def get_realtime_stats():
+    """推送通道状态：订阅者数、采样次数、丢弃与断开次数"""
+    return {"success": True, "data": feed_hub.snapshot()}
+
+# ==================== 传感器数据批量导入 ====================
+
+def score_traffic_rows(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    return TrafficOptimizer.optimize_signals_batch(
+        columns["vehicle_count"], columns["avg_speed"], columns["signal_cycle"]
+    )["optimization_score"]
+
+def score_health_rows(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    return HealthAnalyzer.analyze_health_batch(
+        columns["heart_rate"], columns["systolic_bp"], columns["diastolic_bp"],
+        columns["exercise_minutes"], columns["sleep_hours"]
+    )["health_score"]
+
+INGEST_SCORERS = {"traffic": score_traffic_rows, "health": score_health_rows}
+
+@app.post("/api/ingest/{kind}")
+async def ingest_sensor_data(kind: str, request: Request, format: Optional[str] = None):
+    """流式导入交通/健康读数（NDJSON 或带表头的 CSV），可选 timestamp 字段保留采集时间"""
+    if kind not in INGEST_SCORERS:
+        raise HTTPException(status_code=404, detail=f"未知的数据类型: {kind}，可选 traffic/health")
+    try:
+        fmt = ingest.detect_format(request.headers.get("content-type"), format)
+        result = await ingest.ingest_stream(request.stream(), kind, fmt, INGEST_SCORERS[kind], writer)
+    except ingest.IngestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"{kind} 数据导入失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return JSONResponse({"success": True, "data": result})
+
+# ==================== 监控与性能分析 ====================
+
+def collect_runtime_metrics():
+    """写后队列、城市缓存、实时推送与 Merkle 批次的运行状态"""
+    cache = city_cache.cache
+    return [
+        ("smart_city_db_writer_total", "counter", "写后队列累计提交的批次数、行数与失败次数",
+         [({"kind": kind}, value) for kind, value in writer.stats.items()]),
+        ("smart_city_db_writer_queue_depth", "gauge", "写后队列中等待提交的写入操作数",
+         [({}, writer._queue.qsize())]),
+        ("smart_city_city_cache_bytes", "gauge", "城市缓存当前占用字节数", [({}, cache.current_bytes)]),
+        ("smart_city_city_cache_events_total", "counter", "城市缓存命中/未命中/合并/淘汰次数",
+         [({"event": event}, value) for event, value in cache.stats.items()]),
+        ("smart_city_realtime_subscribers", "gauge", "实时推送订阅者数", [({}, len(feed_hub.subscribers))]),
+        ("smart_city_realtime_events_total", "counter", "实时推送采样、消息、丢弃与断开次数",
+         [({"event": event}, value) for event, value in feed_hub.stats.items()]),
+        ("smart_city_merkle_total", "counter", "Merkle 批量锚定的批次数与叶子数",
+         [({"kind": kind}, value) for kind, value in anchor_batcher.stats.items()]),
+        ("smart_city_forecaster_state_bytes", "gauge", "交通预测模型状态占用字节数",
+         [({}, traffic_forecaster.nbytes)]),
+        ("smart_city_startup_seconds", "gauge", "冷启动各阶段耗时：import 导入应用，preload 重建内存状态，ready 自启动器启动到本进程就绪",
+         [({"phase": phase}, round(seconds, 4)) for phase, seconds in startup_timings.items()]),
+        ("smart_city_change_tailer_total", "counter", "多进程模式下变更订阅的轮询次数、分发行数与失败次数",
+         [({"kind": kind}, value) for kind, value in change_tailer.stats.items()]),
+        ("smart_city_retention_total", "counter", "数据归档累计轮次、归档行数、文件数、字节数、回收页数与失败次数",
+         [({"kind": kind}, value) for kind, value in retention_manager.stats.items()]),
+    ]
+
+metrics.registry.add_collector(collect_runtime_metrics)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus 文本格式的请求与运行指标"""
+    return Response(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+class ProfileRequest(BaseModel):
+    route: str = Field(..., description="路由模板，如 /api/city/generate 或 /api/blockchain/proof/{data_hash}")
+    method: str = "GET"
+    requests: int = Field(10, gt=0, le=metrics.PROFILE_MAX_REQUESTS)
+
+def require_admin(request: Request):
+    if not metrics.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="未配置 SMART_CITY_ADMIN_TOKEN，管理接口已禁用")
+    token = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode(), metrics.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="管理员令牌无效")
+
+@app.post("/api/admin/profile")
+async def start_profile(profile: ProfileRequest, request: Request):
+    """对指定路由接下来的 N 个请求进行栈采样"""
+    require_admin(request)
+    method = profile.method.upper()
+    known = any(getattr(route, "path", None) == profile.route and method in (getattr(route, "methods", None) or ())
+                for route in app.routes)
+    if not known:
+        raise HTTPException(status_code=404, detail=f"未找到路由: {method} {profile.route}")
+    try:
+        metrics.profiler.arm(method, profile.route, profile.requests)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"success": True, "data": metrics.profiler.status()}
+
+@app.get("/api/admin/profile")
+async def get_profile(request: Request, format: str = "json"):
+    """采样状态与结果；format=collapsed 返回折叠栈文本（flamegraph.pl、speedscope 可直接打开）"""
+    require_admin(request)
+    if format == "collapsed":
+        return Response(metrics.profiler.collapsed(), media_type="text/plain; charset=utf-8")
+    return {"success": True, "data": {**metrics.profiler.status(), "collapsed": metrics.profiler.collapsed()}}
+
+@app.delete("/api/admin/profile")
+async def cancel_profile(request: Request):
+    """取消尚未开始的采样请求，已采集的样本保留"""
+    require_admin(request)
+    metrics.profiler.cancel()
+    return {"success": True, "data": metrics.profiler.status()}
+
+class RetentionRunRequest(BaseModel):
+    older_than_days: Optional[float] = Field(None, gt=0, description="为空时使用 SMART_CITY_RETENTION_DAYS")
+
+@app.post("/api/admin/retention/run")
+async def run_retention(run: RetentionRunRequest, request: Request):
+    """立即归档超过保留期的数据并回收空间（后台线程执行，请求等待本轮完成）"""
+    require_admin(request)
+    try:
+        result = await retention_manager.run_now(run.older_than_days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"success": True, "data": result}
+
+# ==================== 数据统计API ====================
+
+@app.get("/api/stats/overview")
+async def get_system_overview():
+    """获取系统总览统计（由写入时增量维护的内存聚合直接提供，O(1)）"""
+    snapshot = overview_stats.snapshot()
+    counts = snapshot["counts"]
+    averages = snapshot["averages"]
     
-    conn.close()
+    traffic_records = counts["traffic_data"]
+    health_records = counts["health_data"]
+    city_records = counts["city_configs"]
+    blockchain_records = counts["blockchain_data"]
     
     return {
         "system_status": "运行正常",
@@ -533,15 +1307,15 @@ async def get_system_overview():
         "module_stats": {
             "traffic_optimization": {
                 "total_optimizations": traffic_records,
-                "avg_efficiency_score": round(avg_traffic_score, 1)
+                "avg_efficiency_score": round(averages["traffic_data"], 1)
             },
             "health_analysis": {
                 "total_analyses": health_records,
-                "avg_health_score": round(avg_health_score, 1)
+                "avg_health_score": round(averages["health_data"], 1)
             },
             "city_generation": {
                 "total_cities": city_records,
-                "avg_sustainability": round(avg_sustainability_score, 1)
+                "avg_sustainability": round(averages["city_configs"], 1)
             },
             "blockchain_storage": {
                 "total_transactions": blockchain_records,
@@ -551,6 +1325,76 @@ async def get_system_overview():
         "timestamp": datetime.now().isoformat()
     }
 
+# ==================== 历史数据API ====================
+
+def _parse_time(value: Optional[str], default: float) -> int:
+    """解析 epoch 秒或 ISO 时间（无时区时按 UTC，与导入接口及数据库中存储的 timestamp 一致）"""
+    if value is None or value == "":
+        return int(default)
+    return int(ingest.parse_time(value).timestamp())
+
+async def _query_history(table: str, start: Optional[str], end: Optional[str], resolution: Optional[str]):
+    try:
+        end_ts = _parse_time(end, datetime.now().timestamp())
+        start_ts = _parse_time(start, end_ts - 86400)
+        step = rollups.parse_duration(resolution) if resolution else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        data = await executor.run_io(lambda: rollups.query_history(pool.get(), table, start_ts, end_ts, step))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "data": data}
+
+@app.get("/api/traffic/history")
+async def get_traffic_history(start: Optional[str] = Query(None, alias="from"),
+                              end: Optional[str] = Query(None, alias="to"),
+                              resolution: Optional[str] = None):
+    """交通历史数据（自动选择分钟/小时/天汇总表，不扫描原始数据）"""
+    return await _query_history("traffic_data", start, end, resolution)
+
+@app.get("/api/health/history")
+async def get_health_history(start: Optional[str] = Query(None, alias="from"),
+                             end: Optional[str] = Query(None, alias="to"),
+                             resolution: Optional[str] = None):
+    """健康历史数据（自动选择分钟/小时/天汇总表，不扫描原始数据）"""
+    return await _query_history("health_data", start, end, resolution)
+
+# ==================== 归档数据API ====================
+
+@app.get("/api/archive")
+async def get_archive_overview():
+    """各表归档文件概况与最近一次归档结果"""
+    partitions = await executor.run_io(lambda: retention_manager.partitions(pool.get()))
+    return {
+        "success": True,
+        "data": {
+            "retention_days": retention_manager.days,
+            "archive_dir": retention_manager.archive_dir,
+            "tables": partitions,
+            "last_run": retention_manager.last_run,
+            "stats": retention_manager.stats
+        }
+    }
+
+@app.get("/api/archive/{table}")
+async def read_archive(table: str, start: Optional[str] = Query(None, alias="from"),
+                       end: Optional[str] = Query(None, alias="to"),
+                       limit: Optional[int] = Query(None, gt=0)):
+    """以 NDJSON 流式读取已归档的原始行（默认最近 7 天内归档的时间范围）"""
+    if table not in retention.RETENTION_TABLES:
+        raise HTTPException(status_code=404, detail=f"未知的归档表: {table}，可选 {', '.join(retention.RETENTION_TABLES)}")
+    try:
+        end_ts = _parse_time(end, datetime.now().timestamp())
+        start_ts = _parse_time(start, end_ts - 7 * 86400)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if end_ts <= start_ts:
+        raise HTTPException(status_code=400, detail="to 必须晚于 from")
+    # 同步生成器由 Starlette 放到线程池中迭代，解压与读文件不阻塞事件循环
+    rows = retention_manager.read(table, retention.sql_time(start_ts), retention.sql_time(end_ts), limit)
+    return StreamingResponse(rows, media_type="application/x-ndjson")
+
 # ==================== 启动服务器 ====================
 
 if __name__ == "__main__":
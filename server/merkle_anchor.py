@@ -0,0 +1,265 @@
+"""
+Merkle 批量锚定：在时间窗口内收集数据哈希，构建 Merkle 树，只把根哈希上链，并为每条记录提供包含证明
+"""
+
+import os
+import uuid
+import asyncio
+import hashlib
+import logging
+import sqlite3
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import executor
+
+logger = logging.getLogger(__name__)
+
+# per_record: 每条记录一笔交易（原有行为）; batch: 按窗口合并为一个 Merkle 根
+ANCHOR_MODE = os.getenv("SMART_CITY_ANCHOR_MODE", "per_record").lower()
+ANCHOR_WINDOW = float(os.getenv("SMART_CITY_ANCHOR_WINDOW", "5"))
+ANCHOR_MAX_LEAVES = int(os.getenv("SMART_CITY_ANCHOR_MAX_LEAVES", "10000"))
+
+if ANCHOR_MODE not in ("per_record", "batch"):
+    raise ValueError(f"SMART_CITY_ANCHOR_MODE 取值无效: {ANCHOR_MODE}")
+
+# 叶子与内部节点使用不同前缀，防止把内部节点伪造成叶子（第二原像攻击）
+_LEAF_PREFIX = b"\x00"
+_NODE_PREFIX = b"\x01"
+
+
+def init_tables(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS merkle_batches (
+            batch_id TEXT PRIMARY KEY,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            merkle_root TEXT,
+            leaf_count INTEGER,
+            transaction_hash TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS merkle_leaves (
+            batch_id TEXT,
+            leaf_index INTEGER,
+            data_hash TEXT,
+            PRIMARY KEY (batch_id, leaf_index)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_merkle_leaves_data_hash ON merkle_leaves(data_hash)")
+
+
+# ==================== Merkle 树 ====================
+
+def leaf_hash(data_hash: str) -> bytes:
+    return hashlib.sha256(_LEAF_PREFIX + bytes.fromhex(data_hash)).digest()
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(_NODE_PREFIX + left + right).digest()
+
+
+def build_tree(data_hashes: List[str]) -> List[List[bytes]]:
+    """构建 Merkle 树，返回自底向上的各层节点；奇数个节点时最后一个直接提升到上一层"""
+    level = [leaf_hash(h) for h in data_hashes]
+    levels = [level]
+    while len(level) > 1:
+        parents = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+        level = parents
+    return levels
+
+
+def inclusion_proof(levels: List[List[bytes]], index: int) -> List[Dict[str, str]]:
+    """生成第 index 个叶子的包含证明（兄弟节点及其位置）"""
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append({
+                "hash": level[sibling].hex(),
+                "position": "left" if sibling < index else "right"
+            })
+        index //= 2
+    return proof
+
+
+def verify_proof(data_hash: str, proof: List[Dict[str, str]], merkle_root: str) -> bool:
+    """校验包含证明：从叶子逐层计算到根"""
+    try:
+        current = leaf_hash(data_hash)
+        for step in proof:
+            sibling = bytes.fromhex(step["hash"])
+            if step["position"] == "left":
+                current = node_hash(sibling, current)
+            else:
+                current = node_hash(current, sibling)
+    except (ValueError, KeyError, TypeError):
+        return False
+    return current.hex() == merkle_root.lower()
+
+
+# ==================== 批量锚定 ====================
+
+class AnchorBatcher:
+    """收集待锚定的数据哈希，按时间窗口或数量封批"""
+
+    def __init__(self, writer, anchor: Callable[[str, str], str],
+                 window: float = ANCHOR_WINDOW, max_leaves: int = ANCHOR_MAX_LEAVES):
+        self.writer = writer
+        self.anchor = anchor
+        self.window = window
+        self.max_leaves = max(1, max_leaves)
+        self._batch_id = uuid.uuid4().hex[:16]
+        self._records: List[Tuple[str, str, str]] = []  # (data_hash, data_content, wallet_address)
+        # 尚未写入数据库的记录 -> (批次号, 叶子序号)，包括已封闭但锚定或写入失败、等待重试的批次
+        self._pending: Dict[str, Tuple[str, int]] = {}
+        self._unsealed: List[Tuple[str, List[Tuple[str, str, str]]]] = []
+        self._task: Optional[asyncio.Task] = None
+        # 批次写满时在后台封批的任务，请求不等待锚定
+        self._seal_tasks: Set[asyncio.Task] = set()
+        self._seal_lock: Optional[asyncio.Lock] = None
+        self._trees: "OrderedDict[str, List[List[bytes]]]" = OrderedDict()
+        self.stats = {"batches": 0, "leaves": 0}
+
+    def start(self):
+        if self._task is None:
+            self._seal_lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """停止定时封批，并把剩余记录封批锚定"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._seal_tasks:
+            await asyncio.gather(*self._seal_tasks)
+        try:
+            await self.seal()
+        except Exception as e:
+            logger.error(f"Merkle 封批失败，{len(self._pending)} 条记录未锚定: {str(e)}")
+
+    async def add(self, data_hash: str, data_content: str, wallet_address: str) -> Dict[str, Any]:
+        """加入当前批次，返回批次号与叶子序号"""
+        batch_id = self._batch_id
+        leaf_index = len(self._records)
+        self._records.append((data_hash, data_content, wallet_address))
+        self._pending[data_hash] = (batch_id, leaf_index)
+        if len(self._records) == self.max_leaves:
+            # 记录已进入待定集合，锚定失败时会重试，回执不依赖本次封批的结果
+            task = asyncio.get_running_loop().create_task(self._seal_logged())
+            self._seal_tasks.add(task)
+            task.add_done_callback(self._seal_tasks.discard)
+        return {"batch_id": batch_id, "leaf_index": leaf_index}
+
+    def pending_position(self, data_hash: str) -> Optional[Dict[str, Any]]:
+        position = self._pending.get(data_hash)
+        if position is None:
+            return None
+        return {"batch_id": position[0], "leaf_index": position[1]}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.window)
+            await self._seal_logged()
+
+    async def _seal_logged(self):
+        try:
+            await self.seal()
+        except Exception as e:
+            logger.error(f"Merkle 封批失败: {str(e)}")
+
+    async def seal(self):
+        """封闭当前批次，并按顺序锚定所有未完成的批次；失败的批次保留其批次号与记录，下次封批时重试"""
+        if self._seal_lock is None:
+            self._seal_lock = asyncio.Lock()
+        async with self._seal_lock:
+            if self._records:
+                # 封批期间新加入的记录进入新批次，已发出的回执（批次号、叶子序号）保持不变
+                self._unsealed.append((self._batch_id, self._records))
+                self._batch_id = uuid.uuid4().hex[:16]
+                self._records = []
+            while self._unsealed:
+                batch_id, records = self._unsealed[0]
+                await self._anchor_batch(batch_id, records)
+                self._unsealed.pop(0)
+
+    async def _anchor_batch(self, batch_id: str, records: List[Tuple[str, str, str]]):
+        """构建 Merkle 树、锚定根哈希，并在一个事务中写入批次、叶子与存证记录"""
+        hashes = [record[0] for record in records]
+        levels = await executor.run_cpu(build_tree, hashes)
+        merkle_root = levels[-1][0].hex()
+        transaction_hash = self.anchor(merkle_root, "merkle-batch")
+
+        await executor.run_io(self.writer.submit_transaction, [
+            ('''
+                INSERT INTO merkle_batches (batch_id, merkle_root, leaf_count, transaction_hash)
+                VALUES (?, ?, ?, ?)
+            ''', [(batch_id, merkle_root, len(records), transaction_hash)]),
+            ('''
+                INSERT INTO merkle_leaves (batch_id, leaf_index, data_hash)
+                VALUES (?, ?, ?)
+            ''', [(batch_id, i, h) for i, h in enumerate(hashes)]),
+            ('''
+                INSERT INTO blockchain_data (data_hash, data_content, wallet_address, transaction_hash)
+                VALUES (?, ?, ?, ?)
+            ''', [(h, content, wallet, transaction_hash) for h, content, wallet in records]),
+        ], True)
+        # 提交完成后再移出待定集合，保证证明查询始终能找到记录
+        for i, h in enumerate(hashes):
+            if self._pending.get(h) == (batch_id, i):
+                del self._pending[h]
+
+        self._remember_tree(batch_id, levels)
+        self.stats["batches"] += 1
+        self.stats["leaves"] += len(records)
+        logger.info(f"Merkle 批次已锚定: {len(records)} 条记录, 根 {merkle_root[:16]}..., 交易 {transaction_hash}")
+
+    # ==================== 证明查询 ====================
+
+    def _remember_tree(self, batch_id: str, levels: List[List[bytes]], limit: int = 16):
+        self._trees[batch_id] = levels
+        self._trees.move_to_end(batch_id)
+        while len(self._trees) > limit:
+            self._trees.popitem(last=False)
+
+    def get_proof(self, conn: sqlite3.Connection, data_hash: str) -> Optional[Dict[str, Any]]:
+        """查询已锚定记录的包含证明（在 IO 线程中调用）"""
+        row = conn.execute(
+            "SELECT batch_id, leaf_index FROM merkle_leaves WHERE data_hash = ? LIMIT 1", (data_hash,)
+        ).fetchone()
+        if row is None:
+            return None
+        batch_id, leaf_index = row
+        batch = conn.execute(
+            "SELECT merkle_root, transaction_hash, leaf_count FROM merkle_batches WHERE batch_id = ?", (batch_id,)
+        ).fetchone()
+        if batch is None:
+            # 批次行缺失（如旧版本分事务写入的数据），没有可校验的根
+            return None
+        merkle_root, transaction_hash, leaf_count = batch
+
+        levels = self._trees.get(batch_id)
+        if levels is None:
+            hashes = [h for (h,) in conn.execute(
+                "SELECT data_hash FROM merkle_leaves WHERE batch_id = ? ORDER BY leaf_index", (batch_id,)
+            )]
+            levels = build_tree(hashes)
+
+        proof = inclusion_proof(levels, leaf_index)
+        return {
+            "data_hash": data_hash,
+            "batch_id": batch_id,
+            "leaf_index": leaf_index,
+            "leaf_count": leaf_count,
+            "merkle_root": merkle_root,
+            "transaction_hash": transaction_hash,
+            "proof": proof,
+            "verified": verify_proof(data_hash, proof, merkle_root)
+        }
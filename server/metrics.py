@@ -0,0 +1,323 @@
+"""
+请求指标与按需采样分析：按路由记录延迟直方图、在途请求数、错误数及数据库/计算耗时，
+以 Prometheus 文本格式导出；管理员可对某个路由接下来的 N 个请求进行栈采样
+"""
+
+import os
+import sys
+import time
+import threading
+import logging
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TOKEN = os.getenv("SMART_CITY_ADMIN_TOKEN", "")
+PROFILE_INTERVAL = float(os.getenv("SMART_CITY_PROFILE_INTERVAL", "0.005"))
+PROFILE_MAX_REQUESTS = 1000
+_ROUTE_CACHE_SIZE = 4096
+
+# 延迟直方图桶上界（秒）
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGES = ("db", "compute", "other")
+
+# 当前请求的分阶段耗时累加器，由执行器在 await 完成后写入
+_stage_times: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_times", default=None)
+
+
+def add_stage_time(stage: str, seconds: float):
+    """把一段耗时计入当前请求（不在请求上下文中时忽略）"""
+    times = _stage_times.get()
+    if times is not None:
+        times[stage] = times.get(stage, 0.0) + seconds
+
+
+class RouteStats:
+    __slots__ = ("buckets", "count", "total", "in_flight", "exceptions", "statuses", "stages")
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.in_flight = 0
+        self.exceptions = 0
+        self.statuses: Counter = Counter()
+        self.stages = {stage: 0.0 for stage in STAGES}
+
+    def observe(self, seconds: float, status: int, stage_times: Dict[str, float]):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.total += seconds
+        self.statuses[status] += 1
+        measured = 0.0
+        for stage in ("db", "compute"):
+            value = stage_times.get(stage, 0.0)
+            self.stages[stage] += value
+            measured += value
+        self.stages["other"] += max(0.0, seconds - measured)
+
+
+# 额外指标采集函数：返回 [(名称, 类型, 说明, [(标签, 值), ...]), ...]
+Collector = Callable[[], List[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]
+
+
+class Metrics:
+    """只在事件循环线程中更新，无需加锁"""
+
+    def __init__(self):
+        self.routes: Dict[Tuple[str, str], RouteStats] = {}
+        self.collectors: List[Collector] = []
+
+    def route(self, method: str, path: str) -> RouteStats:
+        key = (method, path)
+        stats = self.routes.get(key)
+        if stats is None:
+            stats = self.routes[key] = RouteStats()
+        return stats
+
+    def add_collector(self, collector: Collector):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        lines: List[str] = []
+
+        def header(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def labels(**values: Any) -> str:
+            escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for v in values.values())
+            return "{" + ",".join(f'{k}="{v}"' for k, v in zip(values, escaped)) + "}"
+
+        routes = sorted(self.routes.items())
+        name = "smart_city_http_request_duration_seconds"
+        header(name, "histogram", "HTTP 请求耗时（直到响应体发送完毕）")
+        for (method, path), stats in routes:
+            cumulative = 0
+            for bound, count in zip(BUCKETS, stats.buckets):
+                cumulative += count
+                lines.append(f"{name}_bucket{labels(method=method, route=path, le=bound)} {cumulative}")
+            lines.append(f"{name}_bucket{labels(method=method, route=path, le='+Inf')} {stats.count}")
+            lines.append(f"{name}_sum{labels(method=method, route=path)} {stats.total:.6f}")
+            lines.append(f"{name}_count{labels(method=method, route=path)} {stats.count}")
+
+        name = "smart_city_http_requests_total"
+        header(name, "counter", "按状态码统计的 HTTP 请求数")
+        for (method, path), stats in routes:
+            for status, count in sorted(stats.statuses.items()):
+                lines.append(f"{name}{labels(method=method, route=path, status=status)} {count}")
+
+        name = "smart_city_http_requests_in_flight"
+        header(name, "gauge", "正在处理的 HTTP 请求数")
+        for (method, path), stats in routes:
+            lines.append(f"{name}{labels(method=method, route=path)} {stats.in_flight}")
+
+        name = "smart_city_http_request_exceptions_total"
+        header(name, "counter", "处理过程中抛出未处理异常的请求数")
+        for (method, path), stats in routes:
+            lines.append(f"{name}{labels(method=method, route=path)} {stats.exceptions}")
+
+        name = "smart_city_http_request_stage_seconds_total"
+        header(name, "counter", "请求耗时按阶段拆分：db 为 IO 线程池中的数据库操作，compute 为计算执行器，other 为其余部分")
+        for (method, path), stats in routes:
+            for stage, seconds in stats.stages.items():
+                lines.append(f"{name}{labels(method=method, route=path, stage=stage)} {seconds:.6f}")
+
+        for collector in self.collectors:
+            try:
+                for name, kind, help_text, samples in collector():
+                    header(name, kind, help_text)
+                    for sample_labels, value in samples:
+                        lines.append(f"{name}{labels(**sample_labels) if sample_labels else ''} {value}")
+            except Exception as e:
+                logger.error(f"指标采集失败: {str(e)}")
+        return "\n".join(lines) + "\n"
+
+
+# ==================== 按需采样分析 ====================
+
+# 叶子帧位于这些文件中的线程处于空闲等待状态，不计入采样
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "base_events.py", os.path.join("futures", "thread.py"))
+
+
+class SamplingProfiler:
+    """对某个路由接下来的 N 个请求进行栈采样，输出折叠栈格式（flamegraph.pl / speedscope 可直接读取）
+
+    采样覆盖整个进程中的非空闲线程（事件循环线程与执行器线程），因此并发的其他请求也可能出现在结果中。
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self.method: Optional[str] = None
+        self.route: Optional[str] = None
+        self.remaining = 0
+        self.requested = 0
+        self.active = 0
+        self.completed = 0
+        self.samples: Counter = Counter()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def arm(self, method: str, route: str, count: int):
+        with self._lock:
+            if self.remaining > 0 or self.active > 0:
+                raise RuntimeError("已有进行中的采样任务")
+            self.method, self.route = method.upper(), route
+            self.remaining = self.requested = count
+            self.completed = 0
+            self.samples = Counter()
+            self.started_at = time.time()
+            self.finished_at = None
+
+    def cancel(self):
+        with self._lock:
+            self.remaining = 0
+
+    def matches(self, method: str, route: str) -> bool:
+        return self.remaining > 0 and method == self.method and route == self.route
+
+    def enter(self) -> bool:
+        """请求开始时调用，返回该请求是否被纳入采样"""
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            self.active += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+                self._thread.start()
+            return True
+
+    def exit(self):
+        with self._lock:
+            self.active -= 1
+            self.completed += 1
+            if self.active == 0 and self.remaining == 0:
+                self.finished_at = time.time()
+
+    def _sample_loop(self):
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                # 没有被采样的请求在处理时退出，下一个请求进入时重新启动
+                if self.active == 0:
+                    self._thread = None
+                    return
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if frame.f_code.co_filename.endswith(_IDLE_FILES):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+                    stack.append(f"{module}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks.append(";".join(reversed(stack)))
+            with self._lock:
+                self.samples.update(stacks)
+            time.sleep(self.interval)
+
+    def collapsed(self) -> str:
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = sum(self.samples.values())
+        return {
+            "method": self.method,
+            "route": self.route,
+            "requested": self.requested,
+            "remaining": self.remaining,
+            "active": self.active,
+            "completed": self.completed,
+            "done": self.requested > 0 and self.remaining == 0 and self.active == 0,
+            "samples": samples,
+            "interval_ms": self.interval * 1000,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+# ==================== ASGI 中间件 ====================
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件：计时到响应体发送完毕，对流式响应同样准确"""
+
+    def __init__(self, app, registry: "Metrics", profiler: SamplingProfiler):
+        self.app = app
+        self.registry = registry
+        self.profiler = profiler
+        self._routes: Dict[Tuple[str, str], str] = {}
+
+    def _resolve_route(self, scope) -> str:
+        """在路由前解析路径模板，以便在途计数与采样按路由归属；结果按方法与路径缓存"""
+        key = (scope["method"], scope["path"])
+        route = self._routes.get(key)
+        if route is None:
+            from starlette.routing import Match
+            route = "__unmatched__"
+            for candidate in scope["app"].routes:
+                match, _ = candidate.matches(scope)
+                if match == Match.FULL:
+                    route = getattr(candidate, "path", route)
+                    break
+            if len(self._routes) >= _ROUTE_CACHE_SIZE:
+                # 带路径参数的路由会产生大量不同路径，缓存满时整体清空
+                self._routes.clear()
+            self._routes[key] = route
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self._resolve_route(scope)
+        stats = self.registry.route(method, route)
+        profiled = self.profiler.matches(method, route) and self.profiler.enter()
+
+        status = 500
+        started = time.perf_counter()
+        stage_times: Dict[str, float] = {}
+        token = _stage_times.set(stage_times)
+        stats.in_flight += 1
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        failed = False
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            _stage_times.reset(token)
+            stats.in_flight -= 1
+            stats.observe(time.perf_counter() - started, status, stage_times)
+            if failed:
+                stats.exceptions += 1
+            if profiled:
+                self.profiler.exit()
+
+
+registry = Metrics()
+profiler = SamplingProfiler()
@@ -0,0 +1,157 @@
+"""
+系统总览的增量聚合：写入时维护各表计数与 24 小时滚动评分，总览接口直接读取内存
+"""
+
+import time
+import sqlite3
+import threading
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+from database import parse_insert
+
+logger = logging.getLogger(__name__)
+
+WINDOW_MINUTES = 24 * 60
+
+# 各表参与 24 小时平均的评分列（None 表示只计数）
+SCORE_COLUMNS: Dict[str, Optional[str]] = {
+    "traffic_data": "optimization_score",
+    "health_data": "health_score",
+    "city_configs": "sustainability_score",
+    "blockchain_data": None,
+}
+
+
+def current_minute() -> int:
+    return int(time.time() // 60)
+
+
+class RollingWindow:
+    """按分钟分桶的滚动求和/计数，过期桶在推进时间时扣除，读写均摊 O(1)"""
+
+    def __init__(self, minutes: int = WINDOW_MINUTES):
+        self.minutes = minutes
+        self.sums = [0.0] * minutes
+        self.counts = [0] * minutes
+        self.stamps = [-1] * minutes
+        self.total_sum = 0.0
+        self.total_count = 0
+        self.expired_through = current_minute() - minutes
+
+    def _expire(self, now: int):
+        horizon = now - self.minutes
+        if horizon <= self.expired_through:
+            return
+        if horizon - self.expired_through >= self.minutes:
+            # 间隔超过整个窗口，全部桶均已过期
+            self.sums = [0.0] * self.minutes
+            self.counts = [0] * self.minutes
+            self.stamps = [-1] * self.minutes
+            self.total_sum = 0.0
+            self.total_count = 0
+        else:
+            for minute in range(self.expired_through + 1, horizon + 1):
+                idx = minute % self.minutes
+                if self.stamps[idx] == minute:
+                    self.total_sum -= self.sums[idx]
+                    self.total_count -= self.counts[idx]
+                    self.sums[idx] = 0.0
+                    self.counts[idx] = 0
+                    self.stamps[idx] = -1
+        self.expired_through = horizon
+
+    def add(self, minute: int, value_sum: float, count: int, now: Optional[int] = None):
+        now = current_minute() if now is None else now
+        self._expire(now)
+        if minute <= now - self.minutes or count == 0:
+            return
+        idx = minute % self.minutes
+        if self.stamps[idx] != minute:
+            self.total_sum -= self.sums[idx]
+            self.total_count -= self.counts[idx]
+            self.sums[idx] = 0.0
+            self.counts[idx] = 0
+            self.stamps[idx] = minute
+        self.sums[idx] += value_sum
+        self.counts[idx] += count
+        self.total_sum += value_sum
+        self.total_count += count
+
+    def average(self, now: Optional[int] = None) -> float:
+        self._expire(current_minute() if now is None else now)
+        return self.total_sum / self.total_count if self.total_count else 0.0
+
+
+class OverviewStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {table: 0 for table in SCORE_COLUMNS}
+        self.windows: Dict[str, RollingWindow] = {
+            table: RollingWindow() for table, column in SCORE_COLUMNS.items() if column
+        }
+
+    def rebuild(self, conn: sqlite3.Connection, archived: Optional[Dict[str, int]] = None):
+        """启动时从数据库重建计数与最近 24 小时的分钟桶；archived 为已归档出热库的行数"""
+        counts = {}
+        windows = {table: RollingWindow() for table in self.windows}
+        now = current_minute()
+        archived = archived or {}
+        for table, column in SCORE_COLUMNS.items():
+            counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] + archived.get(table, 0)
+            if not column:
+                continue
+            rows = conn.execute(f'''
+                SELECT CAST(strftime('%s', timestamp) AS INTEGER) / 60 AS minute, SUM({column}), COUNT({column})
+                FROM {table}
+                WHERE timestamp > datetime('now', '-1 day')
+                GROUP BY minute
+            ''').fetchall()
+            for minute, value_sum, count in rows:
+                windows[table].add(minute, value_sum or 0.0, count, now)
+        with self._lock:
+            self.counts = counts
+            self.windows = windows
+        logger.info(f"总览统计已重建: {counts}")
+
+    def on_commit(self, sql: str, rows: List[Sequence[Any]]):
+        """写后队列提交回调：累加计数与评分"""
+        parsed = parse_insert(sql)
+        if parsed is None or parsed[0] not in SCORE_COLUMNS:
+            return
+        table, columns = parsed
+        column = SCORE_COLUMNS[table]
+        now = current_minute()
+        # 分钟 -> (评分和, 计数)；未显式写入时间戳的行计入当前分钟
+        buckets: Dict[int, List[float]] = {}
+        if column and column in columns:
+            idx = columns.index(column)
+            stamp_idx = columns.index("timestamp") if "timestamp" in columns else None
+            minutes: Dict[str, int] = {}
+            for row in rows:
+                if row[idx] is None:
+                    continue
+                minute = now
+                if stamp_idx is not None:
+                    stamp = row[stamp_idx]
+                    if stamp not in minutes:
+                        minutes[stamp] = int(datetime.strptime(stamp, "%Y-%m-%d %H:%M:%S")
+                                             .replace(tzinfo=timezone.utc).timestamp() // 60)
+                    minute = minutes[stamp]
+                bucket = buckets.setdefault(minute, [0.0, 0])
+                bucket[0] += row[idx]
+                bucket[1] += 1
+        with self._lock:
+            self.counts[table] += len(rows)
+            for minute, (value_sum, value_count) in buckets.items():
+                self.windows[table].add(minute, value_sum, value_count, now)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+            averages = {table: window.average() for table, window in self.windows.items()}
+        return {"counts": counts, "averages": averages}
+
+
+overview_stats = OverviewStats()
@@ -0,0 +1,165 @@
+"""
+预派生（pre-fork）多进程服务：主进程先导入应用并从数据库预加载内存状态，绑定监听端口后 fork 出 N 个工作进程，
+工作进程共享监听套接字并继承预加载的状态；主进程负责转发信号、优雅退出，以及重启异常退出的工作进程
+"""
+
+import os
+import time
+import select
+import signal
+import socket
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger("prefork")
+
+# 工作进程启动后在该时间内退出视为启动失败，重启前等待，避免快速循环重启
+_CRASH_WINDOW = 5.0
+_RESPAWN_BACKOFF = 1.0
+# 优雅退出超时后再等待的时间，之后强制结束
+_KILL_GRACE = 5.0
+
+
+def _bind(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, sock: socket.socket, index: int, ready_fd: int, log_level: str,
+                graceful_timeout: float) -> int:
+    """工作进程：恢复默认信号处理后交给 uvicorn，就绪时通过管道通知主进程"""
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    async def notify_ready():
+        os.write(ready_fd, bytes([index % 256]))
+
+    # 排在应用自身的启动事件之后，写后队列等组件都已启动才算就绪
+    app.router.on_startup.append(notify_ready)
+    config = uvicorn.Config(app, log_level=log_level, timeout_graceful_shutdown=graceful_timeout,
+                            access_log=False)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    return 0
+
+
+def serve(host: str = "0.0.0.0", port: int = 8000, workers: int = 1, graceful_timeout: float = 30.0,
+          log_level: str = "info", launched_at: Optional[float] = None) -> int:
+    """以 workers 个进程提供服务；workers 为 1 或平台不支持 fork 时在当前进程中运行"""
+    launched_at = launched_at or time.time()
+    if workers > 1 and not hasattr(os, "fork"):
+        logger.warning("当前平台不支持 fork，退化为单进程运行")
+        workers = 1
+    # 必须在导入应用之前设置
+    os.environ["SMART_CITY_MULTIPROCESS"] = "1" if workers > 1 else "0"
+    os.environ["SMART_CITY_LAUNCH_TIME"] = str(launched_at)
+
+    started = time.perf_counter()
+    import uvicorn
+    import main
+    main.startup_timings["import"] = time.perf_counter() - started
+    main.preload_state()
+    logger.info(f"应用已预加载: 导入 {main.startup_timings['import']:.2f}s, "
+                f"重建内存状态 {main.startup_timings['preload']:.2f}s")
+
+    if workers <= 1:
+        uvicorn.run(main.app, host=host, port=port, log_level=log_level,
+                    timeout_graceful_shutdown=graceful_timeout, access_log=False)
+        return 0
+
+    sock = _bind(host, port)
+    ready_r, ready_w = os.pipe()
+    children: Dict[int, int] = {}
+    spawned_at: Dict[int, float] = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                os.close(ready_r)
+                code = _run_worker(main.app, sock, index, ready_w, log_level, graceful_timeout)
+            except BaseException:
+                logger.exception(f"工作进程 {index} 异常退出")
+            finally:
+                os._exit(code)
+        children[pid] = index
+        spawned_at[index] = time.monotonic()
+
+    def handle_signal(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    for index in range(workers):
+        spawn(index)
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    logger.info(f"已启动 {workers} 个工作进程，监听 {host}:{port}")
+
+    ready = set()
+    cold_start_reported = False
+    while not stopping:
+        try:
+            readable, _, _ = select.select([ready_r], [], [], 0.5)
+        except InterruptedError:
+            continue
+        if readable:
+            ready.update(os.read(ready_r, 256))
+            if not cold_start_reported and len(ready) >= workers:
+                cold_start_reported = True
+                logger.info(f"冷启动完成: {workers} 个工作进程就绪，自启动器启动起 {time.time() - launched_at:.2f}s")
+
+        # 回收退出的工作进程并重启
+        while children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            index = children.pop(pid)
+            if stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            logger.warning(f"工作进程 {index} (pid {pid}) 退出，状态 {code}，正在重启")
+            if time.monotonic() - spawned_at.get(index, 0) < _CRASH_WINDOW:
+                time.sleep(_RESPAWN_BACKOFF)
+            spawn(index)
+
+    # 优雅退出：通知工作进程停止接受新连接并处理完在途请求，执行各自的关闭事件（刷新写后队列等）
+    logger.info("正在停止工作进程...")
+    sock.close()
+    for pid in list(children):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + graceful_timeout + _KILL_GRACE
+    while children and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.1)
+            continue
+        children.pop(pid, None)
+    for pid in children:
+        logger.warning(f"工作进程 pid {pid} 未在超时内退出，强制结束")
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+    os.close(ready_r)
+    os.close(ready_w)
+    logger.info("服务已停止")
+    return 0
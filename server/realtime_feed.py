@@ -0,0 +1,180 @@
+"""
+实时数据推送：单个后台定时器按间隔生成各数据流的样本一次，扇出给所有 WebSocket/SSE 订阅者
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每个订阅者最多缓存的消息数；队列满时丢弃最旧的消息
+FEED_QUEUE_SIZE = int(os.getenv("SMART_CITY_FEED_QUEUE_SIZE", "16"))
+# 连续这么多次推送时队列仍是满的，判定为慢消费者并断开
+FEED_MAX_LAG = int(os.getenv("SMART_CITY_FEED_MAX_LAG", "32"))
+
+
+class Feed:
+    def __init__(self, name: str, sampler: Callable[[], Dict[str, Any]], interval: float):
+        self.name = name
+        self.sampler = sampler
+        self.interval = interval
+        self.latest: Optional[Dict[str, Any]] = None
+        self.sampled_at = 0.0
+        self.next_due = 0.0
+
+    def sample(self, now: float) -> Dict[str, Any]:
+        self.latest = self.sampler()
+        self.sampled_at = now
+        self.next_due = now + self.interval
+        return self.latest
+
+
+class Subscriber:
+    """单个客户端连接的消息队列；None 表示连接已被服务端关闭"""
+
+    def __init__(self, feeds: Set[str], queue_size: int = FEED_QUEUE_SIZE):
+        self.feeds = feeds
+        self.queue: "asyncio.Queue[Optional[Tuple[str, Dict[str, Any]]]]" = asyncio.Queue(max(1, queue_size))
+        self.dropped = 0
+        self.lag = 0
+        self.closed = False
+
+    async def get(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        if self.closed and self.queue.empty():
+            return None
+        return await self.queue.get()
+
+    def offer(self, message: Tuple[str, Dict[str, Any]], max_lag: int) -> bool:
+        """放入一条消息，返回 False 表示该订阅者因积压过多被断开"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            self.lag += 1
+            if self.lag >= max_lag:
+                self.closed = True
+                self.queue.put_nowait(None)
+                return False
+        else:
+            self.lag = 0
+        self.queue.put_nowait(message)
+        return True
+
+
+class FeedHub:
+    def __init__(self, max_lag: int = FEED_MAX_LAG):
+        self.max_lag = max_lag
+        self.feeds: Dict[str, Feed] = {}
+        self.subscribers: List[Subscriber] = []
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.stats = {"samples": 0, "messages": 0, "dropped": 0, "disconnected": 0}
+
+    def register(self, name: str, sampler: Callable[[], Dict[str, Any]], interval: float):
+        self.feeds[name] = Feed(name, sampler, interval)
+
+    def latest(self, name: str) -> Dict[str, Any]:
+        """轮询接口使用：间隔内复用定时器生成的样本，过期时才重新采样"""
+        feed = self.feeds[name]
+        now = time.monotonic()
+        if feed.latest is None or now - feed.sampled_at >= feed.interval:
+            feed.sample(now)
+            self.stats["samples"] += 1
+        return feed.latest
+
+    def parse_feeds(self, text: Optional[str]) -> Set[str]:
+        if not text:
+            return set(self.feeds)
+        names = {name.strip() for name in text.split(",") if name.strip()}
+        unknown = names - set(self.feeds)
+        if unknown:
+            raise ValueError(f"未知的数据流: {', '.join(sorted(unknown))}，可选 {', '.join(self.feeds)}")
+        return names
+
+    def subscribe(self, feeds: Iterable[str]) -> Subscriber:
+        subscriber = Subscriber(set(feeds))
+        self.subscribers.append(subscriber)
+        # 新订阅者立即收到各数据流的最近样本，无需等待下一个周期
+        for name in subscriber.feeds:
+            if self.feeds[name].latest is not None:
+                subscriber.offer((name, self.feeds[name].latest), self.max_lag)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for subscriber in self.subscribers:
+            subscriber.closed = True
+            if subscriber.queue.full():
+                subscriber.queue.get_nowait()
+            subscriber.queue.put_nowait(None)
+        self.subscribers = []
+
+    def tick(self, now: float):
+        """生成到期数据流的样本并扇出；没有订阅者的数据流不采样"""
+        active = set()
+        for subscriber in self.subscribers:
+            active |= subscriber.feeds
+        for name in active:
+            feed = self.feeds[name]
+            if now < feed.next_due:
+                continue
+            message = (name, feed.sample(now))
+            self.stats["samples"] += 1
+            for subscriber in list(self.subscribers):
+                if name not in subscriber.feeds:
+                    continue
+                before = subscriber.dropped
+                if subscriber.offer(message, self.max_lag):
+                    self.stats["messages"] += 1
+                else:
+                    self.unsubscribe(subscriber)
+                    self.stats["disconnected"] += 1
+                    logger.info(f"断开慢消费者: 已丢弃 {subscriber.dropped} 条消息")
+                self.stats["dropped"] += subscriber.dropped - before
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            try:
+                self.tick(now)
+            except Exception as e:
+                logger.error(f"实时数据推送失败: {str(e)}")
+            if self.subscribers:
+                active = set().union(*(s.feeds for s in self.subscribers))
+                delay = max(0.0, min(self.feeds[name].next_due for name in active) - time.monotonic())
+            else:
+                delay = None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "subscribers": len(self.subscribers),
+            "feeds": {name: feed.interval for name, feed in self.feeds.items()},
+            **self.stats,
+        }
+
+
+feed_hub = FeedHub()
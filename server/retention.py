@@ -0,0 +1,297 @@
+"""
+数据保留与归档：把超过保留期的原始行按天分区写入 gzip 压缩的 NDJSON 归档文件，
+小批量从热库删除，并在后台做增量 vacuum，使 smart_city.db 保持较小
+"""
+
+import os
+import gzip
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from database import DB_PATH, connect, pool
+
+try:
+    import fcntl
+except ImportError:  # Windows 上不支持多进程部署，无需跨进程互斥
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 保留天数，0 表示不自动归档（仍可通过管理接口手动触发）
+RETENTION_DAYS = float(os.getenv("SMART_CITY_RETENTION_DAYS", "0"))
+RETENTION_INTERVAL = float(os.getenv("SMART_CITY_RETENTION_INTERVAL", "3600"))
+RETENTION_BATCH = int(os.getenv("SMART_CITY_RETENTION_BATCH", "2000"))
+ARCHIVE_DIR = os.getenv("SMART_CITY_ARCHIVE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(DB_PATH)), "archive")
+
+# 参与归档的表；blockchain_data 是存证校验的依据，始终留在热库
+RETENTION_TABLES = ("traffic_data", "health_data", "city_configs")
+
+# 启动后首次归档前的等待时间，避开启动时的缓存预热
+_INITIAL_DELAY = 60.0
+# 每批删除之间、每步 vacuum 之间让出写锁的间隔
+_BATCH_PAUSE = 0.05
+_VACUUM_STEP_PAGES = 256
+
+_SQL_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def init_tables(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive_files (
+            path TEXT PRIMARY KEY,
+            table_name TEXT,
+            day TEXT,
+            row_count INTEGER,
+            min_id INTEGER,
+            max_id INTEGER,
+            bytes INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_archive_files_table_day ON archive_files(table_name, day)")
+
+
+def archived_counts(conn: sqlite3.Connection) -> Dict[str, int]:
+    """各表已归档的行数（总览计数需要加上这部分）"""
+    rows = conn.execute("SELECT table_name, SUM(row_count) FROM archive_files GROUP BY table_name").fetchall()
+    return {table: int(count or 0) for table, count in rows}
+
+
+def sql_time(epoch: float) -> str:
+    """UNIX 秒 -> 与 CURRENT_TIMESTAMP 相同格式的 UTC 时间"""
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime(_SQL_TIME_FORMAT)
+
+
+class RetentionManager:
+    """定期归档过期数据；归档、删除与 vacuum 都在后台线程中使用独立连接完成，不占用请求路径"""
+
+    def __init__(self, days: float = RETENTION_DAYS, interval: float = RETENTION_INTERVAL,
+                 batch_size: int = RETENTION_BATCH, archive_dir: str = ARCHIVE_DIR,
+                 path: Optional[str] = None):
+        self.days = days
+        self.interval = max(60.0, interval)
+        self.batch_size = max(1, batch_size)
+        self.archive_dir = archive_dir
+        self.path = path or DB_PATH
+        self._stopping = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running: Optional[asyncio.Future] = None
+        self._run_lock: Optional[asyncio.Lock] = None
+        self._vacuum_warned = False
+        self.stats = {"runs": 0, "rows": 0, "files": 0, "bytes": 0, "vacuum_pages": 0, "errors": 0}
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    # ==================== 调度 ====================
+
+    def start(self):
+        self._stopping.clear()
+        self._run_lock = asyncio.Lock()
+        if self.days > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            logger.info(f"数据归档已启用: 保留 {self.days} 天, 每 {self.interval:.0f}s 检查一次, 归档目录 {self.archive_dir}")
+
+    async def stop(self):
+        """停止定时任务；进行中的归档在当前批次结束后退出"""
+        self._stopping.set()
+        running = self._running
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if running is not None:
+            try:
+                await running
+            except Exception:
+                pass
+
+    async def _run(self):
+        await asyncio.sleep(_INITIAL_DELAY)
+        while True:
+            try:
+                await self.run_now()
+            except RuntimeError:
+                pass
+            except Exception as e:
+                logger.error(f"数据归档失败: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def run_now(self, days: Optional[float] = None) -> Dict[str, Any]:
+        """立即执行一轮归档（在默认线程池中运行，不占用请求 IO 线程）"""
+        days = self.days if days is None else days
+        if days <= 0:
+            raise ValueError("未配置保留天数（SMART_CITY_RETENTION_DAYS）")
+        if self._run_lock is None or self._run_lock.locked():
+            raise RuntimeError("已有进行中的归档任务")
+        async with self._run_lock:
+            self._running = asyncio.get_running_loop().run_in_executor(None, self.run_once, days)
+            try:
+                # shield: 停止服务时取消定时任务不会中断正在写入的批次
+                return await asyncio.shield(self._running)
+            finally:
+                self._running = None
+
+    # ==================== 归档 ====================
+
+    def run_once(self, days: float) -> Dict[str, Any]:
+        started = time.perf_counter()
+        os.makedirs(self.archive_dir, exist_ok=True)
+        # 多进程部署时每个工作进程都有调度任务，用文件锁保证同一时刻只有一个进程在归档
+        lock = open(os.path.join(self.archive_dir, ".lock"), "w")
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise RuntimeError("其它进程正在归档")
+            return self._run_locked(days, started)
+        finally:
+            lock.close()
+
+    def _run_locked(self, days: float, started: float) -> Dict[str, Any]:
+        cutoff = sql_time(time.time() - days * 86400)
+        result: Dict[str, Any] = {"cutoff": cutoff, "tables": {}, "files": 0, "bytes": 0}
+        conn = connect(self.path)
+        try:
+            for table in RETENTION_TABLES:
+                rows, files, size = self._archive_table(conn, table, cutoff)
+                result["tables"][table] = rows
+                result["files"] += files
+                result["bytes"] += size
+            result["vacuum_pages"] = self._vacuum(conn)
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            conn.close()
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        result["interrupted"] = self._stopping.is_set()
+        archived = sum(result["tables"].values())
+        self.stats["runs"] += 1
+        self.stats["rows"] += archived
+        self.stats["files"] += result["files"]
+        self.stats["bytes"] += result["bytes"]
+        self.stats["vacuum_pages"] += result["vacuum_pages"]
+        self.last_run = {"finished_at": datetime.now().isoformat(), **result}
+        if archived:
+            logger.info(f"数据归档完成: {result['tables']}, {result['files']} 个文件, "
+                        f"{result['bytes'] // 1024} KB, 回收 {result['vacuum_pages']} 页, 用时 {result['seconds']}s")
+        return result
+
+    def _archive_table(self, conn: sqlite3.Connection, table: str, cutoff: str):
+        total_rows = total_files = total_bytes = 0
+        while not self._stopping.is_set():
+            # 按时间戳索引顺序取最旧的一批，历史导入的大 id 旧数据也能被及时归档
+            cursor = conn.execute(
+                f"SELECT * FROM {table} WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?",
+                (cutoff, self.batch_size)
+            )
+            names = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            id_idx, stamp_idx = names.index("id"), names.index("timestamp")
+            days: Dict[str, List[Sequence[Any]]] = {}
+            for row in rows:
+                days.setdefault(row[stamp_idx][:10], []).append(row)
+
+            entries = []
+            for day, group in days.items():
+                entries.append(self._write_part(table, day, names, group, id_idx))
+            # 先落盘归档文件，再在同一事务中登记清单并删除原始行：中途崩溃只会留下未登记的文件
+            with conn:
+                conn.executemany('''
+                    INSERT OR REPLACE INTO archive_files (path, table_name, day, row_count, min_id, max_id, bytes)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', entries)
+                conn.executemany(f"DELETE FROM {table} WHERE id = ?", [(row[id_idx],) for row in rows])
+            total_rows += len(rows)
+            total_files += len(entries)
+            total_bytes += sum(entry[-1] for entry in entries)
+            time.sleep(_BATCH_PAUSE)
+        return total_rows, total_files, total_bytes
+
+    def _write_part(self, table: str, day: str, names: List[str], rows: List[Sequence[Any]], id_idx: int):
+        ids = [row[id_idx] for row in rows]
+        min_id, max_id = min(ids), max(ids)
+        relative = os.path.join(table, day, f"{min_id:012d}-{max_id:012d}.ndjson.gz")
+        target = os.path.join(self.archive_dir, relative)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp = f"{target}.{os.getpid()}.tmp"
+        lines = "".join(json.dumps(dict(zip(names, row)), ensure_ascii=False) + "\n" for row in rows)
+        with open(temp, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6, mtime=0) as f:
+                f.write(lines.encode("utf-8"))
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(temp, target)
+        return relative, table, day, len(rows), min_id, max_id, os.path.getsize(target)
+
+    def _vacuum(self, conn: sqlite3.Connection) -> int:
+        """增量 vacuum：每次回收少量空闲页并让出写锁，直到空闲页用尽"""
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if not self._vacuum_warned:
+                self._vacuum_warned = True
+                logger.warning("数据库未启用增量 vacuum，删除后的空闲页会被复用但文件不会缩小；"
+                               "可在停服时执行 PRAGMA auto_vacuum=INCREMENTAL; VACUUM; 启用")
+            return 0
+        initial = free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while free > 0 and not self._stopping.is_set():
+            # execute() 只单步执行语句（每次仅回收一页），executescript 会把该 PRAGMA 执行完
+            conn.executescript(f"PRAGMA incremental_vacuum({_VACUUM_STEP_PAGES});")
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            time.sleep(_BATCH_PAUSE)
+        return initial - free
+
+    # ==================== 读取 ====================
+
+    def partitions(self, conn: sqlite3.Connection) -> Dict[str, Any]:
+        """各表归档概况"""
+        rows = conn.execute('''
+            SELECT table_name, COUNT(*), SUM(row_count), SUM(bytes), MIN(day), MAX(day)
+            FROM archive_files GROUP BY table_name
+        ''').fetchall()
+        return {
+            table: {"files": files, "rows": count, "bytes": size, "first_day": first, "last_day": last}
+            for table, files, count, size, first, last in rows
+        }
+
+    def read(self, table: str, start: str, end: str, limit: Optional[int] = None) -> Iterator[bytes]:
+        """按 [start, end) 读取归档行（NDJSON 字节行），只打开覆盖该时间范围的日分区
+
+        生成器在迭代它的线程中取连接，可直接交给 StreamingResponse 在线程池中迭代。
+        """
+        files = pool.get().execute('''
+            SELECT path, day FROM archive_files
+            WHERE table_name = ? AND day >= ? AND day <= ?
+            ORDER BY day, min_id
+        ''', (table, start[:10], end[:10])).fetchall()
+        emitted = 0
+        for path, day in files:
+            # 只有首尾两天需要逐行比较时间戳，中间整天直接输出
+            boundary = day == start[:10] or day == end[:10]
+            try:
+                with gzip.open(os.path.join(self.archive_dir, path), "rb") as f:
+                    for line in f:
+                        if boundary:
+                            stamp = json.loads(line)["timestamp"]
+                            if not (start <= stamp < end):
+                                continue
+                        yield line
+                        emitted += 1
+                        if limit is not None and emitted >= limit:
+                            return
+            except (OSError, EOFError) as e:
+                logger.error(f"归档文件读取失败 {path}: {str(e)}")
+
+
+retention_manager = RetentionManager()
@@ -0,0 +1,299 @@
+"""
+交通/健康时间序列的分钟、小时、天级汇总表，写入时增量维护，历史查询自动选择最粗的可用粒度
+"""
+
+import re
+import time
+import sqlite3
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from database import parse_insert
+
+logger = logging.getLogger(__name__)
+
+# 汇总粒度（秒），由细到粗
+RESOLUTIONS: Dict[str, int] = {"minute": 60, "hour": 3600, "day": 86400}
+
+# 每个指标的直方图范围，用于增量计算分位数（超出范围的值计入首/末桶）
+HISTOGRAM_BINS = 64
+METRICS: Dict[str, Dict[str, Tuple[float, float]]] = {
+    "traffic_data": {
+        "vehicle_count": (0, 5000),
+        "avg_speed": (0, 150),
+        "optimization_score": (0, 100),
+    },
+    "health_data": {
+        "heart_rate": (0, 250),
+        "systolic_bp": (0, 250),
+        "diastolic_bp": (0, 200),
+        "exercise_minutes": (0, 600),
+        "sleep_hours": (0, 24),
+        "health_score": (0, 100),
+    },
+}
+
+PERCENTILES = (50, 90, 99)
+MAX_POINTS = 2000
+
+_UPSERT_ROLLUP = '''
+    INSERT INTO metric_rollups (metric, resolution, bucket_start, count, sum, min, max)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(metric, resolution, bucket_start) DO UPDATE SET
+        count = count + excluded.count,
+        sum = sum + excluded.sum,
+        min = MIN(min, excluded.min),
+        max = MAX(max, excluded.max)
+'''
+
+_UPSERT_BIN = '''
+    INSERT INTO metric_rollup_bins (metric, resolution, bucket_start, bin, count)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(metric, resolution, bucket_start, bin) DO UPDATE SET
+        count = count + excluded.count
+'''
+
+
+def init_tables(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS metric_rollups (
+            metric TEXT,
+            resolution TEXT,
+            bucket_start INTEGER,
+            count INTEGER,
+            sum REAL,
+            min REAL,
+            max REAL,
+            PRIMARY KEY (metric, resolution, bucket_start)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS metric_rollup_bins (
+            metric TEXT,
+            resolution TEXT,
+            bucket_start INTEGER,
+            bin INTEGER,
+            count INTEGER,
+            PRIMARY KEY (metric, resolution, bucket_start, bin)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _bin_index(values: np.ndarray, bounds: Tuple[float, float]) -> np.ndarray:
+    low, high = bounds
+    idx = ((values - low) / (high - low) * HISTOGRAM_BINS).astype(np.int64)
+    return np.clip(idx, 0, HISTOGRAM_BINS - 1)
+
+
+def _bin_centers(bounds: Tuple[float, float]) -> np.ndarray:
+    low, high = bounds
+    width = (high - low) / HISTOGRAM_BINS
+    return low + (np.arange(HISTOGRAM_BINS) + 0.5) * width
+
+
+def aggregate_rows(table: str, timestamps: np.ndarray, columns: Dict[str, np.ndarray]) -> Tuple[list, list]:
+    """将一批原始行聚合为汇总表与直方图的 upsert 参数"""
+    rollup_rows: list = []
+    bin_rows: list = []
+    for metric, bounds in METRICS[table].items():
+        values = columns.get(metric)
+        if values is None:
+            continue
+        valid = ~np.isnan(values)
+        if not valid.any():
+            continue
+        values = values[valid]
+        stamps = timestamps[valid]
+        bins = _bin_index(values, bounds)
+        for resolution, seconds in RESOLUTIONS.items():
+            buckets = stamps // seconds * seconds
+            keys, inverse = np.unique(buckets, return_inverse=True)
+            counts = np.bincount(inverse)
+            sums = np.bincount(inverse, weights=values)
+            mins = np.full(keys.size, np.inf)
+            maxs = np.full(keys.size, -np.inf)
+            np.minimum.at(mins, inverse, values)
+            np.maximum.at(maxs, inverse, values)
+            for k, c, s, lo, hi in zip(keys.tolist(), counts.tolist(), sums.tolist(), mins.tolist(), maxs.tolist()):
+                rollup_rows.append((metric, resolution, k, c, s, lo, hi))
+
+            pair = inverse * HISTOGRAM_BINS + bins
+            pair_keys, pair_counts = np.unique(pair, return_counts=True)
+            for p, c in zip(pair_keys.tolist(), pair_counts.tolist()):
+                bin_rows.append((metric, resolution, int(keys[p // HISTOGRAM_BINS]), p % HISTOGRAM_BINS, c))
+    return rollup_rows, bin_rows
+
+
+class RollupMaintainer:
+    """写后队列事务回调：把新写入的交通/健康数据累加到汇总表，与原始行在同一事务中提交"""
+
+    def statements(self, sql: str, rows: List[Sequence[Any]]) -> List[Tuple[str, list]]:
+        parsed = parse_insert(sql)
+        if parsed is None or parsed[0] not in METRICS:
+            return []
+        table, columns = parsed
+        if "timestamp" in columns:
+            # 批量导入的历史数据自带时间戳（SQLite UTC 格式）
+            idx = columns.index("timestamp")
+            stamps = np.array([row[idx] for row in rows], dtype="datetime64[s]").astype(np.int64)
+        else:
+            # 原始行使用 CURRENT_TIMESTAMP 默认值，提交时刻即为其时间戳
+            stamps = np.full(len(rows), int(time.time()), dtype=np.int64)
+        data = {}
+        for metric in METRICS[table]:
+            if metric in columns:
+                idx = columns.index(metric)
+                data[metric] = np.array([row[idx] for row in rows], dtype=np.float64)
+        rollup_rows, bin_rows = aggregate_rows(table, stamps, data)
+        return [(_UPSERT_ROLLUP, rollup_rows), (_UPSERT_BIN, bin_rows)]
+
+
+def backfill(conn: sqlite3.Connection, chunk_size: int = 50000):
+    """汇总表为空而原始表有数据时（如升级后首次启动），从原始行回填"""
+    if conn.execute("SELECT 1 FROM metric_rollups LIMIT 1").fetchone():
+        return
+    for table, metrics in METRICS.items():
+        names = list(metrics)
+        cursor = conn.execute(
+            f"SELECT CAST(strftime('%s', timestamp) AS INTEGER), {', '.join(names)} FROM {table} "
+            "WHERE timestamp IS NOT NULL"
+        )
+        total = 0
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            raw = np.array(chunk, dtype=np.float64)
+            data = {name: raw[:, i + 1] for i, name in enumerate(names)}
+            rollup_rows, bin_rows = aggregate_rows(table, raw[:, 0].astype(np.int64), data)
+            with conn:
+                conn.executemany(_UPSERT_ROLLUP, rollup_rows)
+                conn.executemany(_UPSERT_BIN, bin_rows)
+            total += len(chunk)
+        if total:
+            logger.info(f"汇总表回填完成: {table} {total} 行")
+
+
+# ==================== 历史查询 ====================
+
+_DURATION_RE = re.compile(r"^(\d+)\s*([smhd]?)$")
+_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(text: str) -> int:
+    """解析 '90'、'15m'、'6h'、'1d' 或 minute/hour/day 形式的粒度，返回秒数"""
+    text = text.strip().lower()
+    if text in RESOLUTIONS:
+        return RESOLUTIONS[text]
+    match = _DURATION_RE.match(text)
+    if match is None:
+        raise ValueError(f"无法解析的时间粒度: {text}")
+    return int(match.group(1)) * _UNITS[match.group(2)]
+
+
+def choose_resolution(step: int) -> str:
+    """选择桶宽不超过请求步长且能整除步长的最粗汇总粒度"""
+    chosen = "minute"
+    for name, seconds in RESOLUTIONS.items():
+        if seconds <= step and step % seconds == 0:
+            chosen = name
+    return chosen
+
+
+def _percentile_from_histogram(hist: np.ndarray, centers: np.ndarray, q: float) -> np.ndarray:
+    """hist: (points, bins)，返回每个点的近似分位数"""
+    totals = hist.sum(axis=1)
+    cumulative = np.cumsum(hist, axis=1)
+    target = np.maximum(totals * q / 100.0, 1e-9)[:, None]
+    idx = (cumulative >= target).argmax(axis=1)
+    result = centers[idx].astype(np.float64)
+    result[totals == 0] = np.nan
+    return result
+
+
+def query_history(conn: sqlite3.Connection, table: str, start: int, end: int,
+                  step: Optional[int] = None) -> Dict[str, Any]:
+    """按 [start, end) 查询历史，step 为空时自动选择约 200 个点的步长"""
+    if end <= start:
+        raise ValueError("to 必须晚于 from")
+    span = end - start
+    if step is None:
+        # 自动步长向上取整到不超过它的最粗汇总粒度，确保能直接使用该汇总表
+        step = max(60, span // 200)
+        unit = max(seconds for seconds in RESOLUTIONS.values() if seconds <= step)
+        step = -(-step // unit) * unit
+    # 对齐到分钟并限制返回点数
+    min_step = -(-span // MAX_POINTS)
+    step = max(60, step // 60 * 60, -(-min_step // 60) * 60)
+    resolution = choose_resolution(step)
+    bucket_seconds = RESOLUTIONS[resolution]
+
+    origin = start // bucket_seconds * bucket_seconds
+    points = -(-(end - origin) // step)
+    timestamps = origin + np.arange(points, dtype=np.int64) * step
+
+    metrics = METRICS[table]
+    placeholders = ", ".join("?" for _ in metrics)
+    params = [resolution, origin, end, *metrics]
+    rollups = conn.execute(f'''
+        SELECT metric, bucket_start, count, sum, min, max FROM metric_rollups
+        WHERE resolution = ? AND bucket_start >= ? AND bucket_start < ? AND metric IN ({placeholders})
+    ''', params).fetchall()
+    bins = conn.execute(f'''
+        SELECT metric, bucket_start, bin, count FROM metric_rollup_bins
+        WHERE resolution = ? AND bucket_start >= ? AND bucket_start < ? AND metric IN ({placeholders})
+    ''', params).fetchall()
+
+    result: Dict[str, Any] = {}
+    names = list(metrics)
+    metric_index = {name: i for i, name in enumerate(names)}
+    count = np.zeros((len(names), points))
+    total = np.zeros((len(names), points))
+    low = np.full((len(names), points), np.inf)
+    high = np.full((len(names), points), -np.inf)
+    hist = np.zeros((len(names), points, HISTOGRAM_BINS))
+
+    if rollups:
+        m = np.array([metric_index[r[0]] for r in rollups])
+        raw = np.array([r[1:] for r in rollups], dtype=np.float64)
+        p = ((raw[:, 0] - origin) // step).astype(np.int64)
+        np.add.at(count, (m, p), raw[:, 1])
+        np.add.at(total, (m, p), raw[:, 2])
+        np.minimum.at(low, (m, p), raw[:, 3])
+        np.maximum.at(high, (m, p), raw[:, 4])
+    if bins:
+        m = np.array([metric_index[r[0]] for r in bins])
+        raw = np.array([r[1:] for r in bins], dtype=np.int64)
+        p = (raw[:, 0] - origin) // step
+        np.add.at(hist, (m, p, raw[:, 1]), raw[:, 2])
+
+    def column(values: np.ndarray, digits: int = 2) -> List[Optional[float]]:
+        return [None if np.isnan(v) or np.isinf(v) else round(float(v), digits) for v in values]
+
+    for name, i in metric_index.items():
+        empty = count[i] == 0
+        mean = np.divide(total[i], count[i], out=np.full(points, np.nan), where=~empty)
+        centers = _bin_centers(metrics[name])
+        entry = {
+            "count": count[i].astype(np.int64).tolist(),
+            "mean": column(mean),
+            "min": column(np.where(empty, np.nan, low[i])),
+            "max": column(np.where(empty, np.nan, high[i])),
+        }
+        for q in PERCENTILES:
+            estimate = _percentile_from_histogram(hist[i], centers, q)
+            # 直方图估计值限制在该桶实际最小/最大值之间
+            estimate = np.clip(estimate, low[i], high[i])
+            entry[f"p{q}"] = column(np.where(empty, np.nan, estimate))
+        result[name] = entry
+
+    return {
+        "from": start,
+        "to": end,
+        "step_seconds": int(step),
+        "source_resolution": resolution,
+        "timestamps": timestamps.tolist(),
+        "metrics": result,
+    }
@@ -1,8 +1,21 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field, validator
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Literal
 import math
+import os
+import sys
+
+import numpy as np
+
+try:
+    from . import signal_search, traffic_sim
+    from .traffic_network import StageTimer, green_wave_offsets, solve_network
+except ImportError:
+    # Run as a script (python src/main.py): there is no parent package, import src from the server directory
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src import signal_search, traffic_sim
+    from src.traffic_network import StageTimer, green_wave_offsets, solve_network
 
 app = FastAPI(title="Solarpunk Smart City API", version="0.1.0")
 
@@ -14,10 +27,21 @@ app.add_middleware(
 )
 
 
-class TrafficRequest(BaseModel):
-    intersections: int = Field(1, gt=0, le=50)
+# Slack allowed when plan greens are checked against their cycle
+GREEN_TOLERANCE_S = 0.5
+
+
+class NetworkRequest(BaseModel):
+    intersections: int = Field(1, gt=0, le=5000)
     approaches: int = Field(4, gt=2, le=8)
     demand: List[int] = Field(..., description="Vehicles per minute per approach")
+    network_demand: Optional[List[List[int]]] = Field(
+        None, description="Per-intersection demand (intersections x approaches); defaults to demand for every intersection"
+    )
+    corridor_size: int = Field(10, gt=0, description="Consecutive intersections coordinated as one green-wave corridor")
+    spacing_m: float = Field(300.0, gt=0, description="Distance between neighbouring intersections")
+    speed_kmh: float = Field(50.0, gt=0, le=traffic_sim.MAX_SPEED_KMH,
+                             description="Progression speed for green-wave offsets")
 
     @validator("demand")
     def validate_demand(cls, v, values):
@@ -28,12 +52,133 @@ class TrafficRequest(BaseModel):
             raise ValueError("demand must be non-negative")
         return v
 
+    @validator("network_demand")
+    def validate_network_demand(cls, v, values):
+        if v is None:
+            return v
+        intersections = values.get("intersections", 1)
+        approaches = values.get("approaches", 4)
+        if len(v) != intersections:
+            raise ValueError(f"network_demand length must equal intersections ({intersections})")
+        if any(len(row) != approaches for row in v):
+            raise ValueError(f"each network_demand row must have {approaches} entries")
+        if any(x < 0 for row in v for x in row):
+            raise ValueError("network_demand must be non-negative")
+        return v
+
+
+class TrafficRequest(NetworkRequest):
+    mode: Optional[Literal["proportional", "webster", "search"]] = Field(
+        None, description="Defaults to webster for several intersections or network_demand, proportional otherwise"
+    )
+    time_budget_ms: int = Field(250, ge=10, le=10000, description="Latency budget of the cycle/split search (mode=search)")
+    simulate: bool = Field(False, description="Score the plan against an equal split with the traffic microsimulator")
+    sim_seconds: int = Field(600, ge=60, le=3600)
+    sim_seed: int = 0
+
+    @validator("mode", always=True)
+    def validate_mode(cls, v, values):
+        network = values.get("intersections", 1) > 1 or values.get("network_demand") is not None
+        if v is None:
+            return "webster" if network else "proportional"
+        if v == "proportional" and network:
+            raise ValueError("proportional mode plans a single intersection; "
+                             "use webster or search with intersections or network_demand")
+        return v
+
+
+class SignalPlanInput(BaseModel):
+    cycle_seconds: float = Field(..., ge=10, le=300)
+    green_times: List[float] = Field(..., description="Green seconds per approach, served as sequential phases")
+    green_wave: bool = Field(False, description="Offset signals along each corridor by travel time at speed_kmh")
+
+    @validator("green_times")
+    def validate_green_times(cls, v, values):
+        cycle = values.get("cycle_seconds")
+        # Phases run one after another, so they must fit in the cycle (rounded greens may overshoot slightly)
+        if cycle is not None and sum(v) > cycle + GREEN_TOLERANCE_S:
+            raise ValueError(f"green_times sum to {sum(v):g} s, more than cycle_seconds ({cycle:g} s)")
+        return v
+
+
+class SimulationRequest(NetworkRequest):
+    city_grid_size: Optional[int] = Field(
+        None, gt=0, le=2000,
+        description="Simulate the 3D view's road grid for a city of this size instead of intersections/corridor_size"
+    )
+    plans: List[SignalPlanInput] = Field(..., min_length=1, max_length=64, description="Scenarios run side by side")
+    seconds: int = Field(600, ge=60, le=7200)
+    seed: int = 0
+    through_ratio: float = Field(traffic_sim.THROUGH_RATIO, ge=0, le=1)
+
+    @validator("plans")
+    def validate_plans(cls, v, values):
+        approaches = values.get("approaches", 4)
+        for plan in v:
+            if len(plan.green_times) != approaches:
+                raise ValueError(f"green_times length must equal approaches ({approaches})")
+            if any(g < 0 for g in plan.green_times):
+                raise ValueError("green_times must be non-negative")
+        return v
+
+
+class SimulationReport(BaseModel):
+    seconds: int
+    intersections_simulated: int
+    delay_per_vehicle: float
+    throughput_vph: float
+    baseline_delay_per_vehicle: float
+    baseline_throughput_vph: float
+    delay_reduction_percent: float
+
+
+class ScenarioResult(BaseModel):
+    delay_per_vehicle: float
+    throughput_vph: float
+    network_exits_vph: float
+    mean_entry_queue: float
+
+
+class SimulationResult(BaseModel):
+    rows: int
+    cols: int
+    seconds: int
+    measured_seconds: int
+    scenarios: List[ScenarioResult]
+    best_scenario: int
+    timings_ms: Dict[str, float]
+
+
+class IntersectionPlan(BaseModel):
+    cycle_seconds: int
+    offset_seconds: float
+    green_times: List[float]
+    degree_of_saturation: float
+    efficiency_score: float
+    delay_per_vehicle: Optional[float] = None
+
+
+class SearchReport(BaseModel):
+    time_budget_ms: int
+    cycle_candidates: int
+    candidates_evaluated: int
+    rounds_min: int
+    rounds_max: int
+    workers: int
+    delay_per_vehicle: float
+    baseline_delay_per_vehicle: float
+    delay_reduction_percent: float
+
 
 class TrafficPlan(BaseModel):
     cycle_seconds: int
     green_times: List[float]
     efficiency_score: float
     notes: str
+    intersections: Optional[List[IntersectionPlan]] = None
+    simulation: Optional[SimulationReport] = None
+    search: Optional[SearchReport] = None
+    timings_ms: Optional[Dict[str, float]] = None
 
 
 class HealthInput(BaseModel):
@@ -50,13 +195,175 @@ class HealthAdvice(BaseModel):
     recommendations: List[str]
 
 
+class HealthBatchInput(BaseModel):
+    hr_rest: List[int]
+    sleep_hours: List[float]
+    steps: List[int]
+    age: List[int]
+    conditions: Optional[List[Optional[List[str]]]] = None
+
+
+class HealthBatchAdvice(BaseModel):
+    count: int
+    risk_scores: List[int]
+    flags: Dict[str, List[bool]]
+
+
+@app.on_event("startup")
+def startup():
+    # Fork the search workers before serving, so that requests do not pay for process start-up
+    signal_search.start()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    signal_search.shutdown()
+
+
 @app.get("/healthz")
 def healthz():
     return {"ok": True}
 
 
-@app.post("/api/traffic/optimize", response_model=TrafficPlan)
+def demand_matrix(req: NetworkRequest, intersections: int) -> np.ndarray:
+    if req.network_demand is not None:
+        return np.asarray(req.network_demand, dtype=np.float64)
+    return np.tile(np.asarray(req.demand, dtype=np.float64), (intersections, 1))
+
+
+def optimize_network(req: TrafficRequest) -> TrafficPlan:
+    # Webster cycle per intersection, proportional splits and green-wave offsets along corridors
+    timer = StageTimer()
+    demand = demand_matrix(req, req.intersections)
+    plan = solve_network(demand, req.corridor_size, req.spacing_m, req.speed_kmh, timer=timer)
+
+    cycles = plan["cycles"].astype(int).tolist()
+    offsets = np.round(plan["offsets"], 2).tolist()
+    greens = np.round(plan["greens"], 2).tolist()
+    saturation = np.round(plan["degree_of_saturation"], 3).tolist()
+    scores = np.round(plan["scores"], 3).tolist()
+    intersections = [
+        IntersectionPlan(
+            cycle_seconds=c,
+            offset_seconds=o,
+            green_times=g,
+            degree_of_saturation=x,
+            efficiency_score=e
+        )
+        for c, o, g, x, e in zip(cycles, offsets, greens, saturation, scores)
+    ]
+    timer.mark("serialize")
+
+    return TrafficPlan(
+        cycle_seconds=cycles[0],
+        green_times=greens[0],
+        efficiency_score=round(float(plan["scores"].mean()), 3),
+        notes="Webster cycle per intersection with green-wave offsets along corridors.",
+        intersections=intersections,
+        timings_ms=timer.timings
+    )
+
+
+def optimize_search(req: TrafficRequest) -> TrafficPlan:
+    # Cycle length and green splits searched against the HCM delay model within the request's time budget
+    timer = StageTimer()
+    demand = demand_matrix(req, req.intersections)
+    plan = signal_search.search_network(demand, req.corridor_size, req.spacing_m, req.speed_kmh,
+                                        req.time_budget_ms, timer=timer)
+
+    cycles = plan["cycles"].astype(int).tolist()
+    offsets = np.round(plan["offsets"], 2).tolist()
+    greens = np.round(plan["greens"], 2).tolist()
+    saturation = np.round(plan["degree_of_saturation"], 3).tolist()
+    scores = np.round(plan["scores"], 3).tolist()
+    delays = np.round(plan["delay_per_vehicle"], 2).tolist()
+    intersections = [
+        IntersectionPlan(
+            cycle_seconds=c,
+            offset_seconds=o,
+            green_times=g,
+            degree_of_saturation=x,
+            efficiency_score=e,
+            delay_per_vehicle=d
+        )
+        for c, o, g, x, e, d in zip(cycles, offsets, greens, saturation, scores, delays)
+    ]
+
+    vehicles = float(plan["vehicles_per_second"].sum())
+    delay = float(plan["total_delay"].sum()) / vehicles if vehicles > 0 else 0.0
+    baseline = float(plan["baseline_total_delay"].sum()) / vehicles if vehicles > 0 else 0.0
+    search = SearchReport(
+        time_budget_ms=req.time_budget_ms,
+        cycle_candidates=int(plan["cycle_candidates"]),
+        candidates_evaluated=plan["evaluated"],
+        rounds_min=int(plan["rounds"].min()),
+        rounds_max=int(plan["rounds"].max()),
+        workers=int(plan["workers"]),
+        delay_per_vehicle=round(delay, 2),
+        baseline_delay_per_vehicle=round(baseline, 2),
+        delay_reduction_percent=round((1 - delay / baseline) * 100, 1) if baseline > 0 else 0.0
+    )
+    timer.mark("serialize")
+
+    return TrafficPlan(
+        cycle_seconds=cycles[0],
+        green_times=greens[0],
+        efficiency_score=round(float(plan["scores"].mean()), 3),
+        notes="Cycle length and green splits searched against the HCM delay model, green-wave offsets along corridors.",
+        intersections=intersections,
+        search=search,
+        timings_ms=timer.timings
+    )
+
+
+def simulate_plan(req: TrafficRequest, plan: TrafficPlan) -> SimulationReport:
+    """Measure the plan's delay on a sample of the network against an equal split at the same cycle lengths."""
+    if plan.intersections is not None:
+        cycles = np.array([p.cycle_seconds for p in plan.intersections], dtype=np.float64)
+        greens = np.array([p.green_times for p in plan.intersections], dtype=np.float64)
+        offsets = np.array([p.offset_seconds for p in plan.intersections], dtype=np.float64)
+    else:
+        cycles = np.full(req.intersections, float(plan.cycle_seconds))
+        greens = np.tile(np.asarray(plan.green_times, dtype=np.float64), (req.intersections, 1))
+        offsets = np.zeros(req.intersections)
+
+    rows, cols, index = traffic_sim.grid_sample(req.intersections, req.corridor_size,
+                                                traffic_sim.SCORING_MAX_INTERSECTIONS)
+    if traffic_sim.sim_cells(2, len(index), req.approaches, req.spacing_m, req.speed_kmh) > traffic_sim.MAX_SIM_CELLS:
+        raise HTTPException(status_code=422, detail="simulation too large; reduce spacing_m")
+    cycles, greens, offsets = cycles[index], greens[index], offsets[index]
+    equal = np.repeat(cycles[:, None] / req.approaches, req.approaches, axis=1)
+    result = traffic_sim.simulate(
+        demand_matrix(req, req.intersections)[index],
+        np.stack([cycles, cycles]), np.stack([greens, equal]), np.stack([offsets, np.zeros_like(offsets)]),
+        rows, cols, req.spacing_m, req.speed_kmh, req.sim_seconds, seed=req.sim_seed
+    )
+    delay, throughput = result["delay_per_vehicle"], result["throughput_vph"]
+    return SimulationReport(
+        seconds=req.sim_seconds,
+        intersections_simulated=len(index),
+        delay_per_vehicle=round(float(delay[0]), 2),
+        throughput_vph=round(float(throughput[0]), 1),
+        baseline_delay_per_vehicle=round(float(delay[1]), 2),
+        baseline_throughput_vph=round(float(throughput[1]), 1),
+        delay_reduction_percent=round(float((1 - delay[0] / delay[1]) * 100), 1) if delay[1] > 0 else 0.0
+    )
+
+
+@app.post("/api/traffic/optimize", response_model=TrafficPlan, response_model_exclude_none=True)
 def optimize_traffic(req: TrafficRequest):
+    if req.mode == "webster":
+        plan = optimize_network(req)
+    elif req.mode == "search":
+        plan = optimize_search(req)
+    else:
+        plan = optimize_proportional(req)
+    if req.simulate:
+        plan.simulation = simulate_plan(req, plan)
+    return plan
+
+
+def optimize_proportional(req: TrafficRequest) -> TrafficPlan:
     # Simple proportional split with minimum green, fixed cycle
     cycle = 90
     min_green = 5.0
@@ -94,6 +401,59 @@ def optimize_traffic(req: TrafficRequest):
     )
 
 
+@app.post("/api/traffic/simulate", response_model=SimulationResult)
+def simulate_traffic(req: SimulationRequest):
+    """Run every plan on the same street grid, demand and random draws and report measured delay and throughput."""
+    timer = StageTimer()
+    if req.city_grid_size is not None:
+        rows, cols = traffic_sim.city_street_grid(req.city_grid_size)
+    else:
+        cols = min(req.corridor_size, req.intersections)
+        if req.intersections % cols:
+            raise HTTPException(status_code=422, detail="intersections must be a multiple of corridor_size")
+        rows = req.intersections // cols
+    intersections = rows * cols
+    if req.network_demand is not None and len(req.network_demand) != intersections:
+        raise HTTPException(status_code=422,
+                            detail=f"network_demand length must equal the simulated intersections ({intersections})")
+    if traffic_sim.sim_cells(len(req.plans), intersections, req.approaches, req.spacing_m,
+                             req.speed_kmh) > traffic_sim.MAX_SIM_CELLS:
+        raise HTTPException(status_code=422, detail="simulation too large; reduce plans, intersections or spacing_m")
+
+    demand = demand_matrix(req, intersections)
+    cycles = np.array([[p.cycle_seconds] * intersections for p in req.plans], dtype=np.float64)
+    greens = np.array([[p.green_times] * intersections for p in req.plans], dtype=np.float64)
+    offsets = np.zeros_like(cycles)
+    for s, p in enumerate(req.plans):
+        if p.green_wave:
+            _, offsets[s] = green_wave_offsets(cycles[s], cols, req.spacing_m, req.speed_kmh / 3.6)
+    timer.mark("prepare")
+
+    result = traffic_sim.simulate(demand, cycles, greens, offsets, rows, cols, req.spacing_m, req.speed_kmh,
+                                  req.seconds, through_ratio=req.through_ratio, seed=req.seed)
+    timer.mark("simulate")
+
+    delay = result["delay_per_vehicle"]
+    return SimulationResult(
+        rows=rows,
+        cols=cols,
+        seconds=req.seconds,
+        measured_seconds=int(result["measured_seconds"][0]),
+        scenarios=[
+            ScenarioResult(
+                delay_per_vehicle=round(float(d), 2),
+                throughput_vph=round(float(t), 1),
+                network_exits_vph=round(float(e), 1),
+                mean_entry_queue=round(float(q), 2)
+            )
+            for d, t, e, q in zip(delay, result["throughput_vph"], result["network_exits_vph"],
+                                  result["mean_entry_queue"])
+        ],
+        best_scenario=int(np.argmin(delay)),
+        timings_ms=timer.timings
+    )
+
+
 @app.post("/api/health/analyze", response_model=HealthAdvice)
 def analyze_health(data: HealthInput):
     insights: List[str] = []
@@ -152,11 +512,60 @@ def analyze_health(data: HealthInput):
     )
 
 
+def _has_condition(conditions: Optional[List[Optional[List[str]]]], names: set, count: int) -> np.ndarray:
+    if not conditions:
+        return np.zeros(count, dtype=bool)
+    return np.array([bool(c) and any(x.lower() in names for x in c) for c in conditions], dtype=bool)
+
+
+@app.post("/api/health/analyze/batch", response_model=HealthBatchAdvice)
+def analyze_health_batch(data: HealthBatchInput):
+    # Same rules as analyze_health, evaluated as masks over the whole cohort
+    count = len(data.hr_rest)
+    if any(len(col) != count for col in (data.sleep_hours, data.steps, data.age)):
+        raise HTTPException(status_code=422, detail="hr_rest, sleep_hours, steps and age must have equal length")
+    if data.conditions is not None and len(data.conditions) != count:
+        raise HTTPException(status_code=422, detail="conditions length must equal hr_rest length")
+
+    hr = np.asarray(data.hr_rest, dtype=np.int64)
+    sleep = np.asarray(data.sleep_hours, dtype=np.float64)
+    steps = np.asarray(data.steps, dtype=np.int64)
+    age = np.asarray(data.age, dtype=np.int64)
+
+    # Apply the per-record field bounds of HealthInput to every row
+    invalid = ((hr <= 30) | (hr >= 220) | (sleep <= 0) | (sleep >= 24)
+               | (steps < 0) | (steps >= 200000) | (age <= 0) | (age >= 120))
+    if invalid.any():
+        rows = np.flatnonzero(invalid)[:20].tolist()
+        raise HTTPException(status_code=422, detail=f"values out of range at rows {rows}")
+
+    flags = {
+        "hr_high": hr > 90,
+        "hr_low": (hr < 50) & (age > 30),
+        "sleep_short": sleep < 6,
+        "sleep_long": sleep > 9,
+        "low_activity": steps < 5000,
+        "high_activity": steps > 15000,
+        "hypertension": _has_condition(data.conditions, {"hypertension", "高血压"}, count),
+        "diabetes": _has_condition(data.conditions, {"diabetes", "糖尿病"}, count),
+        "senior": age >= 55,
+    }
+    risk = (20 * flags["hr_high"] + 20 * flags["sleep_short"] + 15 * flags["low_activity"]
+            + 15 * flags["hypertension"] + 15 * flags["diabetes"] + 10 * flags["senior"])
+    risk = np.clip(risk, 0, 100)
+
+    return HealthBatchAdvice(
+        count=count,
+        risk_scores=risk.astype(int).tolist(),
+        flags={name: mask.tolist() for name, mask in flags.items()}
+    )
+
+
 @app.get("/")
 def root():
     return {
         "name": "Solarpunk Smart City API",
-        "endpoints": ["/api/traffic/optimize", "/api/health/analyze", "/healthz"],
+        "endpoints": ["/api/traffic/optimize", "/api/traffic/simulate", "/api/health/analyze", "/api/health/analyze/batch", "/healthz"],
         "docs": "/docs"
     }
 
@@ -0,0 +1,307 @@
+import os
+import time
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .traffic_network import (LOST_TIME_PER_PHASE, MAX_CYCLE, MIN_CYCLE, MIN_GREEN, SATURATION_FLOW_VPS,
+                              StageTimer, efficiency_scores, green_splits, green_wave_offsets, webster_cycles)
+
+# HCM 2000 signalized-intersection delay: analysis period (hours) and incremental delay factor (pretimed control)
+ANALYSIS_PERIOD_H = 0.25
+INCREMENTAL_DELAY_K = 0.5
+CYCLE_STEP = 5.0
+# Round 0 splits green in proportion to flow_ratio ** p; later rounds perturb the best split per cycle
+SPLIT_EXPONENTS = (0.0, 0.5, 1.0, 1.5, 2.0)
+CANDIDATES_PER_ROUND = 8
+INITIAL_SIGMA = 0.5
+MIN_SIGMA = 0.02
+SIGMA_DECAY = 0.85
+MAX_ROUNDS = 64
+# Intersections per search task; requests with more than one task fan out over the process pool
+CHUNK_INTERSECTIONS = 256
+SEARCH_WORKERS = int(os.getenv("SMART_CITY_WORKERS", str(os.cpu_count() or 4)))
+# Budget kept back for dispatching tasks and collecting their results
+DISPATCH_MARGIN = 0.15
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=SEARCH_WORKERS)
+    return _pool
+
+
+def start():
+    """Create the pool and start its worker processes, so that the first search does not pay for them."""
+    pool = get_pool()
+    for future in [pool.submit(os.getpid) for _ in range(SEARCH_WORKERS)]:
+        future.result()
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+def hcm_delay(flow: np.ndarray, greens: np.ndarray, cycles: np.ndarray,
+              saturation_flow: float = SATURATION_FLOW_VPS) -> np.ndarray:
+    """Control delay per vehicle (seconds) of every approach, HCM 2000 uniform plus incremental delay.
+
+    flow: (..., A) vehicles per second; greens: (..., A) seconds including lost time; cycles broadcast against
+    greens without the approach axis. Remains finite for oversaturated approaches (degree of saturation > 1).
+    Computed in the dtype of greens with in-place steps, since the search evaluates millions of candidates.
+    """
+    cycles = np.asarray(cycles, dtype=greens.dtype)[..., None]
+    ratio = greens - LOST_TIME_PER_PHASE
+    np.maximum(ratio, 0.0, out=ratio)
+    ratio /= cycles
+    capacity = ratio * saturation_flow
+    np.maximum(capacity, 1e-9, out=capacity)
+    x = flow / capacity
+
+    # Uniform delay: 0.5 C (1 - g/C)^2 / (1 - min(1, X) g/C)
+    scratch = np.minimum(x, 1.0)
+    scratch *= ratio
+    np.subtract(1.0, scratch, out=scratch)
+    delay = np.subtract(1.0, ratio, out=ratio)
+    delay *= delay
+    delay *= 0.5 * cycles
+    delay /= scratch
+
+    # Incremental delay: 900 T [(X - 1) + sqrt((X - 1)^2 + 8 k X / (c T))], capacity c in vehicles per hour
+    capacity *= 3600.0 * ANALYSIS_PERIOD_H / (8.0 * INCREMENTAL_DELAY_K)
+    spread = np.divide(x, capacity, out=capacity)
+    term = np.subtract(x, 1.0, out=x)
+    np.multiply(term, term, out=scratch)
+    scratch += spread
+    np.sqrt(scratch, out=scratch)
+    scratch += term
+    scratch *= 900.0 * ANALYSIS_PERIOD_H
+    delay += scratch
+    return delay
+
+
+def total_delay(flow: np.ndarray, greens: np.ndarray, cycles: np.ndarray,
+                saturation_flow: float = SATURATION_FLOW_VPS) -> np.ndarray:
+    """Delay accumulated per second of operation (vehicle-seconds per second), summed over approaches."""
+    return (flow * hcm_delay(flow, greens, cycles, saturation_flow)).sum(axis=-1)
+
+
+def cycle_grid(approaches: int, step: float = CYCLE_STEP) -> np.ndarray:
+    """Candidate cycle lengths: multiples of step in [MIN_CYCLE, MAX_CYCLE] that leave every phase its minimum green."""
+    shortest = max(MIN_CYCLE, approaches * MIN_GREEN)
+    first = np.ceil(shortest / step) * step
+    return np.arange(first, MAX_CYCLE + step / 2, step)
+
+
+def _greens(shares: np.ndarray, cycles: np.ndarray) -> np.ndarray:
+    """Green seconds per approach: minimum green plus a share of the rest of the cycle."""
+    approaches = shares.shape[-1]
+    return MIN_GREEN + shares * (cycles[..., None] - approaches * MIN_GREEN)
+
+
+def _normalized(shares: np.ndarray) -> np.ndarray:
+    """float64 shares summing to 1, so that greens add up to the cycle despite float32 rounding in the search"""
+    shares = shares.astype(np.float64)
+    return shares / shares.sum(axis=-1, keepdims=True)
+
+
+def proportional_chunk(flow: np.ndarray, cycles: np.ndarray,
+                       saturation_flow: float = SATURATION_FLOW_VPS) -> Dict[str, np.ndarray]:
+    """Total delay (n, K) and greens (n, K, A) of splits in proportion to flow at every candidate cycle.
+
+    One candidate per (intersection, cycle) pair, so it is cheap enough to compute up front as the plan for
+    intersections whose search misses the deadline.
+    """
+    n, approaches = flow.shape
+    flow32 = flow.astype(np.float32)[:, None, :]
+    grid = np.broadcast_to(cycles.astype(np.float32), (n, len(cycles)))
+    totals = flow32.sum(axis=-1, keepdims=True)
+    shares = np.divide(flow32, totals, out=np.full_like(flow32, 1.0 / approaches), where=totals > 0)
+    greens = _greens(np.broadcast_to(shares, (n, len(cycles), approaches)), grid)
+    cost = total_delay(flow32, greens, grid, saturation_flow)
+    return {"cost": cost.astype(np.float64), "greens": _greens(_normalized(shares), grid.astype(np.float64))}
+
+
+def search_chunk(flow: np.ndarray, cycles: np.ndarray, deadline: float, seed: int = 0,
+                 saturation_flow: float = SATURATION_FLOW_VPS) -> Dict[str, np.ndarray]:
+    """Best green split found for every intersection at every candidate cycle before deadline (time.time()).
+
+    flow: (n, A) vehicles per second; cycles: (K,). Every round evaluates one (n, K, M, A) float32 batch of
+    candidates. Round 0 always runs; later rounds perturb the best split of each (intersection, cycle) pair with a
+    shrinking step and stop when the next round would overrun the deadline. The deadline is wall-clock time so
+    that it means the same in the pool's worker processes.
+    Returns the best total delay (n, K), its greens (n, K, A) and search counters.
+    """
+    started = time.time()
+    n, approaches = flow.shape
+    flow = flow.astype(np.float32)[:, None, None, :]
+    grid = np.broadcast_to(cycles.astype(np.float32), (n, len(cycles)))[..., None]
+
+    ratios = flow[:, 0] / np.float32(saturation_flow)
+    weights = ratios ** np.asarray(SPLIT_EXPONENTS, dtype=np.float32)[:, None]
+    totals = weights.sum(axis=-1, keepdims=True)
+    shares = np.divide(weights, totals, out=np.full_like(weights, 1.0 / approaches), where=totals > 0)
+
+    # Round 0: every exponent at every cycle, shape (n, K, P, A)
+    candidates = np.broadcast_to(shares[:, None], (n, len(cycles)) + shares.shape[1:])
+    cost = total_delay(flow, _greens(candidates, grid), grid, saturation_flow)
+    pick = cost.argmin(axis=-1)[..., None]
+    best_cost = np.take_along_axis(cost, pick, axis=-1)[..., 0]
+    best_share = np.take_along_axis(candidates, pick[..., None], axis=2)[:, :, 0]
+    evaluated = cost.size
+    rounds = 1
+
+    rng = np.random.default_rng(seed)
+    sigma = INITIAL_SIGMA
+    last = first_round = time.time() - started
+    while rounds < MAX_ROUNDS:
+        now = time.time()
+        if now + last > deadline:
+            break
+        noise = rng.standard_normal((n, len(cycles), CANDIDATES_PER_ROUND, approaches), dtype=np.float32)
+        noise *= sigma
+        candidates = np.exp(noise, out=noise)
+        candidates *= best_share[:, :, None, :]
+        candidates /= candidates.sum(axis=-1, keepdims=True)
+        cost = total_delay(flow, _greens(candidates, grid), grid, saturation_flow)
+        pick = cost.argmin(axis=-1)[..., None]
+        round_cost = np.take_along_axis(cost, pick, axis=-1)[..., 0]
+        better = round_cost < best_cost
+        best_cost[better] = round_cost[better]
+        best_share[better] = np.take_along_axis(candidates, pick[..., None], axis=2)[:, :, 0][better]
+        evaluated += cost.size
+        rounds += 1
+        sigma = max(MIN_SIGMA, sigma * SIGMA_DECAY)
+        last = time.time() - now
+
+    return {
+        "cost": best_cost.astype(np.float64),
+        "greens": _greens(_normalized(best_share), grid[..., 0].astype(np.float64)),
+        "rounds": np.int64(rounds),
+        "evaluated": np.int64(evaluated),
+        "first_round_s": np.float64(first_round),
+    }
+
+
+def _search_task(flow: np.ndarray, cycles: np.ndarray, deadline: float, seed: int,
+                 saturation_flow: float) -> Optional[Dict[str, np.ndarray]]:
+    # A task the pool only starts after the deadline would no longer be used: skip it instead of searching
+    if time.time() >= deadline:
+        return None
+    return search_chunk(flow, cycles, deadline, seed, saturation_flow)
+
+
+def _run_chunks(flow: np.ndarray, cycles: np.ndarray, deadline: float, workers: int,
+                saturation_flow: float) -> Tuple[List[Dict[str, np.ndarray]], int]:
+    """Search every chunk of intersections, on the process pool when there is more than one chunk.
+
+    The proportional plan at every cycle is computed before any search starts. Chunks whose search has not
+    finished by the deadline keep it, so the result is ready at the deadline without further work.
+    Returns per-chunk results and the number of worker processes used.
+    """
+    bounds = list(range(0, flow.shape[0], CHUNK_INTERSECTIONS)) + [flow.shape[0]]
+    chunks = list(zip(bounds[:-1], bounds[1:]))
+    fallback = proportional_chunk(flow, cycles, saturation_flow)
+    results: List[Optional[Dict[str, np.ndarray]]] = [None] * len(chunks)
+    workers = max(1, min(workers, len(chunks)))
+
+    if workers > 1:
+        now = time.time()
+        task_deadline = now + max(0.0, deadline - now) * (1.0 - DISPATCH_MARGIN)
+        pool = get_pool()
+        futures = {
+            pool.submit(_search_task, flow[lo:hi], cycles, task_deadline, i, saturation_flow): i
+            for i, (lo, hi) in enumerate(chunks)
+        }
+        done, pending = wait(futures, timeout=max(0.0, deadline - time.time()), return_when=FIRST_EXCEPTION)
+        for future in done:
+            results[futures[future]] = future.result()
+        # Queued tasks are dropped; running ones end at the task deadline, at most one round late
+        for future in pending:
+            future.cancel()
+    else:
+        first_round = 0.0
+        for i, (lo, hi) in enumerate(chunks):
+            now = time.time()
+            # Round 0 cannot be interrupted: stop once another one no longer fits in the budget
+            if now + first_round > deadline:
+                break
+            # Split what is left of the budget evenly over the chunks still to search
+            chunk_deadline = now + (deadline - now) / (len(chunks) - i)
+            results[i] = search_chunk(flow[lo:hi], cycles, chunk_deadline, i, saturation_flow)
+            first_round = float(results[i]["first_round_s"])
+
+    for i, (lo, hi) in enumerate(chunks):
+        if results[i] is None:
+            results[i] = {"cost": fallback["cost"][lo:hi], "greens": fallback["greens"][lo:hi],
+                          "rounds": np.int64(0), "evaluated": np.int64(0)}
+    return results, workers
+
+
+def search_network(demand: np.ndarray, corridor_size: int = 10, spacing_m: float = 300.0,
+                   speed_kmh: float = 50.0, time_budget_ms: float = 250.0, workers: int = SEARCH_WORKERS,
+                   saturation_flow: float = SATURATION_FLOW_VPS,
+                   timer: Optional[StageTimer] = None) -> Dict[str, np.ndarray]:
+    """Search cycle lengths and green splits for a whole network against the HCM delay model.
+
+    demand: (intersections, approaches) vehicles per minute. Every intersection gets the best split found at each
+    candidate cycle; each green-wave corridor then runs the cycle with the least total delay over its members.
+    The Webster plan of solve_network is scored with the same model as the baseline.
+    """
+    timer = timer or StageTimer()
+    deadline = time.time() + time_budget_ms / 1000.0
+    demand = np.asarray(demand, dtype=np.float64)
+    n, approaches = demand.shape
+    flow = demand / 60.0
+    cycles = cycle_grid(approaches)
+    timer.mark("prepare")
+
+    results, used = _run_chunks(flow, cycles, deadline, workers, saturation_flow)
+    cost = np.concatenate([r["cost"] for r in results])
+    greens = np.concatenate([r["greens"] for r in results])
+    timer.mark("search")
+
+    corridor_size = max(1, corridor_size)
+    corridor = np.arange(n) // corridor_size
+    corridor_cost = np.add.reduceat(cost, np.arange(0, n, corridor_size), axis=0)
+    choice = corridor_cost.argmin(axis=1)[corridor]
+    chosen = cycles[choice]
+    greens = greens[np.arange(n), choice]
+    _, offsets = green_wave_offsets(chosen, corridor_size, spacing_m, speed_kmh / 3.6)
+    timer.mark("cycle_length")
+
+    flow_ratios = flow / saturation_flow
+    lost_time = np.full(n, approaches * LOST_TIME_PER_PHASE)
+    baseline_cycles = webster_cycles(flow_ratios.sum(axis=1), lost_time)
+    baseline_cycles, _ = green_wave_offsets(baseline_cycles, corridor_size, spacing_m, speed_kmh / 3.6)
+    baseline_greens = green_splits(flow_ratios, baseline_cycles, lost_time)
+    baseline = total_delay(flow, baseline_greens, baseline_cycles, saturation_flow)
+
+    vehicles = flow.sum(axis=1)
+    delay = cost[np.arange(n), choice]
+    share = np.divide(demand, demand.sum(axis=1, keepdims=True), out=np.full_like(demand, 1.0 / approaches),
+                      where=demand.sum(axis=1, keepdims=True) > 0)
+    timer.mark("scoring")
+
+    return {
+        "cycles": chosen,
+        "offsets": offsets,
+        "greens": greens,
+        "scores": efficiency_scores(share, chosen, lost_time),
+        "degree_of_saturation": flow_ratios.sum(axis=1) * chosen / np.maximum(chosen - lost_time, 1e-9),
+        "delay_per_vehicle": np.divide(delay, vehicles, out=np.zeros(n), where=vehicles > 0),
+        "total_delay": delay,
+        "baseline_total_delay": baseline,
+        "vehicles_per_second": vehicles,
+        "rounds": np.array([r["rounds"] for r in results]),
+        "evaluated": int(sum(int(r["evaluated"]) for r in results)),
+        "workers": np.int64(used),
+        "cycle_candidates": np.int64(len(cycles)),
+    }
@@ -0,0 +1,193 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from .traffic_network import LOST_TIME_PER_PHASE
+
+# Nagel-Schreckenberg defaults: one cell per vehicle length, one step per second
+CELL_M = 7.5
+SLOWDOWN_PROBABILITY = 0.15
+THROUGH_RATIO = 0.6
+# Highest progression speed a simulation accepts; keeps vmax (cells per step) far inside the int8 cell arrays
+MAX_SPEED_KMH = 130.0
+# Road spacing of the 3D city view: web/js/advanced-city-renderer.js generateRoads() draws a road every
+# CITY_ROAD_SPACING units across [-gridSize, gridSize] in both directions
+CITY_ROAD_SPACING = 4
+# Cap on scenarios x lanes x cells kept in memory per step
+MAX_SIM_CELLS = 8_000_000
+# Intersections simulated when an optimize request asks for its plan to be scored
+SCORING_MAX_INTERSECTIONS = 100
+
+
+def city_street_grid(grid_size: int, spacing: int = CITY_ROAD_SPACING) -> Tuple[int, int]:
+    """Intersections (rows, cols) of the renderer's road grid: roads at -grid_size, -grid_size + spacing, ...,
+    up to grid_size."""
+    lines = 2 * grid_size // max(1, spacing) + 1
+    return lines, lines
+
+
+def street_grid(rows: int, cols: int, approaches: int) -> np.ndarray:
+    """Downstream lane of every approach lane (intersection * approaches + approach), -1 when traffic leaves the grid.
+
+    Approaches 0-3 travel east, south, west and north; vehicles going straight on enter the same approach of the
+    neighbouring intersection. Further approaches (turn phases) always leave the grid.
+    """
+    directions = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+    n = rows * cols
+    row, col = np.divmod(np.arange(n), cols)
+    downstream = np.full((n, approaches), -1, dtype=np.int64)
+    for a, (dr, dc) in enumerate(directions[:approaches]):
+        r, c = row + dr, col + dc
+        inside = (r >= 0) & (r < rows) & (c >= 0) & (c < cols)
+        downstream[inside, a] = (r[inside] * cols + c[inside]) * approaches + a
+    return downstream.ravel()
+
+
+def signal_schedule(greens: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Phase start and effective green (green minus lost time) for sequential phases, shapes (S, I, A)."""
+    starts = np.cumsum(greens, axis=-1) - greens
+    effective = np.maximum(greens - LOST_TIME_PER_PHASE, 0.0)
+    return starts, effective
+
+
+def simulate(demand: np.ndarray, cycles: np.ndarray, greens: np.ndarray, offsets: np.ndarray,
+             rows: int, cols: int, spacing_m: float = 300.0, speed_kmh: float = 50.0,
+             seconds: int = 600, warmup: Optional[int] = None, through_ratio: float = THROUGH_RATIO,
+             slowdown: float = SLOWDOWN_PROBABILITY, seed: int = 0) -> Dict[str, np.ndarray]:
+    """Run S signal-plan scenarios on the same street grid and demand in one vectorized simulation.
+
+    demand: (I, A) vehicles per minute per approach, I = rows * cols.
+    cycles, offsets: (S, I) seconds; greens: (S, I, A) seconds, one phase per approach.
+    A share through_ratio of vehicles crossing a stop line continue straight into the next intersection; local
+    entries top every approach up to its demand. Scenarios share all random draws (common random numbers), so
+    differences between them come from the plans alone. Downstream entries are point queues (no spillback).
+    """
+    demand = np.asarray(demand, dtype=np.float64)
+    n, approaches = demand.shape
+    cycles = np.asarray(cycles, dtype=np.float64).reshape(-1, n)
+    greens = np.asarray(greens, dtype=np.float64).reshape(-1, n, approaches)
+    offsets = np.asarray(offsets, dtype=np.float64).reshape(-1, n)
+    scenarios = cycles.shape[0]
+    lanes = n * approaches
+    length, vmax = lane_cells(spacing_m, speed_kmh)
+    if speed_kmh > MAX_SPEED_KMH:
+        raise ValueError(f"speed_kmh must not exceed {MAX_SPEED_KMH}")
+    warmup = int(min(seconds // 2, cycles.max() if warmup is None else warmup))
+    rng = np.random.default_rng(seed)
+
+    downstream = street_grid(rows, cols, approaches)
+    routed = downstream >= 0
+    rate = demand.ravel() / 60.0
+    inflow = np.zeros(lanes)
+    np.add.at(inflow, downstream[routed], rate[routed] * through_ratio)
+    local_rate = np.maximum(rate - inflow, 0.0)
+
+    starts, effective = signal_schedule(greens)
+    starts = starts.reshape(scenarios, lanes)
+    effective = effective.reshape(scenarios, lanes)
+    lane_cycle = np.repeat(cycles, approaches, axis=1)
+    # Green for a lane starts phase_start seconds into each cycle
+    phase_start = np.repeat(offsets, approaches, axis=1) + starts
+    brake_threshold = int(round(slowdown * 256))
+
+    # Every lane is followed by vmax padding cells and all lanes are laid out in one flat array, so looking ahead
+    # and moving are contiguous shifts by at most vmax cells (speeds never exceed vmax). A red signal places a
+    # blocker in the first padding cell; vehicles that move into the padding have crossed the stop line.
+    # -1 marks an empty cell.
+    width = length + vmax
+    cells = scenarios * lanes * width
+    velocity = np.full(cells, -1, dtype=np.int8)
+    lane_view = velocity.reshape(scenarios, lanes, width)
+    waiting = np.zeros((scenarios, lanes), dtype=np.int64)
+
+    occupancy_total = np.zeros(cells, dtype=np.int32)
+    speed_total = np.zeros(cells, dtype=np.int32)
+    wait_total = np.zeros((scenarios, lanes), dtype=np.int64)
+    crossings = np.zeros((scenarios, lanes), dtype=np.int64)
+    leaving = np.zeros(scenarios, dtype=np.int64)
+
+    for t in range(seconds):
+        red = np.mod(t - phase_start, lane_cycle) >= effective
+
+        occupied = velocity >= 0
+        blocked = occupied.copy()
+        blocked.reshape(scenarios, lanes, width)[..., length] = red
+        # Distance to the next vehicle (or red signal) ahead, capped at vmax; the nearest blocker wins
+        gap = np.full(cells, vmax, dtype=np.int8)
+        blocked_int = blocked.view(np.int8)
+        for k in range(vmax, 0, -1):
+            gap[:-k] -= (gap[:-k] - np.int8(k - 1)) * blocked_int[k:]
+
+        # Accelerate, keep the gap, random slowdown (empty cells end up with speed 0)
+        speed = np.minimum(velocity + np.int8(1), gap)
+        brake = rng.integers(0, 256, lanes * width, dtype=np.uint8) < brake_threshold
+        by_scenario = speed.reshape(scenarios, -1)
+        by_scenario -= brake & (by_scenario > 0)
+
+        # Move: cell c receives the vehicle from c - k that drives at speed k (at most one, nobody overtakes)
+        moved = np.full(cells, -1, dtype=np.int8)
+        for k in range(vmax + 1):
+            arriving = occupied[:cells - k] & (speed[:cells - k] == k)
+            moved[k:] += arriving.view(np.int8) * np.int8(k + 1)
+        moved_lanes = moved.reshape(scenarios, lanes, width)
+        # At most one vehicle per lane crosses the stop line in a step
+        passed = (moved_lanes[..., length:] >= 0).any(axis=-1)
+        moved_lanes[..., length:] = -1
+        velocity, lane_view = moved, moved_lanes
+
+        through = passed & (rng.random(lanes) < through_ratio) & routed
+        waiting[:, downstream[routed]] += through[:, routed]
+        waiting += rng.poisson(local_rate)
+
+        entering = (lane_view[..., 0] < 0) & (waiting > 0)
+        lane_view[..., 0][entering] = 0
+        waiting -= entering
+
+        if t >= warmup:
+            occupancy_total += occupied
+            speed_total += speed
+            wait_total += waiting
+            crossings += passed
+            leaving += (passed & ~through).sum(axis=-1)
+
+    # Delay: time lost against free-flow speed while in a lane, plus time spent waiting to enter one
+    lost = (vmax * occupancy_total - speed_total).reshape(scenarios, lanes, width).sum(axis=-1) / vmax
+    delay = lost + wait_total
+    queued = wait_total.sum(axis=1)
+    measured = seconds - warmup
+    total_crossings = crossings.sum(axis=1)
+    intersection_delay = delay.reshape(scenarios, n, approaches).sum(axis=-1)
+    intersection_crossings = crossings.reshape(scenarios, n, approaches).sum(axis=-1)
+    return {
+        "delay_per_vehicle": delay.sum(axis=1) / np.maximum(total_crossings, 1),
+        "throughput_vph": total_crossings / measured * 3600.0 / n,
+        "network_exits_vph": leaving / measured * 3600.0,
+        "mean_entry_queue": queued / measured,
+        "intersection_delay": intersection_delay / np.maximum(intersection_crossings, 1),
+        "measured_seconds": np.full(scenarios, measured),
+    }
+
+
+def grid_sample(intersections: int, corridor_size: int, max_intersections: int) -> Tuple[int, int, np.ndarray]:
+    """Leading rows x cols block of a corridor network (corridors are grid rows) with at most max_intersections.
+
+    Returns (rows, cols, network indices of the sampled intersections in row-major order).
+    """
+    corridor_size = max(1, corridor_size)
+    cols = max(1, min(corridor_size, intersections, max_intersections))
+    full_rows = max(1, intersections // corridor_size)
+    rows = max(1, min(full_rows, max_intersections // cols))
+    index = (np.arange(rows)[:, None] * corridor_size + np.arange(cols)).ravel()
+    return rows, cols, index
+
+
+def lane_cells(spacing_m: float, speed_kmh: float) -> Tuple[int, int]:
+    """(cells per lane, vmax in cells per step) for a link of spacing_m metres driven at speed_kmh."""
+    return max(2, int(round(spacing_m / CELL_M))), max(1, int(round(speed_kmh / 3.6 / CELL_M)))
+
+
+def sim_cells(scenarios: int, intersections: int, approaches: int, spacing_m: float, speed_kmh: float) -> int:
+    """Cells held in memory by a simulation of this size, including the vmax padding after every lane
+    (see MAX_SIM_CELLS)."""
+    length, vmax = lane_cells(spacing_m, speed_kmh)
+    return scenarios * intersections * approaches * (length + vmax)
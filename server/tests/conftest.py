@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# 测试从 server/ 目录导入模块，并且不能写入仓库中的 smart_city.db
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SMART_CITY_DB", os.path.join(tempfile.mkdtemp(prefix="smart-city-test-"), "test.db"))
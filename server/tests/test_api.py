@@ -0,0 +1,49 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import traffic_forecast
+
+
+@pytest.fixture(scope="module")
+def client():
+    # 不进入 with 块：不运行启动事件，只测试请求校验
+    return TestClient(main.app)
+
+
+@pytest.mark.parametrize("intersection_id", [-1, -2, traffic_forecast.MAX_INTERSECTIONS])
+def test_forecast_rejects_out_of_range_intersection(client, intersection_id):
+    response = client.get("/api/traffic/forecast", params={"intersection_id": intersection_id})
+    assert response.status_code == 422
+
+
+def test_forecast_accepts_last_intersection(client):
+    last = traffic_forecast.MAX_INTERSECTIONS - 1
+    response = client.get("/api/traffic/forecast", params={"intersection_id": last, "hours": 3})
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert data["intersection_id"] == last
+    assert len(data["vehicles"]) == 3
+
+
+def test_history_uses_response_envelope(client):
+    response = client.get("/api/traffic/history", params={"from": 0, "to": 3600})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["success"] is True
+    assert body["data"]["from"] == 0
+
+
+def test_city_revalidation_does_not_touch_cache(client, monkeypatch):
+    import city_cache
+
+    async def evicted(*args):
+        raise AssertionError("304 revalidation must not load the city")
+
+    monkeypatch.setattr(city_cache.cache, "get", evicted)
+    etag = city_cache.city_etag(city_cache.city_digest(5, 16, 10), "stats")
+    response = client.post("/api/city/generate", json={"seed": 5, "grid_size": 16, "max_height": 10,
+                                                       "include_buildings": False},
+                           headers={"If-None-Match": f'"other", W/{etag}'})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
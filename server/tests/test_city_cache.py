@@ -0,0 +1,43 @@
+import asyncio
+
+import city_cache
+
+
+def test_waiters_recover_when_leader_is_cancelled(monkeypatch):
+    started = asyncio.Event()
+    calls = []
+
+    async def slow_load(self, key):
+        calls.append(key)
+        if len(calls) == 1:
+            started.set()
+            await asyncio.sleep(10)
+        return city_cache.CachedCity(key, "digest", None, {})
+
+    monkeypatch.setattr(city_cache.CityCache, "_load", slow_load)
+    monkeypatch.setattr(city_cache.CityCache, "_insert", lambda self, entry: None)
+
+    async def scenario():
+        cache = city_cache.CityCache(max_bytes=1 << 20)
+        leader = asyncio.create_task(cache.get(1, 8, 10))
+        await started.wait()
+        waiter = asyncio.create_task(cache.get(1, 8, 10))
+        await asyncio.sleep(0)
+        leader.cancel()
+        entry = await asyncio.wait_for(waiter, timeout=2)
+        assert leader.cancelled()
+        assert entry.key == (1, 8, 10)
+        assert not cache._inflight
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_etag_matches_parses_header_list():
+    etag = '"0123abcd-json"'
+    assert city_cache.etag_matches(f'"other", W/{etag}', etag)
+    assert city_cache.etag_matches("*", etag)
+    # 子串或不同变体不算匹配
+    assert not city_cache.etag_matches('"0123abcd-json-extra"', etag)
+    assert not city_cache.etag_matches('"0123abcd-jso"', etag)
+    assert not city_cache.etag_matches(None, etag)
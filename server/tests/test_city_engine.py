@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+import city_engine
+
+
+@pytest.mark.parametrize("grid_size", [1, 63, 64, 65, 150])
+def test_blocks_and_tiles_match_whole_city(grid_size):
+    city = city_engine.generate_arrays(11, grid_size, 30)
+    for rows_per_block in (1, 7, 64, 100):
+        blocks = list(city_engine.iter_row_blocks(11, grid_size, 30, rows_per_block))
+        assert [b.x0 for b in blocks] == list(range(0, grid_size, rows_per_block))
+        assert np.array_equal(np.concatenate([b.heights for b in blocks]), city.heights)
+        assert np.array_equal(np.concatenate([b.types for b in blocks]), city.types)
+        assert np.array_equal(np.concatenate([b.energy_production for b in blocks]), city.energy_production)
+
+    for tile in city_engine.iter_tiles(11, grid_size, 30, tile_size=16):
+        rows, cols = tile.heights.shape
+        assert np.array_equal(tile.types, city.types[tile.x0:tile.x0 + rows, tile.z0:tile.z0 + cols])
+
+
+def test_city_fields_follow_the_model():
+    city = city_engine.generate_arrays(3, 200, 12)
+    assert city.heights.min() >= 2 and city.heights.max() <= 12
+    green = city.types == city_engine.GREEN
+    assert (city.solar_coverage[green] == 0).all()
+    assert ((city.solar_coverage[~green] >= 0.3) & (city.solar_coverage[~green] <= 0.9)).all()
+    shares = np.bincount(city.types.ravel(), minlength=4) / city.types.size
+    assert np.allclose(shares, city_engine.BUILDING_TYPE_PROBS, atol=0.01)
+    assert not np.array_equal(city.types, city_engine.generate_arrays(4, 200, 12).types)
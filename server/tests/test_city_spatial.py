@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+import city_engine
+import city_spatial
+from city_engine import BUILDING_TYPES, GREEN
+
+
+@pytest.fixture(scope="module")
+def city():
+    return city_engine.generate_arrays(7, 40, 20)
+
+
+@pytest.fixture(scope="module")
+def index(city):
+    return city_spatial.SpatialIndex(city)
+
+
+def _brute_force(city, inside):
+    types = city.types[inside]
+    return {
+        "count": int(inside.sum()),
+        "energy_production": round(float(city.energy_production[inside].sum()), 1),
+        "by_type": {name: int((types == t).sum()) for t, name in enumerate(BUILDING_TYPES)},
+    }
+
+
+def test_radius_matches_brute_force(city, index):
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-5, 45, (60, 2))
+    radii = np.concatenate([rng.uniform(0, 12, 57), [0.0, 3.0, 100.0]])
+    points[-2] = (10, 10)
+    result = index.radius(points, radii)
+
+    xs, zs = np.meshgrid(np.arange(40), np.arange(40), indexing="ij")
+    for i, ((px, pz), r) in enumerate(zip(points, radii)):
+        expected = _brute_force(city, (xs - px) ** 2 + (zs - pz) ** 2 <= r * r + 1e-9)
+        assert result["count"][i] == expected["count"]
+        assert result["energy_production"][i] == pytest.approx(expected["energy_production"], abs=0.11)
+        assert {name: counts[i] for name, counts in result["by_type"].items()} == expected["by_type"]
+
+
+def test_nearest_green_matches_brute_force(city, index):
+    greens = np.argwhere(city.types == GREEN)
+    cells = np.array([[0, 0], [39, 39], [20, 5], [13, 31]])
+    result = index.nearest_green(cells)
+    for i, cell in enumerate(cells):
+        best = np.hypot(*(greens - cell).T).min()
+        assert result["distance"][i] == pytest.approx(best, abs=1e-3)
+
+
+@pytest.mark.parametrize("vertices, rule", [
+    ([(0, 0), (30, 0), (0, 30)], lambda x, z: x + z <= 30),
+    ([(5, 5), (5, 20), (25, 20), (25, 5)], lambda x, z: (5 <= x) & (x <= 25) & (5 <= z) & (z <= 20)),
+    ([(-10, -10), (-10, 60), (60, 60), (60, -10)], lambda x, z: x >= 0),
+])
+def test_polygon_matches_brute_force(city, index, vertices, rule):
+    xs, zs = np.meshgrid(np.arange(40), np.arange(40), indexing="ij")
+    expected = _brute_force(city, rule(xs, zs))
+    result = index.polygon(city, np.array(vertices, dtype=np.float64))
+    assert result["count"] == expected["count"]
+    assert result["by_type"] == expected["by_type"]
+    assert result["energy_production"] == pytest.approx(expected["energy_production"], abs=0.11)
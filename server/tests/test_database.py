@@ -0,0 +1,82 @@
+import sqlite3
+import threading
+
+import pytest
+
+import database
+
+INSERT = "INSERT INTO t (id, v) VALUES (?, ?)"
+
+
+@pytest.fixture
+def writer(tmp_path):
+    path = str(tmp_path / "writes.db")
+    conn = database.connect(path)
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT NOT NULL)")
+    conn.commit()
+    queue = database.WriteBehindQueue(path, flush_interval=0.2)
+    queue.start()
+    yield queue, conn
+    queue.stop()
+    conn.close()
+
+
+def test_failed_write_raises_and_other_requests_commit(writer):
+    queue, conn = writer
+    errors = []
+
+    def submit(rows):
+        try:
+            queue.submit_many(INSERT, rows, wait=True)
+        except sqlite3.Error as e:
+            errors.append(e)
+
+    # 三个请求落在同一个批次中，其中一个违反 NOT NULL
+    threads = [threading.Thread(target=submit, args=(rows,))
+               for rows in ([(1, "a")], [(2, None)], [(3, "c"), (4, "d")])]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(errors) == 1 and isinstance(errors[0], sqlite3.IntegrityError)
+    assert [r[0] for r in conn.execute("SELECT id FROM t ORDER BY id")] == [1, 3, 4]
+
+
+def test_flush_reports_unwaited_failure_once(writer):
+    queue, conn = writer
+    queue.submit(INSERT, (1, None), wait=False)
+    with pytest.raises(sqlite3.IntegrityError):
+        queue.flush()
+    queue.flush()
+
+
+def test_commit_listener_sees_only_committed_rows(writer):
+    queue, _ = writer
+    seen = []
+    queue.add_commit_listener(lambda sql, rows: seen.extend(rows))
+    queue.submit_many(INSERT, [(1, "a"), (2, "b")], wait=True)
+    with pytest.raises(sqlite3.IntegrityError):
+        queue.submit(INSERT, (3, None), wait=True)
+    assert seen == [(1, "a"), (2, "b")]
+
+
+def test_stop_timeout_keeps_connection_until_writer_exits(writer):
+    queue, conn = writer
+    release = threading.Event()
+
+    def slow_hook(sql, rows):
+        release.wait(5)
+        return []
+
+    queue.add_transaction_hook(slow_hook)
+    queue.submit_many(INSERT, [(1, "a"), (2, "b")], wait=False)
+    assert queue.stop(timeout=0.05) is False
+    # 停止期间的写入改为同步写入，不进入已停止消费的队列
+    late = threading.Thread(target=queue.submit, args=(INSERT, (3, "c")), kwargs={"wait": True})
+    late.start()
+    release.set()
+    late.join(5)
+    assert queue.stop(timeout=5) is True
+    assert queue._conn is None
+    assert conn.execute("SELECT id FROM t ORDER BY id").fetchall() == [(1,), (2,), (3,)]
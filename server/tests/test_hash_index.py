@@ -0,0 +1,82 @@
+import hashlib
+import sqlite3
+
+import pytest
+
+from hash_index import BloomFilter, HashIndex, ScalableBloomFilter
+
+INSERT = "INSERT INTO blockchain_data (data_hash, wallet_address, transaction_hash) VALUES (?, ?, ?)"
+
+
+def _hashes(prefix, n):
+    return [hashlib.sha256(f"{prefix}-{i}".encode()).hexdigest() for i in range(n)]
+
+
+def test_bloom_has_no_false_negatives():
+    keys = _hashes("bloom", 5000)
+    bloom = BloomFilter(5000, 0.01)
+    bloom.add_many(keys)
+    assert bloom.contains_many(keys).all()
+    assert keys[0] in bloom
+
+
+def test_scalable_bloom_grows_without_false_negatives():
+    bloom = ScalableBloomFilter(100, 0.01)
+    keys = _hashes("grow", 3000)
+    for start in range(0, len(keys), 70):
+        bloom.add_many(keys[start:start + 70])
+    assert len(bloom.layers) > 1
+    assert all(layer.count <= layer.capacity for layer in bloom.layers)
+    assert bloom.count == len(keys)
+    assert bloom.contains_many(keys).all()
+
+    absent = _hashes("absent", 20000)
+    assert bloom.contains_many(absent).mean() < 0.02
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "index.db"))
+    conn.execute('''
+        CREATE TABLE blockchain_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            data_hash TEXT, wallet_address TEXT, transaction_hash TEXT
+        )
+    ''')
+    yield conn
+    conn.close()
+
+
+def test_lookup_after_commits_past_capacity(conn):
+    index = HashIndex(capacity=50)
+    index.rebuild(conn)
+
+    data, txs = _hashes("data", 400), _hashes("tx", 400)
+    for start in range(0, 400, 40):
+        rows = [(d, "0xwallet", t) for d, t in zip(data[start:start + 40], txs[start:start + 40])]
+        conn.executemany(INSERT, rows)
+        index.on_commit(INSERT, rows)
+    conn.commit()
+    assert len(index.bloom.layers) > 1
+
+    assert index.lookup(conn, data[123])["transaction_hash"] == txs[123]
+    assert index.lookup(conn, txs[321])["data_hash"] == data[321]
+    assert index.lookup(conn, "not-a-hash") is None
+
+    missing = _hashes("missing", 100)
+    result = index.bulk_lookup(conn, data + txs[:10] + missing)
+    assert result["found"] == 410
+    assert result["exists"] == [True] * 410 + [False] * 100
+    assert result["transaction_hash"][:400] == txs
+    assert result["db_checked"] >= 410
+
+
+def test_rebuild_sizes_single_layer_from_rows(conn):
+    conn.executemany(INSERT, [(d, "0xwallet", t) for d, t in zip(_hashes("old", 200), _hashes("old-tx", 200))])
+    conn.commit()
+    index = HashIndex(capacity=10)
+    index.rebuild(conn)
+    assert len(index.bloom.layers) == 1
+    assert index.bloom.capacity >= 800
+    assert index.bulk_lookup(conn, _hashes("old", 200))["found"] == 200
@@ -0,0 +1,80 @@
+import asyncio
+import sqlite3
+
+import numpy as np
+
+import ingest
+
+
+def _lines(chunks, max_line=ingest.MAX_LINE_BYTES):
+    async def source():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [line async for line in ingest.iter_lines(source(), max_line)]
+
+    return asyncio.run(collect())
+
+
+def test_iter_lines_reassembles_arbitrary_chunks():
+    body = b"a\nbcd\n\nef\r\ng"
+    expected = body.split(b"\n")
+    for size in (1, 2, 3, 5, len(body)):
+        chunks = [body[i:i + size] for i in range(0, len(body), size)]
+        assert _lines(chunks) == expected
+
+
+def test_iter_lines_rejects_long_lines_without_buffering_them():
+    chunks = [b"ok\n", b"x" * 6, b"x" * 6, b"x" * 6, b"\nafter\n", b"y" * 20]
+    assert _lines(chunks, max_line=10) == [b"ok", None, b"after", None]
+    assert _lines([b"0123456789\n"], max_line=10) == [b"0123456789"]
+    assert _lines([b"0123456789A\n"], max_line=10) == [None]
+
+
+def test_parse_batch_reports_long_lines():
+    def scorer(columns):
+        return np.zeros(len(columns["vehicle_count"]))
+
+    lines = [(1, b'{"vehicle_count": 10, "avg_speed": 30, "signal_cycle": 60}'), (2, None)]
+    rows, report = ingest.parse_batch("traffic", "ndjson", None, lines, scorer)
+    assert len(rows) == 1
+    assert report["rejected"] == 1
+    assert report["errors"][0]["line"] == 2
+
+
+def test_naive_iso_times_are_utc():
+    epoch = 1_700_000_000
+    for value in (epoch, str(epoch), "2023-11-14T22:13:20", "2023-11-14 22:13:20",
+                  "2023-11-14T22:13:20Z", "2023-11-15T06:13:20+08:00"):
+        assert ingest.parse_time(value).timestamp() == epoch
+    assert ingest._sql_timestamp("2023-11-15T06:13:20+08:00") == "2023-11-14 22:13:20"
+
+
+def test_failed_batch_is_reported_and_later_batches_commit():
+    class FlakyWriter:
+        def __init__(self):
+            self.calls = 0
+            self.committed = []
+
+        def submit_many(self, sql, rows, wait=False):
+            self.calls += 1
+            if self.calls == 2:
+                raise sqlite3.OperationalError("database is locked")
+            self.committed.extend(rows)
+
+    def scorer(columns):
+        return np.zeros(len(columns["vehicle_count"]))
+
+    async def body():
+        for i in range(10):
+            yield b'{"vehicle_count": %d, "avg_speed": 30, "signal_cycle": 60}\n' % i
+
+    writer = FlakyWriter()
+    result = asyncio.run(ingest.ingest_stream(body(), "traffic", "ndjson", scorer, writer, batch_size=4))
+    assert [batch["accepted"] for batch in result["batches"]] == [4, 0, 2]
+    assert "locked" in result["batches"][1]["error"]
+    assert "error" not in result["batches"][0]
+    assert (result["rows"], result["accepted"], result["rejected"]) == (10, 6, 4)
+    assert result["failed_batches"] == 1
+    assert [row[1] for row in writer.committed] == [0, 1, 2, 3, 8, 9]
@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import sqlite3
+
+import pytest
+
+import database
+import merkle_anchor
+
+BLOCKCHAIN_DATA = '''
+    CREATE TABLE blockchain_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        data_hash TEXT,
+        data_content TEXT,
+        wallet_address TEXT,
+        transaction_hash TEXT
+    )
+'''
+
+
+def _hashes(n):
+    return [hashlib.sha256(str(i).encode()).hexdigest() for i in range(n)]
+
+
+@pytest.mark.parametrize("leaves", [1, 2, 3, 4, 5, 7, 8, 9, 16, 33])
+def test_inclusion_proof_round_trip(leaves):
+    hashes = _hashes(leaves)
+    levels = merkle_anchor.build_tree(hashes)
+    root = levels[-1][0].hex()
+    for i, h in enumerate(hashes):
+        proof = merkle_anchor.inclusion_proof(levels, i)
+        assert merkle_anchor.verify_proof(h, proof, root)
+        # 其他叶子或篡改过的证明都不能通过
+        if leaves > 1:
+            assert not merkle_anchor.verify_proof(hashes[(i + 1) % leaves], proof, root)
+        if proof:
+            tampered = [dict(step) for step in proof]
+            tampered[0]["hash"] = "00" * 32
+            assert not merkle_anchor.verify_proof(h, tampered, root)
+
+
+def test_internal_node_is_not_a_leaf():
+    hashes = _hashes(4)
+    levels = merkle_anchor.build_tree(hashes)
+    root = levels[-1][0].hex()
+    # 第二原像：把内部节点当作叶子提交
+    forged = levels[1][0].hex()
+    assert not merkle_anchor.verify_proof(forged, [{"hash": levels[1][1].hex(), "position": "right"}], root)
+
+
+@pytest.fixture
+def conn_path(tmp_path):
+    path = str(tmp_path / "anchor.db")
+    conn = database.connect(path)
+    merkle_anchor.init_tables(conn)
+    conn.commit()
+    yield conn, path
+    conn.close()
+
+
+def _anchor(root, kind):
+    return "0x" + hashlib.sha256(root.encode()).hexdigest()
+
+
+def test_failed_seal_keeps_receipts_and_retries(conn_path):
+    conn, path = conn_path
+    # 写线程未启动时同步写入；缺少 blockchain_data 表使第一次封批失败
+    batcher = merkle_anchor.AnchorBatcher(database.WriteBehindQueue(path), _anchor, max_leaves=100)
+    hashes = _hashes(5)
+
+    async def scenario():
+        receipts = [await batcher.add(h, "content", "wallet") for h in hashes]
+        with pytest.raises(sqlite3.OperationalError):
+            await batcher.seal()
+        assert [batcher.pending_position(h) for h in hashes] == receipts
+        assert conn.execute("SELECT COUNT(*) FROM merkle_leaves").fetchone()[0] == 0
+
+        later = await batcher.add("ff" * 32, "content", "wallet")
+        assert later["batch_id"] != receipts[0]["batch_id"] and later["leaf_index"] == 0
+
+        conn.execute(BLOCKCHAIN_DATA)
+        conn.commit()
+        await batcher.seal()
+        return receipts
+
+    receipts = asyncio.run(scenario())
+    assert all(batcher.pending_position(h) is None for h in hashes)
+    for h, receipt in zip(hashes, receipts):
+        proof = batcher.get_proof(conn, h)
+        assert proof["batch_id"] == receipt["batch_id"]
+        assert proof["leaf_index"] == receipt["leaf_index"]
+        assert proof["verified"]
+    assert conn.execute("SELECT COUNT(*) FROM blockchain_data").fetchone()[0] == 6
+
+
+def test_get_proof_without_batch_row(conn_path):
+    conn, _ = conn_path
+    conn.execute("INSERT INTO merkle_leaves (batch_id, leaf_index, data_hash) VALUES ('b', 0, ?)", ("aa" * 32,))
+    conn.commit()
+    batcher = merkle_anchor.AnchorBatcher(None, _anchor)
+    assert batcher.get_proof(conn, "aa" * 32) is None
+
+
+def test_full_batch_seals_in_background(conn_path):
+    conn, path = conn_path
+    conn.execute(BLOCKCHAIN_DATA)
+    conn.commit()
+    calls = []
+
+    def flaky_anchor(root, kind):
+        calls.append(root)
+        if len(calls) == 1:
+            raise RuntimeError("anchor unavailable")
+        return _anchor(root, kind)
+
+    batcher = merkle_anchor.AnchorBatcher(database.WriteBehindQueue(path), flaky_anchor, max_leaves=3)
+    hashes = _hashes(3)
+
+    async def scenario():
+        receipts = [await batcher.add(h, "content", "wallet") for h in hashes]
+        # 写满批次的请求直接拿到回执，不等待锚定，也不因锚定失败而报错
+        assert calls == []
+        assert receipts[-1]["leaf_index"] == 2
+        await asyncio.gather(*batcher._seal_tasks)
+        assert len(calls) == 1
+        assert [batcher.pending_position(h) for h in hashes] == receipts
+        await batcher.stop()
+        return receipts
+
+    receipts = asyncio.run(scenario())
+    assert len(calls) == 2
+    for h, receipt in zip(hashes, receipts):
+        proof = batcher.get_proof(conn, h)
+        assert proof["batch_id"] == receipt["batch_id"] and proof["verified"]
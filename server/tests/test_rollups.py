@@ -0,0 +1,131 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+import database
+import rollups
+
+INSERT = '''
+    INSERT INTO traffic_data (timestamp, vehicle_count, avg_speed, optimization_score)
+    VALUES (?, ?, ?, ?)
+'''
+
+
+@pytest.fixture
+def writer(tmp_path):
+    path = str(tmp_path / "rollups.db")
+    conn = database.connect(path)
+    conn.execute('''
+        CREATE TABLE traffic_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            vehicle_count INTEGER NOT NULL,
+            avg_speed REAL,
+            signal_cycle INTEGER,
+            optimization_score REAL,
+            intersection_id INTEGER
+        )
+    ''')
+    rollups.init_tables(conn)
+    conn.commit()
+    queue = database.WriteBehindQueue(path, flush_interval=0.01)
+    queue.add_transaction_hook(rollups.RollupMaintainer().statements)
+    queue.start()
+    yield queue, conn
+    queue.stop()
+    conn.close()
+
+
+def _rows(n, start=1_699_920_000 + 3600, seed=0):
+    rng = np.random.default_rng(seed)
+    stamps = start + np.sort(rng.integers(0, 3 * 3600, n))
+    counts = rng.integers(0, 5000, n)
+    speeds = rng.uniform(0, 150, n)
+    scores = rng.uniform(0, 100, n)
+    text = np.datetime_as_string(stamps.astype("datetime64[s]"), unit="s")
+    rows = [(t.replace("T", " "), int(c), float(v), float(s)) for t, c, v, s in zip(text, counts, speeds, scores)]
+    return rows, stamps, counts.astype(np.float64), speeds
+
+
+def test_history_matches_raw_rows(writer):
+    queue, conn = writer
+    rows, stamps, counts, speeds = _rows(3000)
+    queue.submit_many(INSERT, rows, wait=True)
+
+    start = int(stamps[0]) // 3600 * 3600
+    result = rollups.query_history(conn, "traffic_data", start, start + 4 * 3600, step=3600)
+    assert result["source_resolution"] == "hour"
+    vehicle = result["metrics"]["vehicle_count"]
+    for i, t in enumerate(result["timestamps"]):
+        inside = (stamps >= t) & (stamps < t + 3600)
+        assert vehicle["count"][i] == int(inside.sum())
+        if not inside.any():
+            assert vehicle["mean"][i] is None
+            continue
+        assert vehicle["mean"][i] == pytest.approx(counts[inside].mean(), abs=0.01)
+        assert vehicle["min"][i] == counts[inside].min()
+        assert vehicle["max"][i] == counts[inside].max()
+        # 分位数来自 64 桶直方图，误差不超过一个桶宽
+        width = 5000 / rollups.HISTOGRAM_BINS
+        for q in rollups.PERCENTILES:
+            assert abs(vehicle[f"p{q}"][i] - np.percentile(counts[inside], q)) <= width
+
+
+def test_minute_and_day_resolutions_agree(writer):
+    queue, conn = writer
+    rows, stamps, _, speeds = _rows(500, seed=1)
+    queue.submit_many(INSERT, rows, wait=True)
+    start = int(stamps[0]) // 86400 * 86400
+    by_minute = rollups.query_history(conn, "traffic_data", start, start + 86400, step=60)
+    by_day = rollups.query_history(conn, "traffic_data", start, start + 86400, step=86400)
+    assert by_day["source_resolution"] == "day"
+    assert sum(by_minute["metrics"]["avg_speed"]["count"]) == by_day["metrics"]["avg_speed"]["count"][0] == 500
+    assert by_day["metrics"]["avg_speed"]["mean"][0] == pytest.approx(speeds.mean(), abs=0.01)
+
+
+def test_rollups_commit_with_raw_rows(writer):
+    queue, conn = writer
+    rows, _, _, _ = _rows(10, seed=2)
+    # vehicle_count 为 NULL 违反约束：原始行与汇总都不能写入
+    bad = [rows[0][:1] + (None,) + rows[0][2:]]
+    with pytest.raises(sqlite3.IntegrityError):
+        queue.submit_many(INSERT, rows + bad, wait=True)
+    assert conn.execute("SELECT COUNT(*) FROM traffic_data").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM metric_rollups").fetchone()[0] == 0
+
+    queue.submit_many(INSERT, rows, wait=True)
+    total = conn.execute(
+        "SELECT SUM(count) FROM metric_rollups WHERE metric = 'vehicle_count' AND resolution = 'minute'"
+    ).fetchone()[0]
+    assert total == 10
+
+
+@pytest.mark.filterwarnings("error")
+def test_backfill_skips_rows_without_timestamp(tmp_path):
+    conn = database.connect(str(tmp_path / "backfill.db"))
+    conn.execute('''
+        CREATE TABLE traffic_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp DATETIME,
+            vehicle_count INTEGER, avg_speed REAL, optimization_score REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE health_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp DATETIME, heart_rate INTEGER, systolic_bp INTEGER,
+            diastolic_bp INTEGER, exercise_minutes INTEGER, sleep_hours REAL, health_score INTEGER
+        )
+    ''')
+    rollups.init_tables(conn)
+    rows, stamps, counts, _ = _rows(200)
+    conn.executemany(INSERT, rows)
+    conn.execute(INSERT.replace("?, ?, ?, ?", "NULL, ?, ?, ?"), (99999, 10.0, 1.0))
+    conn.commit()
+
+    rollups.backfill(conn)
+    start = int(stamps[0]) // 3600 * 3600
+    result = rollups.query_history(conn, "traffic_data", start, start + 4 * 3600, step=3600)
+    vehicle = result["metrics"]["vehicle_count"]
+    assert sum(vehicle["count"]) == 200
+    assert max(m for m in vehicle["max"] if m is not None) == counts.max()
+    conn.close()
@@ -0,0 +1,59 @@
+import time
+
+import numpy as np
+import pytest
+
+from src import signal_search
+from src.traffic_network import LOST_TIME_PER_PHASE
+
+
+def test_hcm_delay_matches_formula():
+    flow = np.array([[0.2, 0.0, 0.6, 0.1]])
+    greens = np.array([[20.0, 5.0, 40.0, 15.0]])
+    cycle = 80.0
+    ratio = (greens - LOST_TIME_PER_PHASE) / cycle
+    capacity = 0.5 * ratio
+    x = flow / capacity
+    expected = (0.5 * cycle * (1 - ratio) ** 2 / (1 - np.minimum(x, 1) * ratio)
+                + 225 * ((x - 1) + np.sqrt((x - 1) ** 2 + 4 * x / (capacity * 900))))
+    np.testing.assert_allclose(signal_search.hcm_delay(flow, greens, np.array([cycle])), expected)
+
+
+def test_search_finds_exhaustive_optimum():
+    # 两个有流量的相位：穷举其绿灯分配即可得到最优解
+    demand = np.array([[30, 10, 0, 0]])
+    plan = signal_search.search_network(demand, time_budget_ms=200, workers=1)
+    flow = demand / 60.0
+    best = np.inf
+    for cycle in signal_search.cycle_grid(4):
+        first = np.arange(5.0, cycle - 15.0 + 1e-9, 0.25)
+        greens = np.stack([first, cycle - 10.0 - first, np.full_like(first, 5.0), np.full_like(first, 5.0)], axis=1)
+        best = min(best, signal_search.total_delay(flow, greens, np.full(len(first), cycle)).min())
+    assert plan["total_delay"][0] <= best * (1 + 1e-4)
+    assert plan["greens"][0].sum() == pytest.approx(plan["cycles"][0])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_search_respects_budget_and_beats_webster(workers):
+    demand = np.random.default_rng(0).integers(0, 12, (1200, 4))
+    signal_search.search_network(demand, time_budget_ms=20, workers=workers)
+    started = time.perf_counter()
+    plan = signal_search.search_network(demand, time_budget_ms=150, workers=workers)
+    elapsed = time.perf_counter() - started
+    assert elapsed < 0.15 + 0.1
+    assert plan["total_delay"].sum() <= plan["baseline_total_delay"].sum()
+    assert np.all(plan["greens"] >= signal_search.MIN_GREEN - 1e-6)
+    np.testing.assert_allclose(plan["greens"].sum(axis=1), plan["cycles"])
+    # 同一走廊共用周期
+    assert np.all(plan["cycles"].reshape(-1, 10) == plan["cycles"].reshape(-1, 10)[:, :1])
+
+
+def test_missed_deadline_falls_back_to_proportional_plan():
+    demand = np.random.default_rng(1).integers(0, 12, (600, 4))
+    plan = signal_search.search_network(demand, time_budget_ms=0, workers=1)
+    assert plan["rounds"].max() == 0
+    assert np.all(np.isfinite(plan["total_delay"]))
+
+
+def teardown_module():
+    signal_search.shutdown()
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from src import traffic_sim
+from src.traffic_network import LOST_TIME_PER_PHASE
+
+
+def test_city_street_grid_matches_renderer_roads():
+    for grid_size in (1, 3, 4, 8, 10, 50, 2000):
+        # web/js/advanced-city-renderer.js generateRoads(): for (x = -gridSize; x <= gridSize; x += 4)
+        roads = len(range(-grid_size, grid_size + 1, traffic_sim.CITY_ROAD_SPACING))
+        assert traffic_sim.city_street_grid(grid_size) == (roads, roads)
+
+
+def test_street_grid_links_straight_on_neighbours():
+    downstream = traffic_sim.street_grid(2, 3, 5).reshape(6, 5)
+    # Eastbound from (0, 0) continues into (0, 1); westbound from (0, 0) leaves the grid
+    assert downstream[0, 0] == 1 * 5 + 0
+    assert downstream[0, 2] == -1
+    # Southbound from (0, 2) continues into (1, 2); turn phases always leave
+    assert downstream[2, 1] == 5 * 5 + 1
+    assert (downstream[:, 4] == -1).all()
+
+
+def test_schedule_and_scenarios_share_random_draws():
+    demand = np.full((4, 4), 6.0)
+    plan = np.array([20.0, 25.0, 20.0, 25.0])
+    starts, effective = traffic_sim.signal_schedule(plan[None, None, :])
+    assert starts.ravel().tolist() == [0.0, 20.0, 45.0, 65.0]
+    assert np.allclose(effective.ravel(), np.maximum(plan - LOST_TIME_PER_PHASE, 0.0))
+
+    no_green = np.full(4, LOST_TIME_PER_PHASE)
+    cycles = np.array([[plan.sum()] * 4, [plan.sum()] * 4, [no_green.sum()] * 4])
+    greens = np.array([[plan] * 4, [plan] * 4, [no_green] * 4])
+    result = traffic_sim.simulate(demand, cycles, greens, np.zeros_like(cycles), 2, 2, seconds=300, seed=3)
+
+    for key in ("delay_per_vehicle", "throughput_vph", "network_exits_vph", "mean_entry_queue"):
+        assert result[key][0] == result[key][1]
+    assert result["throughput_vph"][0] > 0
+    # Without effective green nobody crosses a stop line
+    assert result["throughput_vph"][2] == 0
+    assert result["network_exits_vph"][2] == 0
+
+
+def test_sim_cells_counts_vmax_padding():
+    length, vmax = traffic_sim.lane_cells(300.0, traffic_sim.MAX_SPEED_KMH)
+    assert (length, vmax) == (40, 5)
+    assert traffic_sim.sim_cells(2, 3, 4, 300.0, traffic_sim.MAX_SPEED_KMH) == 2 * 3 * 4 * (40 + 5)
+
+
+def test_speed_is_bounded_for_simulation():
+    from fastapi.testclient import TestClient
+    from src.main import app
+
+    client = TestClient(app)
+    plan = {"cycle_seconds": 90, "green_times": [20, 20, 20, 20]}
+    body = {"intersections": 4, "corridor_size": 2, "demand": [10, 5, 10, 5], "plans": [plan], "seconds": 60}
+    at_bound = client.post("/api/traffic/simulate", json={**body, "speed_kmh": traffic_sim.MAX_SPEED_KMH})
+    assert at_bound.status_code == 200
+    assert at_bound.json()["scenarios"][0]["throughput_vph"] > 0
+
+    for path, payload in (("/api/traffic/simulate", body),
+                          ("/api/traffic/optimize", {**body, "simulate": True, "sim_seconds": 60})):
+        response = client.post(path, json={**payload, "speed_kmh": 5000})
+        assert response.status_code == 422
+
+    with pytest.raises(ValueError):
+        traffic_sim.simulate(np.ones((1, 4)), [[90.0]], [[[20.0] * 4]], [[0.0]], 1, 1, speed_kmh=5000)
+
+
+def test_optimize_plans_every_intersection_by_default():
+    from fastapi.testclient import TestClient
+    from src.main import app
+
+    client = TestClient(app)
+    single = client.post("/api/traffic/optimize", json={"demand": [20, 15, 30, 10]})
+    assert single.status_code == 200
+    assert "intersections" not in single.json()
+
+    network_demand = [[20, 15, 30, 10], [2, 2, 2, 2], [30, 5, 30, 5]]
+    network = client.post("/api/traffic/optimize",
+                          json={"intersections": 3, "demand": [20, 15, 30, 10], "network_demand": network_demand})
+    assert network.status_code == 200
+    plans = network.json()["intersections"]
+    assert len(plans) == 3
+    assert plans[0]["green_times"] != plans[1]["green_times"]
+
+    rejected = client.post("/api/traffic/optimize",
+                           json={"intersections": 3, "demand": [20, 15, 30, 10], "mode": "proportional"})
+    assert rejected.status_code == 422
+
+
+def test_simulate_rejects_greens_longer_than_cycle():
+    from fastapi.testclient import TestClient
+    from src.main import app
+
+    client = TestClient(app)
+    body = {"intersections": 1, "demand": [10, 5, 10, 5], "seconds": 60}
+    overfull = {"cycle_seconds": 90, "green_times": [80, 80, 80, 80]}
+    assert client.post("/api/traffic/simulate", json={**body, "plans": [overfull]}).status_code == 422
+    rounded = {"cycle_seconds": 90, "green_times": [22.5, 22.5, 22.5, 22.6]}
+    assert client.post("/api/traffic/simulate", json={**body, "plans": [rounded]}).status_code == 200
@@ -0,0 +1,263 @@
+"""
+交通流量预测：按"周内小时"（168 个时段）做季节性指数平滑，每条新记录 O(1) 更新，
+状态保存在紧凑的 NumPy 数组中，预测只需数组查表，可一次向量化预测所有路口
+"""
+
+import io
+import os
+import time
+import sqlite3
+import threading
+import logging
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+
+from database import parse_insert
+
+logger = logging.getLogger(__name__)
+
+SLOTS = 7 * 24
+# 水平与季节因子的平滑系数
+LEVEL_ALPHA = float(os.getenv("SMART_CITY_FORECAST_ALPHA", "0.1"))
+SEASON_GAMMA = float(os.getenv("SMART_CITY_FORECAST_GAMMA", "0.2"))
+# 某个时段观测次数达到该值后预测才使用其季节因子，之前视为 1
+MIN_SLOT_OBSERVATIONS = 2
+# 路口序列使用自身状态预测所需的最少观测数，不足时用全网季节因子按当前读数外推
+MIN_SERIES_OBSERVATIONS = 24
+
+# 序列 0 为全网（所有读数），路口 k 对应序列 k + 1
+NETWORK_SERIES = 0
+MAX_INTERSECTIONS = 10000
+DEFAULT_PEAK_HOURS = "17:30-19:00"
+
+_STATE_NAME = "traffic"
+
+
+def init_tables(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS forecaster_state (
+            name TEXT PRIMARY KEY,
+            last_row_id INTEGER,
+            state BLOB,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _utc_offset() -> int:
+    return time.localtime().tm_gmtoff
+
+
+def hour_slots(epochs: np.ndarray) -> np.ndarray:
+    """UNIX 秒 -> 本地时间的周内小时（周一 0 点为 0）"""
+    local_hours = (np.asarray(epochs, dtype=np.int64) + _utc_offset()) // 3600
+    # 1970-01-01 是周四，偏移 3 天使周一为 0
+    return (local_hours + 3 * 24) % SLOTS
+
+
+class TrafficForecaster:
+    """乘法季节性指数平滑：level 为去季节化水平，season[h] 为时段 h 的季节因子"""
+
+    def __init__(self, alpha: float = LEVEL_ALPHA, gamma: float = SEASON_GAMMA, capacity: int = 64):
+        self.alpha = alpha
+        self.gamma = gamma
+        self._lock = threading.Lock()
+        self.level = np.zeros(capacity, dtype=np.float64)
+        self.season = np.ones((capacity, SLOTS), dtype=np.float32)
+        self.slot_counts = np.zeros((capacity, SLOTS), dtype=np.uint32)
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.last_row_id = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.level.nbytes + self.season.nbytes + self.slot_counts.nbytes + self.counts.nbytes
+
+    def _ensure(self, series: int):
+        capacity = self.level.shape[0]
+        if series < capacity:
+            return
+        size = max(series + 1, capacity * 2)
+        self.level = np.concatenate([self.level, np.zeros(size - capacity)])
+        self.season = np.concatenate([self.season, np.ones((size - capacity, SLOTS), dtype=np.float32)])
+        self.slot_counts = np.concatenate([self.slot_counts, np.zeros((size - capacity, SLOTS), dtype=np.uint32)])
+        self.counts = np.concatenate([self.counts, np.zeros(size - capacity, dtype=np.int64)])
+
+    def _update(self, series: int, slot: int, value: float):
+        """单条记录的 O(1) 更新（调用方持有锁）"""
+        if self.counts[series] == 0:
+            level = value
+        elif self.slot_counts[series, slot] == 0:
+            # 时段首次出现：季节因子直接取读数相对当前水平的比值，水平保持不变
+            level = self.level[series]
+            if level > 0:
+                self.season[series, slot] = value / level
+        else:
+            factor = float(self.season[series, slot])
+            level = self.alpha * value / max(factor, 1e-6) + (1 - self.alpha) * self.level[series]
+            if level > 0:
+                self.season[series, slot] = self.gamma * (value / level) + (1 - self.gamma) * factor
+        self.level[series] = level
+        self.slot_counts[series, slot] += 1
+        self.counts[series] += 1
+
+    def observe(self, epochs: np.ndarray, values: np.ndarray, intersections: Optional[Sequence[Any]] = None):
+        """按时间顺序吸收一批读数；每条读数更新全网序列，带路口编号的同时更新该路口序列"""
+        slots = hour_slots(epochs).tolist()
+        values = np.asarray(values, dtype=np.float64).tolist()
+        with self._lock:
+            if intersections is not None:
+                intersections = [i if i is not None and 0 <= i < MAX_INTERSECTIONS else None
+                                 for i in intersections]
+                self._ensure(max((i for i in intersections if i is not None), default=-1) + 1)
+            for i, (slot, value) in enumerate(zip(slots, values)):
+                self._update(NETWORK_SERIES, slot, value)
+                if intersections is not None and intersections[i] is not None:
+                    self._update(intersections[i] + 1, slot, value)
+
+    # ==================== 预测 ====================
+
+    def _factors(self, series: np.ndarray, slots: np.ndarray) -> np.ndarray:
+        seen = self.slot_counts[series, slots] >= MIN_SLOT_OBSERVATIONS
+        return np.where(seen, self.season[series, slots], 1.0)
+
+    def forecast(self, current: np.ndarray, intersections: Optional[np.ndarray] = None,
+                 now: Optional[float] = None, hours_ahead: int = 1) -> np.ndarray:
+        """向量化预测 hours_ahead 小时后的车流量
+
+        有足够历史的路口直接查表 level * season；其余按全网季节因子从当前读数外推。
+        """
+        now = time.time() if now is None else now
+        current = np.asarray(current, dtype=np.float64)
+        slot_now = int(hour_slots(np.array([now]))[0])
+        slot_next = (slot_now + hours_ahead) % SLOTS
+        with self._lock:
+            network = np.zeros(1, dtype=np.int64)
+            ratio = (self._factors(network, np.array([slot_next])) /
+                     np.maximum(self._factors(network, np.array([slot_now])), 1e-6))[0]
+            prediction = current * ratio
+            if intersections is not None:
+                ids = np.asarray(intersections, dtype=np.int64)
+                series = ids + 1
+                valid = (ids >= 0) & (series < self.level.shape[0])
+                series = np.where(valid, series, NETWORK_SERIES)
+                trained = valid & (self.counts[series] >= MIN_SERIES_OBSERVATIONS)
+                own = self.level[series] * self._factors(series, np.full(series.shape, slot_next))
+                prediction = np.where(trained, own, prediction)
+        return np.maximum(prediction, 0).round().astype(np.int64)
+
+    def profile(self, series: int = NETWORK_SERIES, now: Optional[float] = None, hours: int = 24) -> np.ndarray:
+        """从当前小时起未来 hours 小时的逐小时预测（用于展示与峰值识别）"""
+        now = time.time() if now is None else now
+        slots = (int(hour_slots(np.array([now]))[0]) + np.arange(hours)) % SLOTS
+        with self._lock:
+            if series >= self.level.shape[0] or self.counts[series] == 0:
+                return np.zeros(hours)
+            series_idx = np.full(hours, series)
+            return self.level[series] * self._factors(series_idx, slots)
+
+    def peak_hours(self, series: int = NETWORK_SERIES, now: Optional[float] = None, window: int = 2) -> str:
+        """今天（本地时间）预测流量最高的连续 window 小时，如 "17:00-19:00"；今天多数时段缺少历史时返回默认值"""
+        now = time.time() if now is None else now
+        midnight = now - (int(now) + _utc_offset()) % 86400
+        slots = (int(hour_slots(np.array([midnight]))[0]) + np.arange(24)) % SLOTS
+        with self._lock:
+            if series >= self.level.shape[0]:
+                return DEFAULT_PEAK_HOURS
+            seen = int((self.slot_counts[series, slots] >= MIN_SLOT_OBSERVATIONS).sum())
+        if seen < 12:
+            return DEFAULT_PEAK_HOURS
+        hourly = self.profile(series, midnight, 24)
+        sums = np.convolve(hourly, np.ones(window), mode="valid")
+        start = int(np.argmax(sums))
+        return f"{start:02d}:00-{(start + window) % 24:02d}:00"
+
+    # ==================== 增量维护与持久化 ====================
+
+    def on_commit(self, sql: str, rows: List[Sequence[Any]]):
+        """写后队列提交回调：吸收新写入的交通读数"""
+        parsed = parse_insert(sql)
+        if parsed is None or parsed[0] != "traffic_data":
+            return
+        columns = parsed[1]
+        if "vehicle_count" not in columns:
+            return
+        idx = columns.index("vehicle_count")
+        if "timestamp" in columns:
+            stamp_idx = columns.index("timestamp")
+            epochs = np.array([row[stamp_idx] for row in rows], dtype="datetime64[s]").astype(np.int64)
+        else:
+            epochs = np.full(len(rows), int(time.time()), dtype=np.int64)
+        intersections = None
+        if "intersection_id" in columns:
+            id_idx = columns.index("intersection_id")
+            intersections = [row[id_idx] for row in rows]
+        self.observe(epochs, [row[idx] for row in rows], intersections)
+
+    def _dump(self) -> bytes:
+        buffer = io.BytesIO()
+        with self._lock:
+            np.savez(buffer, level=self.level, season=self.season,
+                     slot_counts=self.slot_counts, counts=self.counts)
+        return buffer.getvalue()
+
+    def _restore(self, blob: bytes):
+        with np.load(io.BytesIO(blob)) as data:
+            level, season = data["level"], data["season"]
+            slot_counts, counts = data["slot_counts"], data["counts"]
+        if season.shape[1:] != (SLOTS,):
+            raise ValueError("预测模型状态格式不匹配")
+        with self._lock:
+            self.level, self.season = level, season
+            self.slot_counts, self.counts = slot_counts, counts
+
+    def load(self, conn: sqlite3.Connection, chunk_size: int = 50000):
+        """加载保存的状态，再按 id 顺序回放其后写入的记录；无状态时即从全部历史训练"""
+        row = conn.execute(
+            "SELECT last_row_id, state FROM forecaster_state WHERE name = ?", (_STATE_NAME,)
+        ).fetchone()
+        if row is not None:
+            try:
+                self._restore(row[1])
+                self.last_row_id = row[0]
+            except (ValueError, KeyError, OSError) as e:
+                logger.warning(f"预测模型状态无法加载，将重新训练: {str(e)}")
+                self.last_row_id = 0
+
+        cursor = conn.execute('''
+            SELECT id, CAST(strftime('%s', timestamp) AS INTEGER), vehicle_count, intersection_id
+            FROM traffic_data WHERE id > ? ORDER BY id
+        ''', (self.last_row_id,))
+        replayed = 0
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            epochs = np.array([r[1] for r in chunk], dtype=np.int64)
+            self.observe(epochs, [r[2] or 0 for r in chunk], [r[3] for r in chunk])
+            self.last_row_id = chunk[-1][0]
+            replayed += len(chunk)
+        logger.info(f"交通预测模型已就绪: 回放 {replayed} 条记录, 状态 {self.nbytes // 1024} KB")
+
+    def save(self, conn: sqlite3.Connection, last_row_id: Optional[int] = None):
+        """保存状态（在写后队列停止后调用，保证已提交的记录都已被吸收）
+
+        last_row_id 为已吸收到的记录位置；为空时取当前自增序列（单进程时两者一致）。
+        """
+        if last_row_id is None:
+            # 取自增序列而非 MAX(id)：旧数据被归档删除后表可能为空
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'traffic_data'").fetchone()
+            last_row_id = row[0] if row else 0
+        with conn:
+            conn.execute('''
+                INSERT INTO forecaster_state (name, last_row_id, state, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(name) DO UPDATE SET
+                    last_row_id = excluded.last_row_id,
+                    state = excluded.state,
+                    updated_at = excluded.updated_at
+            ''', (_STATE_NAME, last_row_id, self._dump()))
+        self.last_row_id = last_row_id
+
+
+traffic_forecaster = TrafficForecaster()
@@ -1,13 +1,20 @@
 #!/usr/bin/env python3
 """
 Solarpunk Smart City 后端启动脚本
+
+    python start_backend.py                          # 开发模式：安装依赖后以自动重载方式启动
+    python start_backend.py --prod --workers 4       # 生产模式：不安装依赖，预加载后多进程服务
 """
 
 import os
 import sys
+import argparse
 import subprocess
 import time
 
+# 记录启动器启动时刻，用于统计冷启动耗时
+LAUNCHED_AT = time.time()
+
 def install_requirements():
     """安装依赖包"""
     print("🔧 安装Python依赖包...")
@@ -30,7 +37,30 @@ def start_backend():
     except Exception as e:
         print(f"❌ 服务启动失败: {e}")
 
+def start_production(args):
+    """生产模式：不安装依赖、不监视文件，主进程预加载应用后 fork 出多个工作进程"""
+    print(f"🚀 生产模式启动: {args.workers} 个工作进程, 监听 {args.host}:{args.port}")
+    server_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server")
+    os.chdir(server_dir)
+    sys.path.insert(0, server_dir)
+    from prefork import serve
+    return serve(host=args.host, port=args.port, workers=args.workers,
+                 graceful_timeout=args.graceful_timeout, log_level=args.log_level,
+                 launched_at=LAUNCHED_AT)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Solarpunk Smart City 后端服务")
+    parser.add_argument("--prod", action="store_true", help="生产模式：不安装依赖，多进程服务")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="生产模式工作进程数（默认 CPU 核数）")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--graceful-timeout", type=float, default=30.0, help="停止时等待在途请求完成的秒数")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--skip-install", action="store_true", help="开发模式下跳过依赖安装")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     print("=" * 50)
     print("🌱 Solarpunk Smart City 后端服务")
     print("=" * 50)
@@ -40,8 +70,11 @@ def main():
         print("❌ 需要Python 3.8或更高版本")
         sys.exit(1)
     
+    if args.prod:
+        sys.exit(start_production(args))
+    
     # 安装依赖
-    if not install_requirements():
+    if not args.skip_install and not install_requirements():
         sys.exit(1)
     
     print("\n🌐 后端服务将在以下地址启动:")
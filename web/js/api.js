@@ -80,6 +80,142 @@ async function generateCity(seed, gridSize, maxHeight) {
     return await apiCall('/city/generate', 'POST', data);
 }
 
+// 以二进制列式格式生成3D城市，返回零拷贝 TypedArray 视图
+// 第 i 栋建筑的坐标为 x = Math.floor(i / grid_size), z = i % grid_size
+async function generateCityBinary(seed, gridSize, maxHeight) {
+    const data = {
+        seed: parseInt(seed),
+        grid_size: parseInt(gridSize),
+        max_height: parseInt(maxHeight)
+    };
+    
+    const response = await fetch(`${API_BASE_URL}/city/generate?format=binary`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'application/vnd.solarpunk.city'
+        },
+        body: JSON.stringify(data)
+    });
+    if (!response.ok) {
+        const result = await response.json();
+        throw new Error(result.detail || 'API调用失败');
+    }
+    
+    return decodeCityBinary(await response.arrayBuffer());
+}
+
+// 解析二进制城市负载（格式说明见 server/city_binary.py）
+function decodeCityBinary(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== 'SPC1') {
+        throw new Error('无效的城市二进制数据');
+    }
+    const headerLength = view.getUint32(4, true);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+    
+    const arrayTypes = { Uint8Array, Uint16Array, Int32Array, Float32Array };
+    const columns = {};
+    header.columns.forEach(column => {
+        columns[column.name] = new arrayTypes[column.array](buffer, column.offset, column.length);
+    });
+    
+    return { header, columns };
+}
+
+// 流式生成3D城市（NDJSON），每收到一个瓦片即回调，便于渲染器边接收边绘制
+async function generateCityStream(seed, gridSize, maxHeight, onTile, tileSize = null) {
+    const data = {
+        seed: parseInt(seed),
+        grid_size: parseInt(gridSize),
+        max_height: parseInt(maxHeight),
+        tile_size: tileSize ? parseInt(tileSize) : null
+    };
+    
+    const response = await fetch(`${API_BASE_URL}/city/generate/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(data)
+    });
+    if (!response.ok) {
+        const result = await response.json();
+        throw new Error(result.detail || 'API调用失败');
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let header = null;
+    let trailer = null;
+    
+    const handleLine = (line) => {
+        if (!line) return;
+        const message = JSON.parse(line);
+        if (message.type === 'header') {
+            header = message;
+        } else if (message.type === 'tile') {
+            onTile(message);
+        } else if (message.type === 'statistics') {
+            trailer = message;
+        }
+    };
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.forEach(handleLine);
+    }
+    handleLine(buffer);
+    
+    return { header, statistics: trailer?.statistics, sustainable_features: trailer?.sustainable_features };
+}
+
+// 获取城市分级瓦片：bbox 为 [x0, z0, x1, z1]，lod 为空时按 maxCells 自动选择级别（远景取粗粒度聚合）
+async function fetchCityTiles(seed, gridSize, maxHeight, bbox = null, lod = null, maxCells = null) {
+    const params = new URLSearchParams({
+        seed: parseInt(seed),
+        grid_size: parseInt(gridSize),
+        max_height: parseInt(maxHeight)
+    });
+    if (bbox) params.set('bbox', bbox.join(','));
+    if (lod !== null) params.set('lod', parseInt(lod));
+    if (maxCells) params.set('max_cells', parseInt(maxCells));
+    return apiCall(`/city/tiles?${params}`);
+}
+
+// 空间查询：points 为 [[x, z], ...]，radius 可为统一半径或逐点半径列表
+async function querySpatialRadius(seed, gridSize, maxHeight, points, radius) {
+    return apiCall('/city/spatial/radius', 'POST', {
+        seed: parseInt(seed), grid_size: parseInt(gridSize), max_height: parseInt(maxHeight), points, radius
+    });
+}
+
+// 最近绿地：传入 points 批量查询网格点，或传入 buildingType 获取该类型全部建筑的距离分布
+async function querySpatialNearestGreen(seed, gridSize, maxHeight, { points = null, buildingType = null } = {}) {
+    return apiCall('/city/spatial/nearest-green', 'POST', {
+        seed: parseInt(seed), grid_size: parseInt(gridSize), max_height: parseInt(maxHeight),
+        points, building_type: buildingType
+    });
+}
+
+// 太阳能分时模拟：options 可包含 horizon（day/year）、day_of_year、step_minutes、latitude、shading、parallel
+async function simulateCitySolar(seed, gridSize, maxHeight, options = {}) {
+    return apiCall('/city/solar/simulate', 'POST', {
+        seed: parseInt(seed), grid_size: parseInt(gridSize), max_height: parseInt(maxHeight), ...options
+    });
+}
+
+// 多边形查询：polygons 为 [[[x, z], ...], ...]，limit > 0 时同时返回多边形内的建筑
+async function querySpatialPolygon(seed, gridSize, maxHeight, polygons, limit = 0) {
+    return apiCall('/city/spatial/polygon', 'POST', {
+        seed: parseInt(seed), grid_size: parseInt(gridSize), max_height: parseInt(maxHeight), polygons, limit
+    });
+}
+
 // ==================== 区块链API ====================
 
 // 区块链数据存证
@@ -106,8 +242,36 @@ async function getSystemOverview() {
 
 // ==================== 实时数据更新 ====================
 
-// 启动实时数据更新
+// 启动实时数据更新：优先使用服务端推送，不支持时退回轮询
 function startRealtimeUpdates() {
+    const handlers = {};
+    if (document.getElementById('current-vehicles')) handlers.traffic = updateTrafficDisplay;
+    if (document.getElementById('realtime-hr')) handlers.health = updateHealthDisplay;
+    if (document.getElementById('current-block')) handlers.chain = updateBlockchainDisplay;
+    
+    const feeds = Object.keys(handlers);
+    if (feeds.length === 0) {
+        return;
+    }
+    if (!window.EventSource) {
+        startRealtimePolling();
+        return;
+    }
+    
+    const source = new EventSource(`${API_BASE_URL}/realtime/stream?feeds=${feeds.join(',')}`);
+    feeds.forEach(feed => {
+        source.addEventListener(feed, event => handlers[feed](JSON.parse(event.data)));
+    });
+    source.onerror = () => {
+        // 断线时 EventSource 会自动重连；彻底关闭时改为轮询
+        if (source.readyState === EventSource.CLOSED) {
+            startRealtimePolling();
+        }
+    };
+}
+
+// 轮询方式更新实时数据（兼容不支持推送的环境）
+function startRealtimePolling() {
     // 交通数据更新
     if (document.getElementById('current-vehicles')) {
         setInterval(async () => {